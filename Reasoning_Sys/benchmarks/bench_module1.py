@@ -0,0 +1,317 @@
+# bench_module1.py
+"""
+End-to-end benchmark suite for Module 1 and its neighbours.
+
+Starts stub_ollama.py on a free local port, builds a fixture Chroma index
+from fixtures/passages.json (embedded through the stub), then measures:
+  - pipeline:  PipelineService.analyze (extract -> predict -> retrieve -> synthesize)
+  - retrieval: Vector_Search.run_custom_multiquery_retrieval
+  - temporal:  temporal_analysis on a fixture patient timeline
+  - chat:      General_Chat.run_rag_chat (plain chat path)
+
+Each stage runs at several concurrency levels. The JSON report has per-stage
+p50/p95 latency, throughput, the pipeline's per-step timings and peak RSS.
+With --baseline, regressions beyond --tolerance are listed and the exit code
+is 1, so the suite can gate CI or a pre-deploy check.
+
+Usage:
+  python bench_module1.py --out report.json
+  python bench_module1.py --save-baseline baseline.json
+  python bench_module1.py --baseline baseline.json --tolerance 0.2
+  python bench_module1.py --latency-ms 200 --tokens-per-sec 25 --concurrency 1 2 4
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_DIR = os.path.abspath(os.path.join(BENCH_DIR, "..", "pipeline"))
+PROJECT_ROOT = os.path.abspath(os.path.join(BENCH_DIR, "..", ".."))
+FIXTURE_PASSAGES = os.path.join(BENCH_DIR, "fixtures", "passages.json")
+
+CASES = [
+    "I have had a throbbing headache on one side for two days with nausea and light sensitivity.",
+    "Fever and headache since yesterday, my neck feels stiff when I bend it.",
+    "Progressive shortness of breath for 3 days with chest tightness and swollen ankles.",
+    "Cough with fever and fast breathing, sharp pain in my chest when I breathe in.",
+]
+
+
+# --- Stub server ---
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub(args) -> Tuple[subprocess.Popen, str]:
+    port = args.port or _free_port()
+    cmd = [
+        sys.executable, os.path.join(BENCH_DIR, "stub_ollama.py"),
+        "--port", str(port),
+        "--latency-ms", str(args.latency_ms),
+        "--tokens-per-sec", str(args.tokens_per_sec),
+        "--tokens", str(args.tokens),
+        "--embed-latency-ms", str(args.embed_latency_ms),
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{url}/api/tags", timeout=1).read()
+            return proc, url
+        except Exception:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("stub Ollama server did not start")
+
+
+# --- Fixtures ---
+
+def fake_predictor(symptoms: List[str]) -> Dict[str, Any]:
+    return {
+        "top_diseases_by_bucket": {
+            "common": [
+                {"disease": "Migraine", "prob": 0.41},
+                {"disease": "Tension headache", "prob": 0.22},
+                {"disease": "Viral infection", "prob": 0.12},
+            ],
+            "serious": [
+                {"disease": "Meningitis", "prob": 0.08},
+                {"disease": "Heart failure", "prob": 0.05},
+            ],
+        }
+    }
+
+
+def build_fixture_index(persist_dir: str) -> None:
+    """Embed the fixture passages (through the stub) into a fresh Chroma collection."""
+    from langchain_chroma import Chroma
+    from MY_Model import get_embedding_model
+    import Vector_Search
+
+    with open(FIXTURE_PASSAGES, "r", encoding="utf-8") as f:
+        passages = json.load(f)
+
+    store = Chroma(
+        collection_name=Vector_Search.COLLECTION_NAME,
+        persist_directory=persist_dir,
+        embedding_function=get_embedding_model(Vector_Search.EMBEDDING_MODEL),
+    )
+    store.add_texts(
+        texts=[p["text"] for p in passages],
+        metadatas=[{"source": p["source"], "page": 0, "ingest_mode": "benchmark_fixture"} for p in passages],
+        ids=[p["id"] for p in passages],
+    )
+    Vector_Search.CHROMA_DB_PATH = persist_dir
+
+
+def build_fixture_timeline(root: str, user_id: str) -> None:
+    analysis_dir = os.path.join(root, user_id, "analysis")
+    os.makedirs(analysis_dir, exist_ok=True)
+    for i, (day, symptoms) in enumerate([("2026-01-10", ["headache"]), ("2026-03-02", ["headache", "nausea"])]):
+        with open(os.path.join(analysis_dir, f"analysis_module1_{i}.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "timestamp": f"{day}T10:00:00",
+                "analysis_output": {
+                    "symptoms": symptoms,
+                    "recommendation": {"disease": "Migraine", "confidence": 0.4, "bucket": "medium"},
+                },
+            }, f)
+
+
+# --- Measurement ---
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+    except ImportError:
+        try:
+            import psutil
+            info = psutil.Process().memory_info()
+            return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+        except Exception:
+            return None
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return round(ordered[idx], 4)
+
+
+def run_stage(fn: Callable[[Any], Any], inputs: List[Any], levels: List[int], requests_per_level: int) -> Dict[str, Any]:
+    from Metrics import metrics
+
+    out: Dict[str, Any] = {}
+    for c in levels:
+        metrics.reset()
+        latencies: List[float] = []
+        errors: List[str] = []
+
+        def call(i: int):
+            start = time.perf_counter()
+            try:
+                fn(inputs[i % len(inputs)])
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+
+        n = max(requests_per_level, c)
+        wall_start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=c) as ex:
+            list(ex.map(call, range(n)))
+        wall = time.perf_counter() - wall_start
+
+        out[str(c)] = {
+            "requests": n,
+            "errors": len(errors),
+            "first_error": errors[0] if errors else None,
+            "p50_s": _percentile(latencies, 50),
+            "p95_s": _percentile(latencies, 95),
+            "mean_s": round(statistics.mean(latencies), 4) if latencies else None,
+            "throughput_rps": round(len(latencies) / wall, 3) if wall > 0 else None,
+            "step_timings": {k: round(v["avg_s"], 4) for k, v in metrics.snapshot()["timings"].items()},
+        }
+        print(f"  concurrency={c}: p50={out[str(c)]['p50_s']}s p95={out[str(c)]['p95_s']}s "
+              f"throughput={out[str(c)]['throughput_rps']} rps errors={len(errors)}")
+    return out
+
+
+def compare_to_baseline(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions: List[str] = []
+    for stage, levels in report["stages"].items():
+        base_levels = baseline.get("stages", {}).get(stage, {})
+        for level, cur in levels.items():
+            base = base_levels.get(level)
+            if not base:
+                continue
+            if cur.get("p95_s") and base.get("p95_s") and cur["p95_s"] > base["p95_s"] * (1 + tolerance):
+                regressions.append(f"{stage}@{level}: p95 {base['p95_s']}s -> {cur['p95_s']}s")
+            if cur.get("throughput_rps") and base.get("throughput_rps") and cur["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+                regressions.append(f"{stage}@{level}: throughput {base['throughput_rps']} -> {cur['throughput_rps']} rps")
+            if cur.get("errors", 0) > base.get("errors", 0):
+                regressions.append(f"{stage}@{level}: errors {base.get('errors', 0)} -> {cur['errors']}")
+    cur_rss, base_rss = report.get("peak_rss_mb"), baseline.get("peak_rss_mb")
+    if cur_rss and base_rss and cur_rss > base_rss * (1 + tolerance):
+        regressions.append(f"peak RSS {base_rss}MB -> {cur_rss}MB")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Module 1 benchmark suite (stub Ollama + fixture Chroma)")
+    parser.add_argument("--stages", nargs="+", default=["pipeline", "retrieval", "temporal", "chat"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=8, help="Requests per concurrency level")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--tokens", type=int, default=120)
+    parser.add_argument("--embed-latency-ms", type=float, default=5.0)
+    parser.add_argument("--with-llm-cache", action="store_true", help="Leave the LLM response cache enabled")
+    parser.add_argument("--with-retrieval-cache", action="store_true", help="Leave the retrieval result cache enabled")
+    parser.add_argument("--out", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Baseline report to compare against")
+    parser.add_argument("--save-baseline", help="Write this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before flagging")
+    args = parser.parse_args()
+
+    stub, url = start_stub(args)
+    work_dir = tempfile.mkdtemp(prefix="cf_bench_")
+    try:
+        # Configure the pipeline before its modules are imported
+        os.environ["OLLAMA_BASE_URL"] = url
+        os.environ["CASE_ROUTER_AUDIT_LOG"] = os.path.join(work_dir, "routing_audit.jsonl")
+        # Every cache lives in work_dir: cache keys carry model names but not the host, so the
+        # stub's fake vectors and canned rewrites must never reach the production caches,
+        # and each run starts cold so baselines stay reproducible
+        for var, name in (("LLM_CACHE_PATH", "llm_responses.sqlite"), ("EMBED_CACHE_PATH", "embeddings.sqlite"),
+                          ("REWRITE_CACHE_PATH", "rewrites.sqlite"), ("RETRIEVAL_CACHE_PATH", "retrieval.sqlite"),
+                          ("CARL_CACHE_PATH", "carl.sqlite")):
+            os.environ[var] = os.path.join(work_dir, name)
+        if not args.with_llm_cache:
+            os.environ["LLM_CACHE_ENABLED"] = "0"
+        if not args.with_retrieval_cache:
+            os.environ["RETRIEVAL_CACHE_ENABLED"] = "0"
+        for p in (PIPELINE_DIR, PROJECT_ROOT):
+            if p not in sys.path:
+                sys.path.insert(0, p)
+
+        build_fixture_index(os.path.join(work_dir, "chroma"))
+        timeline_root = os.path.join(work_dir, "users")
+        build_fixture_timeline(timeline_root, "BENCH-1")
+
+        from Pipeline_Service import PipelineService
+        from Vector_Search import run_custom_multiquery_retrieval
+        from General_Chat import run_rag_chat
+        from temporal_reasoning.temporal_analysis import temporal_analysis
+
+        service = PipelineService(predictor=fake_predictor)
+        stage_fns: Dict[str, Callable[[Any], Any]] = {
+            "pipeline": lambda text: service.analyze(transcription=text),
+            "retrieval": lambda text: run_custom_multiquery_retrieval(
+                text, ["headache", "fever"], "3 days", [], fake_predictor([])
+            ),
+            "temporal": lambda text: temporal_analysis("BENCH-1", text, user_data_root=timeline_root),
+            "chat": lambda text: run_rag_chat(text),
+        }
+
+        report: Dict[str, Any] = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "save_baseline")},
+            "stages": {},
+        }
+        for stage in args.stages:
+            print(f"[bench] stage={stage}")
+            report["stages"][stage] = run_stage(stage_fns[stage], CASES, args.concurrency, args.requests)
+        report["peak_rss_mb"] = peak_rss_mb()
+        print(f"[bench] peak RSS: {report['peak_rss_mb']} MB")
+
+        exit_code = 0
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+            report["regressions"] = regressions
+            if regressions:
+                exit_code = 1
+                print("[bench] REGRESSIONS:")
+                for r in regressions:
+                    print("  -", r)
+            else:
+                print("[bench] no regressions against baseline")
+
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        if args.save_baseline:
+            with open(args.save_baseline, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        if not args.out and not args.save_baseline:
+            print(json.dumps(report, indent=2))
+        return exit_code
+    finally:
+        stub.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
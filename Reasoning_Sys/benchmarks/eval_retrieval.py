@@ -0,0 +1,372 @@
+# eval_retrieval.py
+"""
+Offline retrieval evaluation harness.
+
+Runs a golden set of clinical queries (each with the passages it should
+retrieve) through Vector_Search.run_custom_multiquery_retrieval and
+alternative retriever configurations, and reports per config:
+  - recall@k (k = 1, 3, 5, 10 by default) and MRR,
+  - context tokens handed to synthesis (estimated, ~4 chars per token),
+  - p50/p95 latency per query.
+
+Two modes:
+  - fixture (default): starts stub_ollama.py and builds one fixture index
+    per chunking setting from fixtures/passages.json, so chunk_size /
+    chunk_overlap can be compared. Each chunk records the passages it
+    overlaps in metadata `passage_ids`.
+  - live (--persist-dir): evaluates an existing Chroma collection against
+    the configured Ollama host. Chunking keys in configs are ignored there.
+
+Golden set: JSON list of
+    {"id", "transcription", "symptoms", "duration", "red_flags",
+     "predictions": [{"disease", "prob"}, ...],
+     "expected": ["fx-002", {"source": "guidelines/hf.pdf", "contains": "natriuretic"}]}
+A string matches a fixture passage id (or chunk id); a dict matches chunks
+by source suffix and/or a case-insensitive substring.
+
+Configs: JSON list of
+    {"name", "retriever": "multiquery" | "dense", "num_queries", "k_per_query",
+     "auto_filter", "query_mode", "chunk_size", "chunk_overlap",
+     "patch": {"Reranker.RERANK_ENABLED": true}}
+`patch` sets module attributes for the duration of the config (only
+constants read at call time have an effect).
+
+Usage:
+  python eval_retrieval.py --out eval.json
+  python eval_retrieval.py --configs my_configs.json --repeats 3
+  python eval_retrieval.py --persist-dir "C:\\CareFusion-AI\\vector of external\\chroma_db_bge_m3" --golden golden.json
+  python eval_retrieval.py --baseline eval_baseline.json --max-recall-drop 0.02
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+from bench_module1 import BENCH_DIR, FIXTURE_PASSAGES, PIPELINE_DIR, PROJECT_ROOT, _percentile, start_stub
+
+FIXTURE_GOLDEN = os.path.join(BENCH_DIR, "fixtures", "golden_queries.json")
+CHARS_PER_TOKEN = 4
+
+DEFAULT_CONFIGS: List[Dict[str, Any]] = [
+    {"name": "default", "num_queries": 3, "k_per_query": 10, "chunk_size": 3000, "chunk_overlap": 300},
+    {"name": "add_new_doc_chunks", "num_queries": 3, "k_per_query": 10, "chunk_size": 4200, "chunk_overlap": 800},
+    {"name": "small_chunks", "num_queries": 3, "k_per_query": 10, "chunk_size": 400, "chunk_overlap": 80},
+    {"name": "k5", "num_queries": 3, "k_per_query": 5, "chunk_size": 400, "chunk_overlap": 80},
+    {"name": "k20", "num_queries": 3, "k_per_query": 20, "chunk_size": 400, "chunk_overlap": 80},
+    {"name": "facet_queries", "query_mode": "facets", "k_per_query": 10, "chunk_size": 400, "chunk_overlap": 80},
+    {"name": "one_rewrite", "num_queries": 1, "k_per_query": 10, "chunk_size": 400, "chunk_overlap": 80},
+    {"name": "auto_filter", "num_queries": 3, "k_per_query": 10, "auto_filter": True, "chunk_size": 400, "chunk_overlap": 80},
+    {"name": "rerank", "num_queries": 3, "k_per_query": 10, "chunk_size": 400, "chunk_overlap": 80,
+     "patch": {"Reranker.RERANK_ENABLED": True}},
+    {"name": "no_score_cutoffs", "num_queries": 3, "k_per_query": 10, "chunk_size": 400, "chunk_overlap": 80,
+     "patch": {"Multi_Query_Retriver.MULTIQUERY_MIN_SCORE": -1.0, "Multi_Query_Retriver.MULTIQUERY_SCORE_GAP": 0,
+               "Multi_Query_Retriver.MULTIQUERY_MAX_TOTAL": 0, "Multi_Query_Retriver.MULTIQUERY_ENOUGH_EVIDENCE": 0}},
+    {"name": "dense_only", "retriever": "dense", "k_per_query": 10, "chunk_size": 400, "chunk_overlap": 80},
+]
+
+
+# --- Fixture indexes ---
+
+def build_eval_index(persist_dir: str, collection_name: str, chunk_size: int, chunk_overlap: int) -> int:
+    """
+    Concatenate the fixture passages per source (one "PDF" each), split them
+    like build_index does and write every side index the retriever reads.
+    """
+    from langchain_chroma import Chroma
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from MY_Model import get_embedding_model, EMBEDDING_MODEL_NAME
+    from Knowledge_Store import record_index_update
+    from Lexical_Index import write_segment
+    from Metadata_Filter import FacetIndex, infer_doc_tags
+    from Near_Dup import add_signatures
+
+    with open(FIXTURE_PASSAGES, "r", encoding="utf-8") as f:
+        passages = json.load(f)
+
+    by_source: Dict[str, List[Dict[str, Any]]] = {}
+    for p in passages:
+        by_source.setdefault(p["source"], []).append(p)
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    chunks = []
+    for source, items in by_source.items():
+        text, spans = "", []
+        for p in items:
+            if text:
+                text += "\n\n"
+            spans.append((len(text), len(text) + len(p["text"]), p["id"]))
+            text += p["text"]
+        meta = {"source": source, "page": 0, "ingest_mode": "eval_fixture", **infer_doc_tags(text, source)}
+        for chunk in splitter.create_documents([text], metadatas=[meta]):
+            start = chunk.metadata["start_index"]
+            end = start + len(chunk.page_content)
+            chunk.metadata["passage_ids"] = ",".join(pid for s, e, pid in spans if s < end and e > start)
+            chunks.append(chunk)
+    add_signatures(chunks)
+
+    ids = [f"{c.metadata['source']}#{i}" for i, c in enumerate(chunks)]
+    store = Chroma(
+        collection_name=collection_name,
+        persist_directory=persist_dir,
+        embedding_function=get_embedding_model(EMBEDDING_MODEL_NAME),
+    )
+    store.add_documents(chunks, ids=ids)
+    write_segment(persist_dir, collection_name, ids, [c.page_content for c in chunks])
+    FacetIndex(persist_dir, collection_name).add(ids, [c.metadata for c in chunks])
+    record_index_update(store, persist_dir, collection_name, EMBEDDING_MODEL_NAME)
+    return len(chunks)
+
+
+# --- Scoring ---
+
+def _matches(doc: Any, expected: Any) -> bool:
+    meta = getattr(doc, "metadata", None) or {}
+    if isinstance(expected, str):
+        return expected in str(meta.get("passage_ids", "")).split(",") or expected == getattr(doc, "id", None)
+    source = expected.get("source")
+    if source and not str(meta.get("source", "")).replace("\\", "/").endswith(source):
+        return False
+    contains = expected.get("contains")
+    if contains and contains.lower() not in (getattr(doc, "page_content", "") or "").lower():
+        return False
+    return bool(source or contains)
+
+
+def score_query(docs: Sequence[Any], expected: Sequence[Any], ks: Sequence[int]) -> Dict[str, Any]:
+    hits: List[Set[int]] = [{j for j, e in enumerate(expected) if _matches(d, e)} for d in docs]
+    recall = {}
+    for k in ks:
+        found: Set[int] = set().union(*hits[:k]) if docs else set()
+        recall[str(k)] = len(found) / len(expected) if expected else 0.0
+    first = next((rank for rank, h in enumerate(hits, start=1) if h), None)
+    chars = sum(len(getattr(d, "page_content", "") or "") for d in docs)
+    return {
+        "recall": recall,
+        "reciprocal_rank": 1.0 / first if first else 0.0,
+        "first_relevant_rank": first,
+        "docs": len(docs),
+        "context_tokens": chars // CHARS_PER_TOKEN,
+    }
+
+
+# --- Running configs ---
+
+@contextlib.contextmanager
+def patched(patch: Optional[Dict[str, Any]]):
+    saved = []
+    try:
+        for dotted, value in (patch or {}).items():
+            module_name, _, attr = dotted.rpartition(".")
+            module = importlib.import_module(module_name)
+            saved.append((module, attr, getattr(module, attr)))
+            setattr(module, attr, value)
+        yield
+    finally:
+        for module, attr, value in reversed(saved):
+            setattr(module, attr, value)
+
+
+def _prediction_for(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {"top_diseases_by_bucket": {"golden": item.get("predictions", [])}}
+
+
+def retrieve(config: Dict[str, Any], item: Dict[str, Any]) -> List[Any]:
+    import Vector_Search
+
+    args = (item["transcription"], item.get("symptoms", []), item.get("duration"),
+            item.get("red_flags", []), _prediction_for(item))
+    k = config.get("k_per_query", 10)
+    if config.get("retriever", "multiquery") == "dense":
+        from Knowledge_Store import get_knowledge_store
+        store = get_knowledge_store(Vector_Search.CHROMA_DB_PATH, Vector_Search.COLLECTION_NAME, Vector_Search.EMBEDDING_MODEL)
+        return store.as_retriever(k).invoke(Vector_Search.build_clinical_query(*args))
+    return Vector_Search.run_custom_multiquery_retrieval(
+        *args,
+        num_queries=config.get("num_queries", 3),
+        k_per_query=k,
+        auto_filter=config.get("auto_filter", Vector_Search.RETRIEVAL_AUTO_FILTER),
+        query_mode=config.get("query_mode", Vector_Search.RETRIEVAL_QUERY_MODE),
+    )
+
+
+def evaluate_config(config: Dict[str, Any], golden: List[Dict[str, Any]], ks: Sequence[int],
+                    repeats: int, warmup: int, per_query: bool) -> Dict[str, Any]:
+    latencies: List[float] = []
+    scored: List[Dict[str, Any]] = []
+    errors: List[str] = []
+
+    with patched(config.get("patch")), contextlib.redirect_stdout(io.StringIO()):
+        for item in golden[:warmup]:
+            try:
+                retrieve(config, item)
+            except Exception:
+                pass
+        for item in golden:
+            docs = None
+            for _ in range(max(1, repeats)):
+                start = time.perf_counter()
+                try:
+                    docs = retrieve(config, item)
+                    latencies.append(time.perf_counter() - start)
+                except Exception as e:
+                    errors.append(f"{item['id']}: {type(e).__name__}: {e}")
+            if docs is not None:
+                scored.append({"id": item["id"], **score_query(docs, item.get("expected", []), ks)})
+
+    n = len(scored)
+    result: Dict[str, Any] = {
+        "queries": len(golden),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "recall_at_k": {str(k): round(sum(s["recall"][str(k)] for s in scored) / n, 4) if n else None for k in ks},
+        "mrr": round(sum(s["reciprocal_rank"] for s in scored) / n, 4) if n else None,
+        "mean_docs": round(statistics.mean(s["docs"] for s in scored), 2) if n else None,
+        "mean_context_tokens": round(statistics.mean(s["context_tokens"] for s in scored), 1) if n else None,
+        "p50_s": _percentile(latencies, 50),
+        "p95_s": _percentile(latencies, 95),
+    }
+    if per_query:
+        result["per_query"] = scored
+    return result
+
+
+def compare_to_baseline(report: Dict[str, Any], baseline: Dict[str, Any], max_recall_drop: float, tolerance: float) -> List[str]:
+    regressions: List[str] = []
+    for name, cur in report["configs"].items():
+        base = baseline.get("configs", {}).get(name)
+        if not base:
+            continue
+        for k, value in cur["recall_at_k"].items():
+            old = base.get("recall_at_k", {}).get(k)
+            if value is not None and old is not None and value < old - max_recall_drop:
+                regressions.append(f"{name}: recall@{k} {old} -> {value}")
+        if cur.get("mrr") is not None and base.get("mrr") is not None and cur["mrr"] < base["mrr"] - max_recall_drop:
+            regressions.append(f"{name}: MRR {base['mrr']} -> {cur['mrr']}")
+        if cur.get("p95_s") and base.get("p95_s") and cur["p95_s"] > base["p95_s"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_s']}s -> {cur['p95_s']}s")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline retrieval evaluation (recall@k, MRR, context tokens, latency)")
+    parser.add_argument("--golden", default=FIXTURE_GOLDEN, help="Golden query set (JSON)")
+    parser.add_argument("--configs", help="Retriever configs (JSON list); defaults to the built-in sweep")
+    parser.add_argument("--only", nargs="+", help="Evaluate only these config names")
+    parser.add_argument("--k", nargs="+", type=int, default=[1, 3, 5, 10])
+    parser.add_argument("--repeats", type=int, default=1, help="Timed runs per query")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed queries per config before measuring")
+    parser.add_argument("--per-query", action="store_true", help="Include per-query scores in the report")
+    parser.add_argument("--persist-dir", help="Evaluate this existing Chroma directory instead of the fixture")
+    parser.add_argument("--collection", default=None, help="Collection name (live mode)")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--embed-latency-ms", type=float, default=2.0)
+    parser.add_argument("--with-caches", action="store_true", help="Use the normal LLM / rewrite / embedding / result caches")
+    parser.add_argument("--out", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Earlier report to compare against")
+    parser.add_argument("--max-recall-drop", type=float, default=0.02, help="Allowed absolute drop in recall@k / MRR")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative p95 slowdown")
+    args = parser.parse_args()
+
+    with open(args.golden, "r", encoding="utf-8") as f:
+        golden = json.load(f)
+    configs = DEFAULT_CONFIGS
+    if args.configs:
+        with open(args.configs, "r", encoding="utf-8") as f:
+            configs = json.load(f)
+    if args.only:
+        configs = [c for c in configs if c["name"] in args.only]
+
+    live = bool(args.persist_dir)
+    stub, url = (None, None) if live else start_stub(args)
+    work_dir = tempfile.mkdtemp(prefix="cf_eval_")
+    try:
+        if url:
+            os.environ["OLLAMA_BASE_URL"] = url
+        if not args.with_caches or not live:
+            # fixture runs embed with the stub: keep its vectors out of the production caches
+            os.environ["REWRITE_CACHE_PATH"] = os.path.join(work_dir, "rewrites.sqlite")
+            os.environ["EMBED_CACHE_PATH"] = os.path.join(work_dir, "embeddings.sqlite")
+            os.environ["LLM_CACHE_PATH"] = os.path.join(work_dir, "llm_responses.sqlite")
+            os.environ["RETRIEVAL_CACHE_PATH"] = os.path.join(work_dir, "retrieval.sqlite")
+        if not args.with_caches:
+            os.environ["LLM_CACHE_ENABLED"] = "0"
+            os.environ["RETRIEVAL_CACHE_ENABLED"] = "0"
+        for p in (PIPELINE_DIR, PROJECT_ROOT):
+            if p not in sys.path:
+                sys.path.insert(0, p)
+
+        import Vector_Search
+        if args.collection:
+            Vector_Search.COLLECTION_NAME = args.collection
+
+        report: Dict[str, Any] = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "mode": "live" if live else "fixture",
+            "golden": os.path.abspath(args.golden),
+            "golden_queries": len(golden),
+            "k": args.k,
+            "repeats": args.repeats,
+            "configs": {},
+            "config_defs": configs,
+        }
+        indexes: Dict[Any, str] = {}
+        for config in configs:
+            if live:
+                Vector_Search.CHROMA_DB_PATH = args.persist_dir
+            else:
+                chunking = (config.get("chunk_size", 3000), config.get("chunk_overlap", 300))
+                if chunking not in indexes:
+                    persist = os.path.join(work_dir, f"chroma-{chunking[0]}-{chunking[1]}")
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        n_chunks = build_eval_index(persist, Vector_Search.COLLECTION_NAME, *chunking)
+                    print(f"[eval] fixture index chunk_size={chunking[0]} overlap={chunking[1]}: {n_chunks} chunks")
+                    indexes[chunking] = persist
+                Vector_Search.CHROMA_DB_PATH = indexes[chunking]
+
+            print(f"[eval] config={config['name']}")
+            result = evaluate_config(config, golden, args.k, args.repeats, args.warmup, args.per_query)
+            report["configs"][config["name"]] = result
+            recall = " ".join(f"R@{k}={v}" for k, v in result["recall_at_k"].items())
+            print(f"  {recall} MRR={result['mrr']} ctx_tokens={result['mean_context_tokens']} "
+                  f"p50={result['p50_s']}s p95={result['p95_s']}s errors={result['errors']}")
+
+        exit_code = 0
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                regressions = compare_to_baseline(report, json.load(f), args.max_recall_drop, args.tolerance)
+            report["regressions"] = regressions
+            if regressions:
+                exit_code = 1
+                print("[eval] REGRESSIONS:")
+                for r in regressions:
+                    print("  -", r)
+            else:
+                print("[eval] no regressions against baseline")
+
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+        return exit_code
+    finally:
+        if stub is not None:
+            stub.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
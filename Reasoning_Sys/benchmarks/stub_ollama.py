@@ -0,0 +1,215 @@
+# stub_ollama.py
+"""
+Local stub of the Ollama HTTP API for benchmarks.
+
+Implements /api/tags, /api/chat, /api/generate, /api/embed and the legacy
+/api/embeddings with configurable injected latency and token rate, so the
+pipeline can be measured repeatably without a GPU or real models.
+
+Responses:
+  - symptom-extraction prompts get a valid SymptomModel JSON object
+  - multi-query rewrite prompts get the requested number of query lines
+  - everything else gets `--tokens` words of filler clinical text
+Embeddings are deterministic hashed bag-of-words vectors (unit length), so
+lexically similar texts land close together in the fixture index.
+
+Usage:
+  python stub_ollama.py --port 11555 --latency-ms 50 --tokens-per-sec 40 --tokens 120
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import re
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBED_DIM = 1024
+FILLER = (
+    "Based on the reported symptoms and the retrieved references the presentation "
+    "is consistent with several possibilities that warrant further clinical evaluation "
+).split()
+
+SYMPTOM_JSON = {
+    "symptoms": ["headache", "fever"],
+    "duration": "3 days",
+    "red_flags": [],
+    "notes": None,
+}
+
+
+def embed_text(text: str, dim: int = EMBED_DIM):
+    vec = [0.0] * dim
+    for tok in re.findall(r"[a-z0-9]+", text.lower()):
+        h = int.from_bytes(hashlib.blake2b(tok.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+class StubConfig:
+    latency_ms = 0.0
+    tokens_per_sec = 0.0
+    tokens = 120
+    embed_latency_ms = 0.0
+
+
+def _completion_for(prompt_text: str):
+    m = re.search(r"rewrite the user's original question into\s+(\d+)", prompt_text)
+    if m:
+        n = int(m.group(1))
+        return [f"clinical query variant {i + 1}\n" for i in range(n)]
+    if "SymptomModel" in prompt_text or "allowed symptom names" in prompt_text:
+        return [json.dumps(SYMPTOM_JSON)]
+    return [FILLER[i % len(FILLER)] + " " for i in range(StubConfig.tokens)]
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    # --- helpers ---
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b"{}"
+        try:
+            return json.loads(body or b"{}")
+        except Exception:
+            return {}
+
+    def _send_json(self, obj, status=200):
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, obj):
+        data = (json.dumps(obj) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _generate(self, body, pieces, make_chunk, make_final):
+        time.sleep(StubConfig.latency_ms / 1000.0)
+        delay = 1.0 / StubConfig.tokens_per_sec if StubConfig.tokens_per_sec > 0 else 0.0
+        start = time.perf_counter()
+        if body.get("stream", True):
+            self._start_chunked()
+            for piece in pieces:
+                if delay:
+                    time.sleep(delay)
+                self._chunk(make_chunk(piece))
+            self._chunk(make_final("", len(pieces), time.perf_counter() - start))
+            self._end_chunked()
+        else:
+            if delay:
+                time.sleep(delay * len(pieces))
+            self._send_json(make_final("".join(pieces), len(pieces), time.perf_counter() - start))
+
+    # --- routes ---
+
+    def do_GET(self):
+        if self.path.startswith("/api/tags"):
+            return self._send_json({"models": []})
+        if self.path.startswith("/api/version"):
+            return self._send_json({"version": "0.0.0-stub"})
+        self._send_json({"error": "not found"}, status=404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = self._read_json()
+        model = body.get("model", "stub")
+
+        if self.path.startswith("/api/chat"):
+            prompt_text = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+            pieces = _completion_for(prompt_text)
+
+            def chunk(piece):
+                return {"model": model, "created_at": _now(), "message": {"role": "assistant", "content": piece}, "done": False}
+
+            def final(content, n, elapsed):
+                return {
+                    "model": model, "created_at": _now(),
+                    "message": {"role": "assistant", "content": content},
+                    "done": True, "done_reason": "stop",
+                    "total_duration": int(elapsed * 1e9), "eval_count": n,
+                    "prompt_eval_count": len(prompt_text.split()),
+                }
+
+            return self._generate(body, pieces, chunk, final)
+
+        if self.path.startswith("/api/generate"):
+            prompt_text = str(body.get("prompt", ""))
+            pieces = _completion_for(prompt_text)
+
+            def chunk(piece):
+                return {"model": model, "created_at": _now(), "response": piece, "done": False}
+
+            def final(content, n, elapsed):
+                return {
+                    "model": model, "created_at": _now(), "response": content,
+                    "done": True, "done_reason": "stop",
+                    "total_duration": int(elapsed * 1e9), "eval_count": n,
+                    "prompt_eval_count": len(prompt_text.split()),
+                }
+
+            return self._generate(body, pieces, chunk, final)
+
+        if self.path.startswith("/api/embed") and not self.path.startswith("/api/embeddings"):
+            inputs = body.get("input", "")
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            time.sleep(StubConfig.embed_latency_ms / 1000.0)
+            return self._send_json({"model": model, "embeddings": [embed_text(t) for t in inputs]})
+
+        if self.path.startswith("/api/embeddings"):
+            time.sleep(StubConfig.embed_latency_ms / 1000.0)
+            return self._send_json({"embedding": embed_text(str(body.get("prompt", "")))})
+
+        self._send_json({"error": "not found"}, status=404)
+
+
+def serve(port: int, latency_ms: float, tokens_per_sec: float, tokens: int, embed_latency_ms: float):
+    StubConfig.latency_ms = latency_ms
+    StubConfig.tokens_per_sec = tokens_per_sec
+    StubConfig.tokens = tokens
+    StubConfig.embed_latency_ms = embed_latency_ms
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    print(f"stub ollama listening on http://127.0.0.1:{port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Ollama server for benchmarks")
+    parser.add_argument("--port", type=int, default=11555)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="0 = as fast as possible")
+    parser.add_argument("--tokens", type=int, default=120, help="Tokens per free-text completion")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    serve(args.port, args.latency_ms, args.tokens_per_sec, args.tokens, args.embed_latency_ms)
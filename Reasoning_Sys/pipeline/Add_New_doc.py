@@ -2,27 +2,30 @@ from pathlib import Path
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
-from langchain_community.embeddings import OllamaEmbeddings
+from MY_Model import get_embedding_model, EMBEDDING_MODEL_NAME
+from Knowledge_Store import record_index_update
+from Lexical_Index import write_segment
+from Near_Dup import add_signatures
+from Metadata_Filter import FacetIndex, infer_doc_tags
+from Parent_Store import CHILD_CHUNK_OVERLAP, CHILD_CHUNK_SIZE, SMALL_TO_BIG_ENABLED, ParentStore, make_children
+from Ingest_Manifest import IngestManifest, chunk_ids_for, config_key, file_digest, remove_file_chunks, source_name
 
 # -------------------------------------------------
 # CONFIG — MUST MATCH EXISTING STORE (DO NOT CHANGE)
 # -------------------------------------------------
 PERSIST_DIR = r"C:\CareFusion-AI\vector of external\chroma_db_bge_m3"
 COLLECTION_NAME = "daily_knowledge"
-EMBED_MODEL = "bge-m3"
+EMBED_MODEL = EMBEDDING_MODEL_NAME
 
 NEW_DOCS_PATH = Path(r"C:\CareFusion-AI\External_knowledger")
 
 # -------------------------------------------------
-# 1. Embeddings (EXACT SAME AS ORIGINAL)
+# 1. Embeddings (EXACT SAME AS ORIGINAL, pooled client)
 # -------------------------------------------------
-embeddings = OllamaEmbeddings(
-    model=EMBED_MODEL,
-    base_url="http://127.0.0.1:11434"
-)
+embeddings = get_embedding_model(EMBED_MODEL)
 
 # -------------------------------------------------
-# 2. Load existing Chroma collection (APPEND ONLY)
+# 2. Load existing Chroma collection
 # -------------------------------------------------
 vectorstore = Chroma(
     collection_name=COLLECTION_NAME,
@@ -35,43 +38,108 @@ print("Existing vector count:", vectorstore._collection.count())
 # -------------------------------------------------
 # 3. Splitter (MUST MATCH ORIGINAL SETTINGS)
 # -------------------------------------------------
+CHUNK_SIZE = 4200
+CHUNK_OVERLAP = 800
 splitter = RecursiveCharacterTextSplitter(
-    chunk_size=4200,
-    chunk_overlap=800,
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+)
+# Anything that changes the chunks or their vectors; a change re-ingests every file
+CHUNK_CONFIG = config_key(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    small_to_big=[CHILD_CHUNK_SIZE, CHILD_CHUNK_OVERLAP] if SMALL_TO_BIG_ENABLED else None,
+    embedding_model=EMBED_MODEL,
 )
 
 # -------------------------------------------------
-# 4. LAZY LOAD + STREAM INGESTION
+# 4. LAZY LOAD + STREAM INGESTION (incremental)
 # -------------------------------------------------
 BATCH_SIZE = 10
-buffer = []
+facets = FacetIndex(PERSIST_DIR, COLLECTION_NAME)
+parent_store = ParentStore(PERSIST_DIR, COLLECTION_NAME) if SMALL_TO_BIG_ENABLED else None
+manifest = IngestManifest(PERSIST_DIR, COLLECTION_NAME)
+skipped = deleted = added = 0
+version = None
+
+
+def flush(buffer, buffer_ids, file_texts):
+    # deterministic ids: Chroma upserts, the facet rows are replaced
+    facets.delete(buffer_ids)
+    vectorstore.add_documents(buffer, ids=buffer_ids)
+    facets.add(buffer_ids, [c.metadata for c in buffer])
+    file_texts.extend(c.page_content for c in buffer)
+    print(f"✅ Added {len(buffer)} chunks")
+    buffer.clear()
+    buffer_ids.clear()
+
+
+for pdf_path in sorted(NEW_DOCS_PATH.rglob("*.pdf")):
+    file_hash = file_digest(str(pdf_path))
+    state, entry = manifest.plan(str(pdf_path), file_hash, CHUNK_CONFIG)
+    if state == "unchanged":
+        skipped += 1
+        continue
+    if state == "duplicate":
+        # same chunks serve both paths; recording this one keeps it "unchanged" next run
+        # and stops a later change to the original from deleting the shared chunks
+        manifest.record_duplicate(str(pdf_path), entry)
+        print(f"⏭️ Same content already ingested as {entry['path']}: {pdf_path}")
+        skipped += 1
+        continue
+    if state == "modified":
+        # replace, never append: drop the previous version's chunks first
+        n = remove_file_chunks(vectorstore, facets, entry, PERSIST_DIR, COLLECTION_NAME, parent_store, manifest)
+        deleted += n
+        print(f"♻️ Modified, removed {n} old chunks (kept if another copy uses them): {pdf_path}")
 
-for pdf_path in NEW_DOCS_PATH.rglob("*.pdf"):
     print(f"📄 Lazy loading: {pdf_path}")
 
     loader = PyPDFLoader(str(pdf_path))
+    source = source_name(pdf_path)
+    doc_tags = None
+    buffer, buffer_ids, file_ids, file_texts = [], [], [], []
 
     # IMPORTANT: lazy_load() yields ONE PAGE AT A TIME
     for page_doc in loader.lazy_load():
         # Enrich metadata (important for traceability)
-        page_doc.metadata["source"] = str(pdf_path)
+        page_doc.metadata["source"] = source
         page_doc.metadata["ingest_mode"] = "lazy_append"
+        # Document-level facets, inferred from the first page (lazy_load yields it first)
+        if doc_tags is None:
+            doc_tags = infer_doc_tags(page_doc.page_content or "", source, page_doc.metadata)
+        page_doc.metadata.update(doc_tags)
 
         # Split page → chunks
         chunks = splitter.split_documents([page_doc])
+        if parent_store is not None:
+            chunks = make_children(chunks, parent_store)
+        add_signatures(chunks)
 
-        for chunk in chunks:
+        for chunk, chunk_id in zip(chunks, chunk_ids_for(file_hash, CHUNK_CONFIG, len(chunks), start=len(file_ids))):
             buffer.append(chunk)
+            buffer_ids.append(chunk_id)
+            file_ids.append(chunk_id)
 
             if len(buffer) >= BATCH_SIZE:
-                vectorstore.add_documents(buffer)
-                print(f"✅ Added {len(buffer)} chunks")
-                buffer.clear()
+                flush(buffer, buffer_ids, file_texts)
+
+    # Flush the file's remaining chunks and write its BM25 segment (re-written
+    # ids supersede older postings, so a retried file is not double-counted)
+    if buffer:
+        flush(buffer, buffer_ids, file_texts)
+    write_segment(PERSIST_DIR, COLLECTION_NAME, file_ids, file_texts)
+    added += len(file_ids)
+    # Bump the index version so warm retrievers pick up the file, and only
+    # then record it: a crash before this point re-ingests the file next run
+    version = record_index_update(vectorstore, PERSIST_DIR, COLLECTION_NAME, EMBED_MODEL)
+    manifest.record(str(pdf_path), file_hash, CHUNK_CONFIG, source, file_ids)
 
-# Flush remaining chunks
-if buffer:
-    vectorstore.add_documents(buffer)
-    print(f"✅ Added final {len(buffer)} chunks")
+print(f"⏭️ Skipped {skipped} unchanged files.")
+if version is None:
+    print("🎯 Nothing to ingest; index unchanged.")
+    raise SystemExit(0)
 
-print("🎯 Ingestion complete.")
+print(f"🎯 Ingestion complete: {added} chunks added, {deleted} replaced chunks removed.")
+print("Index version:", version)
 print("Updated vector count:", vectorstore._collection.count())
@@ -0,0 +1,491 @@
+# Ann_Snapshot.py
+"""
+Immutable, memory-mapped ANN snapshot of a knowledge collection.
+
+Every worker that opens the Chroma collection and searches it loads its own
+copy of the HNSW index into RAM. An exported snapshot is instead a single
+read-only file that all workers map: the OS page cache holds one copy no
+matter how many processes search it. Nothing is parsed at open time except
+the header and the chunk id list.
+
+Index: an inverted file over binary codes (Quantized_Store's 1-bit codes):
+rows are grouped into SNAPSHOT_NLIST clusters, a query probes the
+SNAPSHOT_NPROBE clusters whose centroid code is nearest in Hamming
+distance, shortlists rows by Hamming distance and rescores them exactly
+from the float32 vectors in the same file. Metadata-filtered searches scan
+exactly the allowed rows instead of probing clusters. Either way the
+candidate codes are copied out of the mapping as one buffer and scanned
+in a single pass.
+
+Files, under <persist_dir>/snapshots/<collection>/:
+    ann-<version>.idx     the index (layout below)
+    ann-<version>.chunks  JSONL sidecar, one {"id", "text", "metadata"} per row
+    CURRENT               {"index", "chunks", "source_version", ...}
+
+Index layout (little-endian):
+    header    "<8sIIIIQQQQQQQ": magic, dim, count, nlist, code_bytes,
+              mean_off, centroids_off, list_starts_off, codes_off,
+              vectors_off, spans_off, ids_off
+    mean      float32[dim]
+    centroids nlist x code_bytes
+    starts    uint32[nlist + 1]       rows are stored grouped by cluster
+    codes     count x code_bytes
+    vectors   float32[count x dim]    unit-normalized
+    spans     uint64[count x 2]       (start, end) of each row in the sidecar
+    ids       JSON list of chunk ids
+
+Snapshot files are never modified. An export writes new files and then
+replaces CURRENT atomically; readers notice the new pointer on their next
+poll and map the new files, while searches already running finish on the
+old mapping, which is closed when the last of them returns. Old files are
+removed best-effort (mapped files cannot be deleted on Windows; they are
+retried on the next export).
+
+Usage:
+  python Ann_Snapshot.py export  <persist_dir> <collection> [--if-stale]
+  python Ann_Snapshot.py compare <persist_dir> <collection> --samples 50 --k 10
+"""
+
+import heapq
+import json
+import math
+import mmap
+import operator
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from Metrics import metrics
+from Quantized_Store import QUANT_RESCORE_FACTOR, _encode, _hamming_distances, _normalize, _popcount
+
+ANN_SNAPSHOT_ENABLED = os.environ.get("ANN_SNAPSHOT_ENABLED", "0") not in ("0", "false", "False")
+# 0 = about sqrt(count) clusters
+SNAPSHOT_NLIST = int(os.environ.get("SNAPSHOT_NLIST", "0"))
+SNAPSHOT_NPROBE = int(os.environ.get("SNAPSHOT_NPROBE", "8"))
+SNAPSHOT_TRAIN_ITERS = int(os.environ.get("SNAPSHOT_TRAIN_ITERS", "8"))
+SNAPSHOT_KEEP = int(os.environ.get("SNAPSHOT_KEEP", "2"))
+
+MAGIC = b"ANNSNAP1"
+_HEADER = struct.Struct("<8sIIIIQQQQQQQ")
+
+
+def snapshot_dir(persist_dir: str, collection_name: str) -> str:
+    return os.path.join(persist_dir, "snapshots", collection_name)
+
+
+def read_current(persist_dir: str, collection_name: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(snapshot_dir(persist_dir, collection_name), "CURRENT"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# --- Export ---
+
+def _train_centroids(codes: Sequence[int], nlist: int, dim: int, iters: int) -> List[int]:
+    """k-modes on binary codes: Hamming assignment, per-bit majority update (on a sample)."""
+    rng = random.Random(0)
+    sample = rng.sample(list(codes), min(len(codes), nlist * 32))
+    centroids = rng.sample(sample, nlist)
+    for _ in range(iters):
+        ones = [[0] * dim for _ in range(nlist)]
+        sizes = [0] * nlist
+        for code in sample:
+            c = min(range(nlist), key=lambda j: _popcount(code ^ centroids[j]))
+            sizes[c] += 1
+            bits = ones[c]
+            while code:
+                low = code & -code
+                bits[low.bit_length() - 1] += 1
+                code ^= low
+        for j in range(nlist):
+            if sizes[j]:
+                half = sizes[j] / 2.0
+                centroids[j] = sum(1 << b for b, n in enumerate(ones[j]) if n > half)
+            else:
+                centroids[j] = rng.choice(sample)  # re-seed empty clusters
+    return centroids
+
+
+def _align(f, n: int) -> int:
+    pad = (-f.tell()) % n
+    f.write(b"\0" * pad)
+    return f.tell()
+
+
+def export_snapshot(collection, persist_dir: str, collection_name: str, *, embedding_model: str = "",
+                    source_version: str = "0", nlist: int = SNAPSHOT_NLIST, page_size: int = 500) -> Dict[str, Any]:
+    """Export a Chroma collection to a new snapshot and point CURRENT at it."""
+    out_dir = snapshot_dir(persist_dir, collection_name)
+    os.makedirs(out_dir, exist_ok=True)
+    stem = f"ann-{int(time.time())}-{uuid.uuid4().hex[:6]}"
+    index_path = os.path.join(out_dir, stem + ".idx")
+    chunks_path = os.path.join(out_dir, stem + ".chunks")
+
+    # pass 1: vectors to a scratch file, chunk lines to the sidecar, mean
+    dim, count = 0, 0
+    sums: List[float] = []
+    ids: List[str] = []
+    spans = array("Q")
+    scratch = tempfile.TemporaryFile(dir=out_dir)
+    with open(chunks_path + ".tmp", "wb") as cf:
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+            if not len(page["ids"]):
+                break
+            for chunk_id, emb, text, meta in zip(page["ids"], page["embeddings"], page["documents"], page["metadatas"]):
+                vec = _normalize([float(x) for x in emb])
+                if not dim:
+                    dim, sums = len(vec), [0.0] * len(vec)
+                array("f", vec).tofile(scratch)
+                for i, v in enumerate(vec):
+                    sums[i] += v
+                start = cf.tell()
+                cf.write(json.dumps({"id": chunk_id, "text": text or "", "metadata": meta or {}}, ensure_ascii=False).encode("utf-8") + b"\n")
+                spans.extend((start, cf.tell()))
+                ids.append(chunk_id)
+                count += 1
+            offset += len(page["ids"])
+    if not count:
+        scratch.close()
+        os.remove(chunks_path + ".tmp")
+        raise ValueError(f"Collection {collection_name} is empty; nothing to export.")
+    mean = [s / count for s in sums]
+    code_bytes = (dim + 7) // 8
+
+    # pass 2: binary codes, clusters, row order grouped by cluster
+    scratch.seek(0)
+    codes: List[int] = []
+    for _ in range(count):
+        vec = array("f")
+        vec.fromfile(scratch, dim)
+        codes.append(_encode(vec, mean))
+    nlist = max(1, min(count, nlist or int(math.sqrt(count))))
+    centroids = _train_centroids(codes, nlist, dim, SNAPSHOT_TRAIN_ITERS) if nlist > 1 else [0]
+    assign = [min(range(nlist), key=lambda j: _popcount(code ^ centroids[j])) for code in codes]
+    order = sorted(range(count), key=assign.__getitem__)
+    starts = array("I", [0] * (nlist + 1))
+    for c in assign:
+        starts[c + 1] += 1
+    for j in range(nlist):
+        starts[j + 1] += starts[j]
+
+    scratch_mm = mmap.mmap(scratch.fileno(), 0, access=mmap.ACCESS_READ)
+    row_bytes = dim * 4
+    try:
+        with open(index_path + ".tmp", "wb") as f:
+            f.write(b"\0" * _HEADER.size)
+            mean_off = _align(f, 4)
+            array("f", mean).tofile(f)
+            centroids_off = f.tell()
+            for code in centroids:
+                f.write(code.to_bytes(code_bytes, "little"))
+            list_starts_off = _align(f, 4)
+            starts.tofile(f)
+            codes_off = f.tell()
+            for row in order:
+                f.write(codes[row].to_bytes(code_bytes, "little"))
+            vectors_off = _align(f, 4)
+            for row in order:
+                f.write(scratch_mm[row * row_bytes : (row + 1) * row_bytes])
+            spans_off = _align(f, 8)
+            array("Q", [v for row in order for v in (spans[2 * row], spans[2 * row + 1])]).tofile(f)
+            ids_off = f.tell()
+            f.write(json.dumps([ids[row] for row in order]).encode("utf-8"))
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, dim, count, nlist, code_bytes, mean_off, centroids_off,
+                                 list_starts_off, codes_off, vectors_off, spans_off, ids_off))
+    finally:
+        scratch_mm.close()
+        scratch.close()
+    os.replace(chunks_path + ".tmp", chunks_path)
+    os.replace(index_path + ".tmp", index_path)
+
+    current = {
+        "index": os.path.basename(index_path),
+        "chunks": os.path.basename(chunks_path),
+        "source_version": source_version,
+        "embedding_model": embedding_model,
+        "count": count,
+        "dim": dim,
+        "nlist": nlist,
+        "created_at": time.time(),
+    }
+    pointer = os.path.join(out_dir, "CURRENT")
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(current, f)
+    os.replace(pointer + ".tmp", pointer)
+    _remove_old(out_dir, keep=SNAPSHOT_KEEP)
+    return current
+
+
+def _remove_old(out_dir: str, keep: int) -> None:
+    stems = sorted({name.rsplit(".", 1)[0] for name in os.listdir(out_dir) if name.startswith("ann-")})
+    for stem in stems[:-keep] if keep else stems:
+        for ext in (".idx", ".chunks"):
+            try:
+                os.remove(os.path.join(out_dir, stem + ext))
+            except OSError:
+                pass  # still mapped by a worker (Windows); retried next export
+
+
+# --- Reading ---
+
+class AnnSnapshot:
+    """
+    One mapped snapshot. Read-only and safe to share between threads.
+
+    Searches run inside an in-flight count; once the handle has moved on to
+    a newer snapshot (`retire`), the mapping is closed as soon as that count
+    drops to zero, and later calls on the retired object are served by its
+    successor.
+    """
+
+    def __init__(self, index_path: str, chunks_path: str, info: Optional[Dict[str, Any]] = None):
+        self.path = index_path
+        self.chunks_path = chunks_path
+        self.info = dict(info or {})
+        self.source_version: str = self.info.get("source_version", "0")
+        self._file = open(index_path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.dim, self.count, self.nlist, self.code_bytes, mean_off, self._centroids_off,
+         list_starts_off, self._codes_off, vectors_off, spans_off, ids_off) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not an ANN snapshot: {index_path}")
+        self._view = memoryview(self._mm)
+        self._mean = self._view[mean_off : mean_off + self.dim * 4].cast("f")
+        self._starts = self._view[list_starts_off : list_starts_off + (self.nlist + 1) * 4].cast("I")
+        self._floats = self._view[vectors_off : vectors_off + self.count * self.dim * 4].cast("f")
+        self._spans = self._view[spans_off : spans_off + self.count * 16].cast("Q")
+        self.ids: List[str] = json.loads(self._mm[ids_off:].decode("utf-8"))
+        self._row_of: Optional[Dict[str, int]] = None
+        self._chunk_file = open(chunks_path, "rb")
+        self._chunk_mm = mmap.mmap(self._chunk_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._successor: Optional["AnnSnapshot"] = None
+        self._retired = False
+        self.closed = False
+
+    def __len__(self) -> int:
+        return self.count
+
+    def chunk(self, row: int) -> Dict[str, Any]:
+        return json.loads(self._chunk_mm[self._spans[2 * row] : self._spans[2 * row + 1]])
+
+    def vector(self, row: int) -> List[float]:
+        return list(self._floats[row * self.dim : (row + 1) * self.dim])
+
+    def memory_bytes(self) -> int:
+        # process-private: the id list (codes, vectors and chunks are shared page cache)
+        return sum(len(i) + 8 for i in self.ids)
+
+    def disk_bytes(self) -> int:
+        return os.path.getsize(self.path) + os.path.getsize(self.chunks_path)
+
+    # --- in-flight accounting ---
+
+    def _enter(self) -> "AnnSnapshot":
+        with self._lock:
+            if not self.closed:
+                self._in_flight += 1
+                return self
+            successor = self._successor
+        if successor is None:
+            raise ValueError(f"ANN snapshot {self.path} is closed")
+        return successor._enter()
+
+    def _exit(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            if self._retired and not self._in_flight:
+                self._close_locked()
+
+    def retire(self, successor: Optional["AnnSnapshot"]) -> None:
+        """Hand over to successor; the mapping closes once no search is using it."""
+        with self._lock:
+            self._successor = successor
+            self._retired = True
+            if not self._in_flight:
+                self._close_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_locked()
+
+    def _close_locked(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        for view in (self._mean, self._starts, self._floats, self._spans, self._view):
+            view.release()
+        self._mm.close()
+        self._chunk_mm.close()
+        self._file.close()
+        self._chunk_file.close()
+
+    # --- search ---
+
+    def _rows_for(self, allowed_ids: Set[str]) -> List[int]:
+        if self._row_of is None:
+            self._row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        return sorted(self._row_of[c] for c in allowed_ids if c in self._row_of)
+
+    def _search_rows(self, query: Sequence[float], k: int, allowed_ids: Optional[Set[str]],
+                     nprobe: int, rescore: Optional[int]) -> List[Tuple[int, float]]:
+        if not self.count:
+            return []
+        q = _normalize(query)
+        q_code = _encode(q, self._mean)
+        cb, codes_off, mm = self.code_bytes, self._codes_off, self._mm
+        with metrics.timed("ann_snapshot.first_pass"):
+            # gather the candidate codes into one buffer and scan it in a single pass
+            if allowed_ids is not None:
+                rows = self._rows_for(allowed_ids)
+                codes = b"".join([mm[codes_off + r * cb : codes_off + (r + 1) * cb] for r in rows])
+            else:
+                centroid_dists = _hamming_distances(
+                    mm[self._centroids_off : self._centroids_off + self.nlist * cb], q_code, cb
+                )
+                probe = sorted(heapq.nsmallest(min(self.nlist, max(1, nprobe)), range(self.nlist),
+                                               key=centroid_dists.__getitem__))
+                rows, parts = [], []
+                for j in probe:
+                    start, end = self._starts[j], self._starts[j + 1]
+                    rows.extend(range(start, end))
+                    parts.append(mm[codes_off + start * cb : codes_off + end * cb])
+                codes = b"".join(parts)
+            dists = _hamming_distances(codes, q_code, cb)
+            shortlist = [rows[i] for i in heapq.nsmallest(
+                max(k, rescore or QUANT_RESCORE_FACTOR * k), range(len(rows)), key=dists.__getitem__
+            )]
+        dim, floats = self.dim, self._floats
+        with metrics.timed("ann_snapshot.rescore"):
+            scored = [(r, sum(map(operator.mul, q, floats[r * dim : (r + 1) * dim]))) for r in shortlist]
+        return heapq.nlargest(k, scored, key=lambda t: t[1])
+
+    def search_indices(self, query: Sequence[float], k: int, *, allowed_ids: Optional[Set[str]] = None,
+                       nprobe: int = SNAPSHOT_NPROBE, rescore: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Top-k (row, cosine similarity), best first. Rows index this snapshot's ids."""
+        with self._lock:
+            if self.closed:
+                raise ValueError(f"ANN snapshot {self.path} is closed; rows would not match its successor")
+            self._in_flight += 1
+        try:
+            return self._search_rows(query, k, allowed_ids, nprobe, rescore)
+        finally:
+            self._exit()
+
+    def search(self, query: Sequence[float], k: int, *, allowed_ids: Optional[Set[str]] = None,
+               rescore: Optional[int] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """Top-k ({"id", "text", "metadata"}, cosine similarity), best first."""
+        snap = self._enter()
+        try:
+            hits = snap._search_rows(query, k, allowed_ids, SNAPSHOT_NPROBE, rescore)
+            return [(snap.chunk(r), sim) for r, sim in hits]
+        finally:
+            snap._exit()
+
+    def lookup(self, ids: Sequence[str]) -> Dict[str, Tuple[Dict[str, Any], List[float]]]:
+        """Chunk and stored (unit) vector of each id in the snapshot, keyed by id."""
+        snap = self._enter()
+        try:
+            rows = snap._rows_for(set(ids))
+            return {snap.ids[r]: (snap.chunk(r), snap.vector(r)) for r in rows}
+        finally:
+            snap._exit()
+
+
+class SnapshotHandle:
+    """
+    Per-process handle on a collection's CURRENT snapshot. `current()`
+    re-reads the pointer at most every poll_s seconds and maps the new
+    files when it moves; the previous mapping is retired, so searches
+    still running on it complete before it is closed.
+    """
+
+    def __init__(self, persist_dir: str, collection_name: str, poll_s: float = 2.0):
+        self.dir = snapshot_dir(persist_dir, collection_name)
+        self.poll_s = poll_s
+        self._lock = threading.Lock()
+        self._snapshot: Optional[AnnSnapshot] = None
+        self._pointer_mtime: Optional[float] = None
+        self._last_check = 0.0
+        self.swaps = 0
+
+    def current(self) -> Optional[AnnSnapshot]:
+        now = time.monotonic()
+        if now - self._last_check < self.poll_s:
+            return self._snapshot
+        with self._lock:
+            self._last_check = now
+            try:
+                mtime = os.path.getmtime(os.path.join(self.dir, "CURRENT"))
+            except OSError:
+                return self._snapshot
+            if mtime != self._pointer_mtime:
+                with open(os.path.join(self.dir, "CURRENT"), "r", encoding="utf-8") as f:
+                    info = json.load(f)
+                old = self._snapshot
+                self._snapshot = AnnSnapshot(
+                    os.path.join(self.dir, info["index"]), os.path.join(self.dir, info["chunks"]), info
+                )
+                if old is not None:
+                    old.retire(self._snapshot)
+                self._pointer_mtime = mtime
+                self.swaps += 1
+                metrics.incr("ann_snapshot.swaps")
+                print(f"[Ann_Snapshot] mapped {info['index']} ({info['count']} vectors, {info['nlist']} lists)")
+            return self._snapshot
+
+    def close(self) -> None:
+        with self._lock:
+            if self._snapshot is not None:
+                self._snapshot.close()
+                self._snapshot = None
+            self._pointer_mtime = None
+
+
+if __name__ == "__main__":
+    import argparse
+    from langchain_chroma import Chroma
+    from Knowledge_Store import read_index_info
+    from MY_Model import EMBEDDING_MODEL_NAME
+    from Quantized_Store import compare
+
+    parser = argparse.ArgumentParser(description="Export / check a memory-mapped ANN snapshot of a Chroma collection")
+    parser.add_argument("command", choices=["export", "compare"])
+    parser.add_argument("persist_dir")
+    parser.add_argument("collection")
+    parser.add_argument("--if-stale", action="store_true", help="Export only when the index version moved")
+    parser.add_argument("--nlist", type=int, default=SNAPSHOT_NLIST)
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    store = Chroma(collection_name=args.collection, persist_directory=args.persist_dir)
+    info = read_index_info(args.persist_dir, args.collection)
+    if args.command == "export":
+        if args.if_stale and read_current(args.persist_dir, args.collection).get("source_version") == info.get("version", "0"):
+            print("Snapshot is current; nothing to do.")
+        else:
+            current = export_snapshot(
+                store._collection, args.persist_dir, args.collection,
+                embedding_model=info.get("embedding_model", EMBEDDING_MODEL_NAME),
+                source_version=info.get("version", "0"), nlist=args.nlist,
+            )
+            print(f"Exported {current['count']} vectors to {current['index']} ({current['nlist']} lists)")
+    else:
+        snap = SnapshotHandle(args.persist_dir, args.collection).current()
+        if snap is None:
+            raise SystemExit("No snapshot exported yet.")
+        print(json.dumps(compare(store._collection, snap, args.samples, args.k), indent=2))
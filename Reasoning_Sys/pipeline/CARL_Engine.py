@@ -0,0 +1,237 @@
+# CARL_Engine.py
+"""
+Clinical Advisory Reasoning Loop (CARL) engine.
+
+Answers the 18 advisory questions from CARL_Questions for one case:
+  - the case context is retrieved (and embedded) ONCE and shared by all questions,
+  - questions run concurrently under a bounded LLM concurrency cap,
+  - answers are cached per (case hash, question id), so a re-run only
+    recomputes questions whose inputs changed,
+  - results stream back category by category as each category completes.
+
+Usage:
+  python CARL_Engine.py "<transcript>" --symptoms "headache,fever"
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from CARL_Questions import CARL_QUESTIONS, get_flattened_questions
+from Disk_Cache import DiskLRUCache
+from MY_Model import get_chat_model, CARL_ADVISOR_MODEL
+from MY_Prompt import carl_advisor_template
+from Metrics import metrics
+
+# --- CONFIG ---
+CARL_MAX_CONCURRENCY = int(os.environ.get("CARL_MAX_CONCURRENCY", "3"))
+CARL_CONTEXT_MAX_CHARS = int(os.environ.get("CARL_CONTEXT_MAX_CHARS", "6000"))
+CARL_CACHE_PATH = os.environ.get(
+    "CARL_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "carl_answers.sqlite"),
+)
+CARL_CACHE_MAX_MB = int(os.environ.get("CARL_CACHE_MAX_MB", "64"))
+
+CATEGORY_MARKER = "---CARL_CATEGORY---"
+
+
+def _default_context_retriever(transcript: str, symptoms: Sequence[str]) -> List[Any]:
+    from Vector_Search import run_custom_multiquery_retrieval
+    return run_custom_multiquery_retrieval(transcript, list(symptoms), None, [], "not available")
+
+
+def _docs_to_context(docs: Sequence[Any], max_chars: int) -> str:
+    pieces, total = [], 0
+    for doc in docs or []:
+        text = getattr(doc, "page_content", None) or str(doc)
+        if not text.strip():
+            continue
+        if total + len(text) > max_chars:
+            pieces.append(text[: max(0, max_chars - total)])
+            break
+        pieces.append(text)
+        total += len(text)
+    return "\n\n".join(pieces) if pieces else "No relevant medical knowledge retrieved."
+
+
+class CARLEngine:
+    def __init__(
+        self,
+        *,
+        llm: Any = None,
+        context_retriever: Optional[Callable[[str, Sequence[str]], List[Any]]] = None,
+        max_concurrency: int = CARL_MAX_CONCURRENCY,
+        answer_cache: Optional[DiskLRUCache] = None,
+        questions: Optional[List[Dict[str, str]]] = None,
+    ):
+        self._llm = llm
+        self.context_retriever = context_retriever or _default_context_retriever
+        self.max_concurrency = max(1, max_concurrency)
+        self.answer_cache = answer_cache
+        self.questions = questions or get_flattened_questions()
+        self.model_name = getattr(llm, "model", None) or CARL_ADVISOR_MODEL
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = get_chat_model(model=CARL_ADVISOR_MODEL, temperature=0.2)
+        return self._llm
+
+    @staticmethod
+    def case_hash(transcript: str, symptoms: Sequence[str], context: str, model: str) -> str:
+        payload = json.dumps(
+            {"t": transcript.strip(), "s": sorted(symptoms), "c": context, "m": model},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _answer_key(self, case_hash: str, question: Dict[str, str]) -> str:
+        q_hash = hashlib.sha256(question["question_text"].encode("utf-8")).hexdigest()[:16]
+        return f"{case_hash}:{question['question_id']}:{q_hash}"
+
+    def _answer(self, question: Dict[str, str], transcript: str, symptoms_str: str, context: str) -> str:
+        chain = carl_advisor_template | self.llm
+        with metrics.timed("carl.question"):
+            result = chain.invoke({
+                "question": question["question_text"],
+                "category": question["category_name"],
+                "transcript": transcript,
+                "symptoms": symptoms_str,
+                "context": context,
+            })
+        return getattr(result, "content", None) or str(result)
+
+    def run(
+        self,
+        transcript: str,
+        symptoms: Sequence[str],
+        *,
+        docs: Optional[Sequence[Any]] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yield one result per category, in completion order:
+          {"category", "category_name", "answers": [{question_id, question_text, answer, cached}]}
+        Pass `docs` to reuse an existing retrieval (e.g. Module 1's) instead of retrieving again.
+        """
+        if docs is None:
+            with metrics.timed("carl.retrieve"):
+                docs = self.context_retriever(transcript, symptoms)
+        context = _docs_to_context(docs, CARL_CONTEXT_MAX_CHARS)
+        symptoms_str = ", ".join(symptoms) if symptoms else "None extracted"
+        case_hash = self.case_hash(transcript, symptoms, context, self.model_name)
+
+        by_category: Dict[str, List[Dict[str, str]]] = {}
+        for q in self.questions:
+            by_category.setdefault(q["category_id"], []).append(q)
+        pending = {cat: len(qs) for cat, qs in by_category.items()}
+        answers: Dict[str, Dict[str, Any]] = {}
+        lock = threading.Lock()
+
+        cached = {}
+        if self.answer_cache is not None:
+            keys = {self._answer_key(case_hash, q): q for q in self.questions}
+            cached = {keys[k]["question_id"]: v.decode("utf-8") for k, v in self.answer_cache.get_many(keys).items()}
+
+        def category_result(cat: str) -> Dict[str, Any]:
+            qs = by_category[cat]
+            return {
+                "category": cat,
+                "category_name": qs[0]["category_name"],
+                "answers": [answers[q["question_id"]] for q in qs],
+            }
+
+        def finish(q: Dict[str, str], answer: str, was_cached: bool) -> Optional[str]:
+            with lock:
+                answers[q["question_id"]] = {
+                    "question_id": q["question_id"],
+                    "question_text": q["question_text"],
+                    "answer": answer,
+                    "cached": was_cached,
+                }
+                pending[q["category_id"]] -= 1
+                return q["category_id"] if pending[q["category_id"]] == 0 else None
+
+        to_run = []
+        for q in self.questions:
+            if q["question_id"] in cached:
+                metrics.incr("carl.answers.cached")
+                done_cat = finish(q, cached[q["question_id"]], True)
+                if done_cat:
+                    yield category_result(done_cat)
+            else:
+                to_run.append(q)
+
+        if not to_run:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(to_run))) as executor:
+            futures = {executor.submit(self._answer, q, transcript, symptoms_str, context): q for q in to_run}
+            for fut in as_completed(futures):
+                q = futures[fut]
+                try:
+                    answer = fut.result()
+                    metrics.incr("carl.answers.computed")
+                    if self.answer_cache is not None:
+                        self.answer_cache.set(self._answer_key(case_hash, q), answer.encode("utf-8"))
+                except Exception as e:
+                    traceback.print_exc()
+                    metrics.incr("carl.answers.failed")
+                    answer = f"Advisory generation failed: {e}"
+                done_cat = finish(q, answer, False)
+                if done_cat:
+                    yield category_result(done_cat)
+
+
+_answer_cache: Optional[DiskLRUCache] = None
+
+
+def get_carl_answer_cache() -> DiskLRUCache:
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = DiskLRUCache(CARL_CACHE_PATH, max_bytes=CARL_CACHE_MAX_MB * 1024 * 1024, name="carl")
+    return _answer_cache
+
+
+def run_carl(transcript: str, symptoms: Sequence[str], docs: Optional[Sequence[Any]] = None) -> List[Dict[str, Any]]:
+    """Convenience wrapper: run all categories and return them in CARL_QUESTIONS order."""
+    engine = CARLEngine(answer_cache=get_carl_answer_cache())
+    results = {r["category"]: r for r in engine.run(transcript, symptoms, docs=docs)}
+    return [results[c["category"]] for c in CARL_QUESTIONS if c["category"] in results]
+
+
+if __name__ == "__main__":
+    import argparse
+    from MY_Model import get_client_metrics
+
+    parser = argparse.ArgumentParser(description="Run the CARL advisory question set for one case")
+    parser.add_argument("transcript", help="Patient transcript text")
+    parser.add_argument("--symptoms", default="", help="Comma-separated extracted symptoms")
+    args = parser.parse_args()
+
+    if sys.stdout.encoding != 'utf-8':
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+    symptoms = [s.strip() for s in args.symptoms.split(",") if s.strip()]
+    engine = CARLEngine(answer_cache=get_carl_answer_cache())
+    categories = []
+    try:
+        for category in engine.run(args.transcript, symptoms):
+            # Stream each completed category to the caller as it becomes available
+            print(CATEGORY_MARKER + json.dumps(category), flush=True)
+            categories.append(category)
+    except Exception as e:
+        print("---PIPELINE_ERROR---")
+        print(str(e))
+        sys.exit(1)
+
+    order = [c["category"] for c in CARL_QUESTIONS]
+    categories.sort(key=lambda c: order.index(c["category"]))
+    print("---PIPELINE_OUTPUT_START---")
+    print(json.dumps({"categories": categories, "metrics": get_client_metrics()}))
+    print("---PIPELINE_OUTPUT_END---")
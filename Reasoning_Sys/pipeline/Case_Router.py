@@ -0,0 +1,148 @@
+# Case_Router.py
+"""
+Tiered model routing for Module 1.
+
+Scores how complex a case is from the structured symptom output, the
+top-5 disease predictions and the transcript, then picks the synthesis
+tier:
+  - "fast": small model + compact prompt (one/two symptom, unambiguous cases)
+  - "full": FINAL_LLM_MODEL + full A–K prompt (complex or any red flag)
+
+Every decision is appended to a JSONL audit log together with the
+synthesis latency it produced, so routing thresholds can be tuned.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+from pydantic import BaseModel, Field
+
+from MY_Model import FAST_LLM_MODEL, FINAL_LLM_MODEL
+from Metrics import metrics
+
+# --- CONFIG ---
+COMPLEXITY_THRESHOLD = float(os.environ.get("CASE_ROUTER_THRESHOLD", "0.45"))
+ROUTING_AUDIT_LOG = os.environ.get(
+    "CASE_ROUTER_AUDIT_LOG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "routing_audit.jsonl"),
+)
+
+# Normalisation points: at or above these, a factor contributes its full weight
+SYMPTOM_COUNT_SATURATION = 6
+TRANSCRIPT_WORDS_SATURATION = 250
+PROB_SPREAD_SATURATION = 0.30   # top1 - top2 gap considered "clear-cut"
+
+WEIGHTS = {"symptom_count": 0.35, "ambiguity": 0.35, "transcript_length": 0.30}
+
+_audit_lock = threading.Lock()
+
+
+class RoutingDecision(BaseModel):
+    tier: str = Field(..., description="'fast' or 'full'")
+    model: str
+    prompt: str = Field(..., description="Name of the synthesis prompt template used")
+    score: float
+    threshold: float
+    reason: str
+    factors: Dict[str, Any] = Field(default_factory=dict)
+
+
+def score_case_complexity(
+    symptoms: Sequence[str],
+    red_flags: Optional[Sequence[str]],
+    top_predictions: List[Dict[str, Any]],
+    transcript: str,
+) -> Dict[str, Any]:
+    """
+    Return a 0..1 complexity score and the factors behind it.
+    """
+    n_symptoms = len(symptoms or [])
+    n_red_flags = len(red_flags or [])
+    words = len((transcript or "").split())
+
+    probs = sorted((float(p.get("prob", 0.0)) for p in top_predictions or []), reverse=True)
+    if len(probs) >= 2:
+        spread = probs[0] - probs[1]
+    elif probs:
+        spread = probs[0]
+    else:
+        spread = 0.0
+    # No predictions at all is as ambiguous as it gets
+    ambiguity = 1.0 - min(spread / PROB_SPREAD_SATURATION, 1.0)
+
+    symptom_factor = min(n_symptoms / SYMPTOM_COUNT_SATURATION, 1.0)
+    length_factor = min(words / TRANSCRIPT_WORDS_SATURATION, 1.0)
+
+    score = (
+        WEIGHTS["symptom_count"] * symptom_factor
+        + WEIGHTS["ambiguity"] * ambiguity
+        + WEIGHTS["transcript_length"] * length_factor
+    )
+    return {
+        "score": round(score, 4),
+        "symptom_count": n_symptoms,
+        "red_flag_count": n_red_flags,
+        "top_prob_spread": round(spread, 4),
+        "top5_prob_range": round(probs[0] - probs[-1], 4) if probs else None,
+        "transcript_words": words,
+    }
+
+
+def route_case(
+    symptoms: Sequence[str],
+    red_flags: Optional[Sequence[str]],
+    top_predictions: List[Dict[str, Any]],
+    transcript: str,
+    *,
+    threshold: float = COMPLEXITY_THRESHOLD,
+) -> RoutingDecision:
+    factors = score_case_complexity(symptoms, red_flags, top_predictions, transcript)
+    score = factors["score"]
+
+    if factors["red_flag_count"] > 0:
+        tier, reason = "full", "red flags present"
+    elif score >= threshold:
+        tier, reason = "full", f"complexity {score:.2f} >= {threshold:.2f}"
+    else:
+        tier, reason = "fast", f"complexity {score:.2f} < {threshold:.2f}"
+
+    decision = RoutingDecision(
+        tier=tier,
+        model=FINAL_LLM_MODEL if tier == "full" else FAST_LLM_MODEL,
+        prompt="final_prompt_template" if tier == "full" else "compact_final_prompt_template",
+        score=score,
+        threshold=threshold,
+        reason=reason,
+        factors=factors,
+    )
+    metrics.incr(f"module1.routing.{tier}")
+    print(f"[Case_Router] tier={tier} model={decision.model} ({reason})")
+    return decision
+
+
+def log_routing_decision(
+    decision: RoutingDecision,
+    *,
+    synthesis_latency_s: Optional[float] = None,
+    ttft_s: Optional[float] = None,
+) -> None:
+    """Append the decision and its latency impact to the routing audit log."""
+    metrics_name = f"module1.synthesis.{decision.tier}"
+    if synthesis_latency_s is not None:
+        metrics.observe(metrics_name, synthesis_latency_s)
+
+    entry = {
+        "timestamp": datetime.utcnow().isoformat(),
+        **decision.model_dump(),
+        "synthesis_latency_s": synthesis_latency_s,
+        "ttft_s": ttft_s,
+    }
+    try:
+        os.makedirs(os.path.dirname(ROUTING_AUDIT_LOG), exist_ok=True)
+        with _audit_lock, open(ROUTING_AUDIT_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+    except Exception as e:
+        print(f"[Case_Router] could not write audit log: {e}")
@@ -0,0 +1,390 @@
+# Client_Registry.py
+"""
+Shared Ollama client layer.
+
+All ChatOllama / OllamaEmbeddings instances used by the pipeline are handed
+out from here so that:
+  - every instance talks to Ollama through one keep-alive HTTP pool per
+    (host, timeout) instead of opening its own session (async pools are
+    additionally per event loop: httpx connections belong to the loop
+    that opened them),
+  - identical model configurations are built once and reused,
+  - each model has a concurrency cap (a busy CPU node cannot usefully run
+    more than a couple of generations at once),
+  - request / connection counters are visible through Metrics.
+
+Configuration comes from environment variables so the backend, the worker
+scripts and the ingestion tools all agree on one host.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from ollama import AsyncClient, Client
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+
+from Metrics import metrics
+
+# --- Shared configuration ---
+
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_CONNECTIONS", "16"))
+OLLAMA_MAX_KEEPALIVE = int(os.environ.get("OLLAMA_MAX_KEEPALIVE", "8"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.environ.get("OLLAMA_KEEPALIVE_EXPIRY", "120"))
+# Default number of in-flight requests allowed per model
+OLLAMA_MODEL_CONCURRENCY = int(os.environ.get("OLLAMA_MODEL_CONCURRENCY", "2"))
+# Per-model overrides, e.g. "MedAIBase/MedGemma1.5:4b=1,bge-m3:latest=4"
+OLLAMA_MODEL_CONCURRENCY_OVERRIDES = os.environ.get("OLLAMA_MODEL_CONCURRENCY_OVERRIDES", "")
+# How long a successful server health check is trusted
+OLLAMA_HEALTH_TTL = float(os.environ.get("OLLAMA_HEALTH_TTL", "60"))
+# Async slot waiters poll the (thread-shared) model semaphore, backing off up to this interval
+OLLAMA_SLOT_POLL_MAX_S = float(os.environ.get("OLLAMA_SLOT_POLL_MAX_S", "0.05"))
+
+
+def _parse_overrides(raw: str) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        name, _, value = item.rpartition("=")
+        try:
+            out[name.strip()] = max(1, int(value))
+        except ValueError:
+            continue
+    return out
+
+
+def _freeze(kwargs: Dict[str, Any]) -> Tuple:
+    return tuple(sorted((k, repr(v)) for k, v in kwargs.items()))
+
+
+class ClientRegistry:
+    """
+    Process-wide registry of pooled Ollama clients and model wrappers.
+    """
+
+    def __init__(
+        self,
+        base_url: str = OLLAMA_BASE_URL,
+        *,
+        max_connections: int = OLLAMA_MAX_CONNECTIONS,
+        max_keepalive: int = OLLAMA_MAX_KEEPALIVE,
+        keepalive_expiry: float = OLLAMA_KEEPALIVE_EXPIRY,
+        default_concurrency: int = OLLAMA_MODEL_CONCURRENCY,
+        concurrency_overrides: Optional[Dict[str, int]] = None,
+    ):
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.default_concurrency = max(1, default_concurrency)
+        self.concurrency_overrides = dict(concurrency_overrides or {})
+
+        self._lock = threading.Lock()
+        self._sync_clients: Dict[Tuple[str, Optional[float]], Client] = {}
+        # (id(loop), host, timeout) -> (loop, client); the loop is kept so its id
+        # cannot be reused while the entry exists, and closed loops are pruned
+        self._async_clients: Dict[Tuple[int, str, Optional[float]], Tuple[asyncio.AbstractEventLoop, AsyncClient]] = {}
+        self._models: Dict[Tuple, Any] = {}
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._last_healthy: Dict[str, float] = {}
+
+    # --- HTTP pools ---
+
+    def _on_request(self, request: httpx.Request) -> None:
+        metrics.incr("ollama.http.requests")
+        metrics.incr(f"ollama.http.requests.{request.url.path}")
+
+    def _on_response(self, response: httpx.Response) -> None:
+        metrics.incr("ollama.http.responses")
+        if response.status_code >= 400:
+            metrics.incr("ollama.http.errors")
+
+    async def _aon_request(self, request: httpx.Request) -> None:
+        self._on_request(request)
+
+    async def _aon_response(self, response: httpx.Response) -> None:
+        self._on_response(response)
+
+    def sync_client(self, base_url: Optional[str] = None, timeout: Optional[float] = None) -> Client:
+        key = (base_url or self.base_url, timeout)
+        with self._lock:
+            client = self._sync_clients.get(key)
+            if client is None:
+                client = Client(
+                    host=key[0],
+                    timeout=timeout,
+                    limits=self.limits,
+                    event_hooks={"request": [self._on_request], "response": [self._on_response]},
+                )
+                self._sync_clients[key] = client
+                metrics.incr("ollama.pools.created")
+            return client
+
+    def async_client(self, base_url: Optional[str] = None, timeout: Optional[float] = None) -> AsyncClient:
+        """
+        Pooled AsyncClient for the running event loop. Must be called from
+        inside that loop; pools of loops that have since closed are dropped.
+        """
+        loop = asyncio.get_running_loop()
+        key = (id(loop), base_url or self.base_url, timeout)
+        with self._lock:
+            self._prune_async_clients()
+            entry = self._async_clients.get(key)
+            if entry is None:
+                client = AsyncClient(
+                    host=key[1],
+                    timeout=timeout,
+                    limits=self.limits,
+                    event_hooks={"request": [self._aon_request], "response": [self._aon_response]},
+                )
+                entry = self._async_clients[key] = (loop, client)
+                metrics.incr("ollama.pools.created")
+            return entry[1]
+
+    def _prune_async_clients(self) -> None:
+        # caller holds self._lock; a closed loop's connections cannot be reused or awaited
+        for key in [k for k, (loop, _) in self._async_clients.items() if loop.is_closed()]:
+            del self._async_clients[key]
+            metrics.incr("ollama.pools.dropped")
+
+    def ensure_server(self, base_url: Optional[str] = None, retries: int = 2) -> None:
+        """
+        Check the Ollama server is reachable. A success is cached for
+        OLLAMA_HEALTH_TTL seconds so hot paths do not pay a round-trip per call.
+        """
+        host = base_url or self.base_url
+        if time.monotonic() - self._last_healthy.get(host, -OLLAMA_HEALTH_TTL) < OLLAMA_HEALTH_TTL:
+            return
+
+        client = self.sync_client(host, timeout=15)
+        for attempt in range(retries + 1):
+            try:
+                client.list()
+                self._last_healthy[host] = time.monotonic()
+                return
+            except Exception as e:
+                if attempt < retries:
+                    time.sleep(2)
+                    continue
+                raise RuntimeError(
+                    f"Ollama server is unresponsive or not running (Error: {type(e).__name__}). "
+                    "Please ensure the Ollama application is active and not hung."
+                )
+
+    # --- Concurrency caps ---
+
+    def _semaphore(self, model: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = self._semaphores.get(model)
+            if sem is None:
+                limit = self.concurrency_overrides.get(model, self.default_concurrency)
+                sem = self._semaphores[model] = threading.BoundedSemaphore(limit)
+            return sem
+
+    @contextmanager
+    def slot(self, model: str):
+        sem = self._semaphore(model)
+        if not sem.acquire(blocking=False):
+            metrics.incr("ollama.slots.waits")
+            start = time.perf_counter()
+            sem.acquire()
+            metrics.observe("ollama.slots.wait", time.perf_counter() - start)
+        metrics.incr(f"ollama.model_calls.{model}")
+        try:
+            yield
+        finally:
+            sem.release()
+
+    @asynccontextmanager
+    async def aslot(self, model: str):
+        """
+        Async counterpart of slot(). The cap is shared with sync callers, so
+        it stays a threading semaphore; waiters poll it with non-blocking
+        acquires instead of parking an executor thread on it. A waiter that
+        is cancelled (e.g. the SSE client disconnected) simply stops polling
+        and never ends up holding a slot nobody releases.
+        """
+        sem = self._semaphore(model)
+        if not sem.acquire(blocking=False):
+            metrics.incr("ollama.slots.waits")
+            start = time.perf_counter()
+            delay = 0.001
+            while not sem.acquire(blocking=False):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, OLLAMA_SLOT_POLL_MAX_S)
+            metrics.observe("ollama.slots.wait", time.perf_counter() - start)
+        metrics.incr(f"ollama.model_calls.{model}")
+        try:
+            yield
+        finally:
+            sem.release()
+
+    # --- Model wrappers ---
+
+    def _attach(self, instance, base_url: Optional[str], timeout: Optional[float]):
+        # Swap the per-instance clients created by langchain_ollama for the shared pools;
+        # the async side resolves the pool of whichever loop the call runs on
+        instance._client = self.sync_client(base_url, timeout)
+        instance._async_client = _LoopAsyncClient(self, base_url, timeout)
+        return instance
+
+    def chat(self, *, model: str, base_url: Optional[str] = None, timeout: Optional[float] = None, **kwargs) -> "PooledChatOllama":
+        key = ("chat", model, base_url or self.base_url, timeout, _freeze(kwargs))
+        with self._lock:
+            llm = self._models.get(key)
+        if llm is None:
+            llm = PooledChatOllama(model=model, base_url=base_url or self.base_url, **kwargs)
+            self._attach(llm, base_url, timeout)
+            with self._lock:
+                llm = self._models.setdefault(key, llm)
+        return llm
+
+    def embeddings(self, *, model: str, base_url: Optional[str] = None, timeout: Optional[float] = None) -> "PooledOllamaEmbeddings":
+        key = ("embeddings", model, base_url or self.base_url, timeout)
+        with self._lock:
+            emb = self._models.get(key)
+        if emb is None:
+            emb = PooledOllamaEmbeddings(model=model, base_url=base_url or self.base_url)
+            self._attach(emb, base_url, timeout)
+            with self._lock:
+                emb = self._models.setdefault(key, emb)
+        return emb
+
+    # --- Introspection ---
+
+    def stats(self) -> Dict[str, Any]:
+        pools = {}
+        with self._lock:
+            self._prune_async_clients()
+            clients = [("sync", host, timeout, client) for (host, timeout), client in self._sync_clients.items()]
+            clients += [
+                (f"async[loop={loop_id:x}]", host, timeout, client)
+                for (loop_id, host, timeout), (_, client) in self._async_clients.items()
+            ]
+        for kind, host, timeout, client in clients:
+            entry = {"open_connections": None, "idle_connections": None}
+            try:
+                conns = client._client._transport._pool.connections
+                entry["open_connections"] = len(conns)
+                entry["idle_connections"] = sum(1 for c in conns if c.is_idle())
+            except Exception:
+                pass
+            pools[f"{kind}:{host}:timeout={timeout}"] = entry
+        return {
+            "base_url": self.base_url,
+            "models_cached": len(self._models),
+            "concurrency": {
+                name: self.concurrency_overrides.get(name, self.default_concurrency)
+                for name in self._semaphores
+            },
+            "pools": pools,
+        }
+
+
+class _LoopAsyncClient:
+    """
+    Stand-in for a model's AsyncClient: every attribute lookup (e.g.
+    `await self._async_client.chat(...)`) is forwarded to the registry pool
+    of the event loop the call is running on, so one cached model can be
+    awaited from the run_sync bridge loop and from the backend's own loop.
+    """
+
+    def __init__(self, registry: ClientRegistry, base_url: Optional[str], timeout: Optional[float]):
+        self._registry = registry
+        self._base_url = base_url
+        self._timeout = timeout
+
+    def __getattr__(self, name: str):
+        return getattr(self._registry.async_client(self._base_url, self._timeout), name)
+
+
+class PooledChatOllama(ChatOllama):
+    """ChatOllama that holds a registry slot for the duration of each call."""
+
+    def _generate(self, *args, **kwargs):
+        with get_registry().slot(self.model):
+            return super()._generate(*args, **kwargs)
+
+    def _stream(self, *args, **kwargs):
+        with get_registry().slot(self.model):
+            yield from super()._stream(*args, **kwargs)
+
+    async def _agenerate(self, *args, **kwargs):
+        async with get_registry().aslot(self.model):
+            return await super()._agenerate(*args, **kwargs)
+
+    async def _astream(self, *args, **kwargs):
+        async with get_registry().aslot(self.model):
+            async for chunk in super()._astream(*args, **kwargs):
+                yield chunk
+
+
+class PooledOllamaEmbeddings(OllamaEmbeddings):
+    """OllamaEmbeddings with per-model concurrency caps (embed_query delegates here)."""
+
+    def embed_documents(self, texts):
+        with get_registry().slot(self.model):
+            return super().embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        async with get_registry().aslot(self.model):
+            return await super().aembed_documents(texts)
+
+
+_registry: Optional[ClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ClientRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ClientRegistry(
+                    concurrency_overrides=_parse_overrides(OLLAMA_MODEL_CONCURRENCY_OVERRIDES)
+                )
+                metrics.register_collector("ollama_clients", _registry.stats)
+    return _registry
+
+
+# --- Sync -> async bridge ---
+
+_bridge_loop: Optional[asyncio.AbstractEventLoop] = None
+_bridge_lock = threading.Lock()
+
+
+def _get_bridge_loop() -> asyncio.AbstractEventLoop:
+    global _bridge_loop
+    if _bridge_loop is None:
+        with _bridge_lock:
+            if _bridge_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="ollama-bridge-loop", daemon=True).start()
+                _bridge_loop = loop
+    return _bridge_loop
+
+
+def run_sync(coro):
+    """
+    Run a coroutine to completion from synchronous code.
+
+    AsyncClient pools are kept per event loop, so sync callers (CLI
+    scripts, worker threads) all run their coroutines on one long-lived
+    bridge loop and keep reusing its pool instead of opening a fresh one
+    for a fresh `asyncio.run` loop per call. Must not be called from inside a running
+    event loop; await the coroutine there instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run_coroutine_threadsafe(coro, _get_bridge_loop()).result()
+    coro.close()
+    raise RuntimeError("run_sync called inside a running event loop; await the coroutine instead")
@@ -0,0 +1,214 @@
+# Disk_Cache.py
+"""
+Embedded on-disk key/value cache with size-bounded LRU eviction.
+
+Backed by a single SQLite file (WAL mode) so several worker processes on
+the same node can share it. Values are raw bytes; callers choose the
+serialization. Hits, misses and evictions are reported through Metrics
+under `cache.<name>.*`.
+
+Reads do not write: a hit only records its access time in memory, and the
+buffered times are written in one batch on the next `set` (before any
+eviction), or once _TOUCH_FLUSH_EVERY hits or _TOUCH_FLUSH_S seconds have
+gone by. Touches not yet flushed when a process exits are lost, which only
+makes the LRU order slightly less exact.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from Metrics import metrics
+
+# Recompute the on-disk total every N writes (other processes may write too)
+_RESYNC_EVERY = 200
+# Write buffered access times after this many hits or seconds, whichever comes first
+_TOUCH_FLUSH_EVERY = 256
+_TOUCH_FLUSH_S = 30.0
+
+
+class DiskLRUCache:
+    def __init__(self, path: str, *, max_bytes: int, name: str = "cache"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.name = name
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+        self._writes = 0
+        self._touched: Dict[str, float] = {}
+        self._last_flush = time.monotonic()
+        self._total_bytes = self._sum_bytes()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        metrics.register_collector(f"cache.{name}", self.stats)
+
+    def _sum_bytes(self) -> int:
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return int(row[0])
+
+    # --- Key/value API ---
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.incr(f"cache.{self.name}.misses")
+                return None
+            self._touch_locked([key])
+            self.hits += 1
+            metrics.incr(f"cache.{self.name}.hits")
+            return bytes(row[0])
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        found: Dict[str, bytes] = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i : i + 500]
+                marks = ",".join("?" * len(chunk))
+                for k, v in self._conn.execute(f"SELECT key, value FROM entries WHERE key IN ({marks})", chunk):
+                    found[k] = bytes(v)
+            if found:
+                self._touch_locked(found)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        metrics.incr(f"cache.{self.name}.hits", len(found))
+        metrics.incr(f"cache.{self.name}.misses", len(keys) - len(found))
+        return found
+
+    def set(self, key: str, value: bytes) -> None:
+        self.set_many({key: value})
+
+    def set_many(self, items: Dict[str, bytes]) -> None:
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._flush_touches_locked()
+            for key, value in items.items():
+                old = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                if old is not None:
+                    self._total_bytes -= int(old[0])
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, sqlite3.Binary(value), len(value), now),
+                )
+                self._total_bytes += len(value)
+            self._writes += len(items)
+            if self._writes >= _RESYNC_EVERY:
+                self._writes = 0
+                self._total_bytes = self._sum_bytes()
+            self._evict_locked()
+            self._conn.commit()
+
+    def _touch_locked(self, keys: Iterable[str]) -> None:
+        now = time.time()
+        for key in keys:
+            self._touched[key] = now
+        if len(self._touched) >= _TOUCH_FLUSH_EVERY or time.monotonic() - self._last_flush >= _TOUCH_FLUSH_S:
+            self._flush_touches_locked()
+            self._conn.commit()
+
+    def _flush_touches_locked(self) -> None:
+        # caller commits
+        self._last_flush = time.monotonic()
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE entries SET last_access = ? WHERE key = ?", [(t, k) for k, t in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def flush(self) -> None:
+        """Write buffered access times now."""
+        with self._lock:
+            self._flush_touches_locked()
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._total_bytes -= int(row[0])
+                self._conn.commit()
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Drop every entry whose key starts with `prefix`; returns how many."""
+        where = "substr(key, 1, ?) = ?"
+        args = (len(prefix), prefix)
+        with self._lock:
+            count, size = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE {where}", args
+            ).fetchone()
+            self._conn.execute(f"DELETE FROM entries WHERE {where}", args)
+            self._conn.commit()
+            self._total_bytes -= int(size)
+        return int(count)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._touched.clear()
+            self._total_bytes = 0
+
+    def _evict_locked(self) -> None:
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY last_access ASC LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                return
+            for key, size in rows:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._total_bytes -= int(size)
+                self.evictions += 1
+                metrics.incr(f"cache.{self.name}.evictions")
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    # --- Metadata (e.g. model name / index version the entries belong to) ---
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
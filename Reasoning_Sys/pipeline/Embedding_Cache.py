@@ -0,0 +1,204 @@
+# Embedding_Cache.py
+"""
+Two-level cache for query embeddings.
+
+  L1: in-process LRU (bounded by entry count)
+  L2: Disk_Cache.DiskLRUCache shared by workers on the node (bounded by bytes)
+
+Keys are (embedding model name, normalized text); vectors are stored as
+packed float32 arrays, a quarter of the size of a list of Python floats.
+Because the model is part of every key, several embedding models (in one
+process or across workers) share the on-disk store without touching each
+other's vectors; entries of a model no longer in use age out through LRU
+eviction.
+
+Enable it per call site with `get_embedding_model(..., cache=True)`; the
+returned object is a drop-in LangChain Embeddings wrapper.
+"""
+
+import hashlib
+import os
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.embeddings import Embeddings
+
+from Disk_Cache import DiskLRUCache
+from Metrics import metrics
+
+# --- CONFIG ---
+EMBED_CACHE_ENABLED = os.environ.get("EMBED_CACHE_ENABLED", "1") not in ("0", "false", "False")
+EMBED_CACHE_PATH = os.environ.get(
+    "EMBED_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "query_embeddings.sqlite"),
+)
+EMBED_CACHE_MAX_MB = int(os.environ.get("EMBED_CACHE_MAX_MB", "128"))
+EMBED_CACHE_MEMORY_ITEMS = int(os.environ.get("EMBED_CACHE_MEMORY_ITEMS", "4096"))
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def _unpack(raw: bytes) -> array:
+    arr = array("f")
+    arr.frombytes(raw)
+    return arr
+
+
+class QueryEmbeddingCache:
+    def __init__(self, model_name: str, *, path: str = EMBED_CACHE_PATH,
+                 max_bytes: int = EMBED_CACHE_MAX_MB * 1024 * 1024,
+                 memory_items: int = EMBED_CACHE_MEMORY_ITEMS):
+        self.model_name = model_name
+        self.memory_items = memory_items
+        self.disk = DiskLRUCache(path, max_bytes=max_bytes, name="embeddings")
+        self._memory: "OrderedDict[str, array]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        metrics.register_collector(f"embed_cache.{model_name}", self.stats)
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{digest}"
+
+    def get_many(self, texts: Sequence[str]) -> Dict[str, array]:
+        """Return {text: vector} for the texts that are cached."""
+        found: Dict[str, array] = {}
+        disk_keys: Dict[str, List[str]] = {}
+        with self._lock:
+            for text in texts:
+                key = self._key(text)
+                vec = self._memory.get(key)
+                if vec is not None:
+                    self._memory.move_to_end(key)
+                    found[text] = vec
+                else:
+                    disk_keys.setdefault(key, []).append(text)
+            memory_hits = len(found)
+            self.memory_hits += memory_hits
+
+        disk_hits = 0
+        if disk_keys:
+            rows = self.disk.get_many(disk_keys)
+            disk_hits = len(rows)
+            with self._lock:
+                for key, raw in rows.items():
+                    vec = _unpack(raw)
+                    self._remember_locked(key, vec)
+                    for text in disk_keys[key]:
+                        found[text] = vec
+                self.disk_hits += disk_hits
+                self.misses += len(disk_keys) - disk_hits
+
+        metrics.incr("embed_cache.memory_hits", memory_hits)
+        metrics.incr("embed_cache.disk_hits", disk_hits)
+        metrics.incr("embed_cache.misses", len(disk_keys) - disk_hits)
+        return found
+
+    def set_many(self, items: Dict[str, Sequence[float]]) -> None:
+        packed = {}
+        with self._lock:
+            for text, vec in items.items():
+                key = self._key(text)
+                arr = vec if isinstance(vec, array) else array("f", vec)
+                self._remember_locked(key, arr)
+                packed[key] = arr.tobytes()
+        self.disk.set_many(packed)
+
+    def _remember_locked(self, key: str, vec: array) -> None:
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        self.disk.delete_prefix(f"{self.model_name}:")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "model": self.model_name,
+            "memory_entries": len(self._memory),
+            "memory_max_entries": self.memory_items,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None,
+            "disk": self.disk.stats(),
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain Embeddings wrapper that serves repeated texts from QueryEmbeddingCache."""
+
+    def __init__(self, inner: Embeddings, cache: QueryEmbeddingCache):
+        self.inner = inner
+        self.cache = cache
+        self.model = getattr(inner, "model", cache.model_name)
+
+    def _split(self, texts: List[str]):
+        cached = self.cache.get_many(texts)
+        missing = list(dict.fromkeys(t for t in texts if t not in cached))
+        return cached, missing
+
+    def _merge(self, texts: List[str], cached: Dict[str, Any], missing: List[str], vectors) -> List[List[float]]:
+        # Round fresh vectors to float32 too, so a hit returns exactly what a miss did
+        fresh = {t: array("f", v) for t, v in zip(missing, vectors)}
+        if fresh:
+            self.cache.set_many(fresh)
+        merged = {**cached, **fresh}
+        return [merged[t].tolist() for t in texts]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        cached, missing = self._split(texts)
+        vectors = self.inner.embed_documents(missing) if missing else []
+        return self._merge(texts, cached, missing, vectors)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        cached, missing = self._split(texts)
+        vectors = await self.inner.aembed_documents(missing) if missing else []
+        return self._merge(texts, cached, missing, vectors)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+_caches: Dict[str, QueryEmbeddingCache] = {}
+_wrappers: Dict[int, CachedEmbeddings] = {}
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name: str) -> Optional[QueryEmbeddingCache]:
+    """Process-wide cache for one embedding model, or None when disabled via EMBED_CACHE_ENABLED."""
+    if not EMBED_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        cache = _caches.get(model_name)
+        if cache is None:
+            cache = QueryEmbeddingCache(model_name)
+            _caches[model_name] = cache
+        return cache
+
+
+def with_embedding_cache(inner: Embeddings, model_name: str) -> Embeddings:
+    """Wrap a (pooled, shared) embeddings client; returns it unchanged when caching is disabled."""
+    cache = get_embedding_cache(model_name)
+    if cache is None:
+        return inner
+    with _cache_lock:
+        wrapper = _wrappers.get(id(inner))
+        if wrapper is None:
+            wrapper = CachedEmbeddings(inner, cache)
+            _wrappers[id(inner)] = wrapper
+        return wrapper
@@ -1,20 +1,16 @@
 # Execution.py
-from MY_Model import get_chat_model, audio_text, get_embedding_model
-from MY_Prompt import prompt, final_prompt_template
-from MY_Format import parser, SymptomModel, FinalBaseModel
+# CLI / legacy entry point for Module 1. The pipeline itself lives in Pipeline_Service.
+from MY_Model import get_client_metrics
+from Pipeline_Service import PipelineService, get_pipeline_service
 
-# Single import for run_custom_multiquery_retrieval (adjust path if needed)
-from Vector_Search import run_custom_multiquery_retrieval
-
-from Tools import _normalize_symptom_json, flatten_docs
-from typing import Optional, Any, List, Dict
-import os
+from typing import Optional, Any, Dict, Callable
 import sys
-import traceback
 import json
-import re
 import io
 
+# stdout marker used to stream synthesis tokens to the backend (one JSON string per line)
+TOKEN_MARKER = "---PIPELINE_TOKEN---"
+
 # Force UTF-8 for Windows console/subprocess output
 if sys.stdout.encoding != 'utf-8':
     try:
@@ -23,73 +19,13 @@ if sys.stdout.encoding != 'utf-8':
         # Fallback for older python or restricted environments
         sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-# helper to safely extract text from LangChain runnable results
-def _result_to_text(result: Any) -> str:
-    """
-    Normalize an LLM chain result to plain string.
-    Accepts objects with .content or .text, or plain strings.
-    """
-    if result is None:
-        return ""
-    if isinstance(result, str):
-        return result
-    # ChatMessage-like
-    if hasattr(result, "content"):
-        return result.content
-    if hasattr(result, "text"):
-        return result.text
-    # fallback
-    return str(result)
-
-
-def _extract_json_substring(s: str) -> Optional[str]:
-    """
-    Try to find the first top-level JSON object in string `s`.
-    Returns the JSON substring or None.
-    This is defensive: LLMs sometimes add surrounding text.
-    """
-    if not s:
-        return None
-    # First try to parse entire string
-    try:
-        json.loads(s)
-        return s
-    except Exception:
-        pass
-
-    # Heuristic: find first { ... } balanced braces block
-    brace_stack = []
-    start = None
-    for i, ch in enumerate(s):
-        if ch == "{":
-            if start is None:
-                start = i
-            brace_stack.append(i)
-        elif ch == "}":
-            if brace_stack:
-                brace_stack.pop()
-                if not brace_stack and start is not None:
-                    candidate = s[start : i + 1]
-                    # try parse
-                    try:
-                        json.loads(candidate)
-                        return candidate
-                    except Exception:
-                        # continue searching (maybe nested object not JSON)
-                        start = None
-                        brace_stack = []
-    # Last resort: regex (greedy) — may produce invalid JSON if braces unmatched
-    m = re.search(r"(\{(?:.|\s)*\})", s)
-    if m:
-        try:
-            json.loads(m.group(1))
-            return m.group(1)
-        except Exception:
-            return None
-    return None
-
-
-def pipeline(audio_path: Optional[str] = None, transcription: Optional[str] = None, history: Optional[str] = None) -> Dict[str, Any]:
+def pipeline(
+    audio_path: Optional[str] = None,
+    transcription: Optional[str] = None,
+    history: Optional[str] = None,
+    on_token: Optional[Callable[[str], None]] = None,
+    service: Optional[PipelineService] = None,
+) -> Dict[str, Any]:
     """
     Full pipeline:
       - transcribe audio (if transcription not provided)
@@ -97,171 +33,18 @@ def pipeline(audio_path: Optional[str] = None, transcription: Optional[str] = No
       - validate into SymptomModel
       - call run_symptom_test
       - run multi-query retrieval to get docs
-      - build context and call final prompt chain
-    Returns a dictionary with result details.
+      - build context and stream the final prompt chain
+    `on_token` (optional) receives each synthesis token as it is generated.
+    Returns a dictionary with result details (see Pipeline_Service.AnalysisResult).
     """
-    # 0) Project root insert (so relative imports work as your codebase expects)
-    PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
-    if PROJECT_ROOT not in sys.path:
-        sys.path.insert(0, PROJECT_ROOT)
-
-    # 1) Transcribe (skip if text already provided)
-    if not transcription:
-        if not audio_path:
-             raise ValueError("Either audio_path or transcription must be provided.")
-        try:
-            transcription = audio_text(audio_path)
-            print("TRANSCRIPTION (first 300 chars):\n", transcription[:300])
-        except Exception as e:
-            traceback.print_exc()
-            raise RuntimeError(f"Failed to transcribe audio: {e}")
-    else:
-        print("Using provided text transcription.")
-
-    # 2) LLM + prompt to extract symptoms
-    try:
-        llm = get_chat_model()
-    except Exception as e:
-        traceback.print_exc()
-        raise RuntimeError(f"Failed to instantiate chat model: {e}")
-
-    # Build LLM chain for symptom extraction: prompt | llm
-    text_chain = prompt | llm
-
-    try:
-        raw_text_result = text_chain.invoke({
-            "audio_transcription": transcription,
-            "history": history or "No previous medical history available."
-        })
-        raw_text = _result_to_text(raw_text_result)
-        print("\nRaw symptom-extraction output (first 600 chars):\n", raw_text[:600])
-    except Exception as e:
-        traceback.print_exc()
-        raise RuntimeError(f"Symptom extraction chain failed: {e}")
-
-    # 3) Normalize output to JSON-like dict and validate with Pydantic SymptomModel
-    try:
-        normalized_obj = _normalize_symptom_json(raw_text)
-    except Exception as e:
-        traceback.print_exc()
-        raise RuntimeError(f"Failed to normalize symptom JSON: {e}")
-
-    try:
-        model_output: SymptomModel = SymptomModel.model_validate(normalized_obj)
-    except Exception as e:
-        traceback.print_exc()
-        raise RuntimeError(f"SymptomModel validation failed: {e}")
-
-    print("Parsed SymptomModel:")
-    print(" - symptoms:", model_output.symptoms)
-    print(" - duration:", model_output.duration)
-    print(" - red_flags:", model_output.red_flags)
-    print(" - notes:", getattr(model_output, "notes", None))
-    
-    # 4) Run prediction model
-    try:
-        from Disease_Prediction_Pipeline.test import run_symptom_test
-    except Exception as e:
-        traceback.print_exc()
-        raise RuntimeError(f"Cannot import run_symptom_test: {e}")
-
-    try:
-        result_prediction = run_symptom_test(model_output.symptoms)
-    except Exception as e:
-        traceback.print_exc()
-        raise RuntimeError(f"run_symptom_test failed: {e}")
-
-    # Extract Top 5 Diseases for display and prompt
-    top_5_list = []
-    if isinstance(result_prediction, dict):
-        top_map = result_prediction.get("top_diseases_by_bucket", {})
-        temp_preds = {}
-        for bucket_name, diseases in top_map.items():
-            for d in diseases:
-                name = d.get("disease")
-                prob = d.get("prob", 0.0)
-                if name not in temp_preds or prob > temp_preds[name]["prob"]:
-                    temp_preds[name] = {"disease": name, "prob": prob, "bucket": bucket_name}
-        
-        all_preds = list(temp_preds.values())
-        all_preds.sort(key=lambda x: x["prob"], reverse=True)
-        top_5_list = all_preds[:5]
-
-    top_5_summary = "\n".join([f"{i+1}. {p['disease']} ({p['prob']:.2%})" for i, p in enumerate(top_5_list)]) if top_5_list else "None"
-    
-    # Lead prediction for legacy field
-    lead_pred = "No safe prediction"
-    if top_5_list:
-        lead = top_5_list[0]
-        lead_pred = f"{lead['disease']} ({lead['prob']:.2%})"
-
-    # 5) Retrieval
-    try:
-        docs = run_custom_multiquery_retrieval(
-            transcription,
-            model_output.symptoms,
-            model_output.duration,
-            model_output.red_flags,
-            result_prediction,
-        )
-    except Exception as e:
-        traceback.print_exc()
-        raise RuntimeError(f"run_custom_multiquery_retrieval failed: {e}")
-
-    # 6) Flatten docs
-    final_docs = []
-    try:
-        final_docs = flatten_docs(docs)
-    except Exception:
-        if docs is None: final_docs = []
-        elif isinstance(docs, list) and docs and isinstance(docs[0], list):
-            final_docs = [d for sub in docs for d in sub]
-        elif isinstance(docs, list): final_docs = docs
-        else: final_docs = []
-
-    print(f"\nRetrieved {len(final_docs)} documents.")
-
-    # 7) Build context string (NO metadata as requested)
-    context_pieces = []
-    for doc in final_docs:
-        page_content = getattr(doc, "page_content", None)
-        if page_content and isinstance(page_content, str) and page_content.strip():
-            context_pieces.append(page_content)
-        else:
-            text = getattr(doc, "content", None) or str(doc)
-            if text and text.strip():
-                context_pieces.append(text)
-
-    context = "\n\n".join(context_pieces)
-    if not context.strip():
-        context = "No relevant medical documents found."
-
-    # 8) Final prompt -> LLM
-    final_chain = final_prompt_template | llm
-    final_text = ""
-
-    try:
-        final_raw = final_chain.invoke({
-            "document": context,
-            "symptoms": model_output.symptoms,
-            "duration": model_output.duration,
-            "red_flags": model_output.red_flags,
-            "disease_prediction": lead_pred,
-            "top_5_predictions": top_5_summary,
-            "user_query": transcription,
-            "history": history or "No previous medical history available."
-        })
-        final_text = _result_to_text(final_raw)
-    except Exception as e:
-        traceback.print_exc()
-        final_text = "Clinical synthesis failed."
-
-    return {
-        "symptoms": model_output.symptoms,
-        "top_5": top_5_list,
-        "ai_response": final_text,
-        "logs": f"Reasoning path: Symptom extraction -> {len(context_pieces)} document(s) retrieved -> Differential reasoning -> {lead_pred} identified as primary hypothesis."
-    }
+    service = service or get_pipeline_service()
+    result = service.analyze(
+        audio_path=audio_path,
+        transcription=transcription,
+        history=history,
+        on_token=on_token,
+    )
+    return result.model_dump()
 
 
 if __name__ == "__main__":
@@ -271,6 +54,7 @@ if __name__ == "__main__":
     parser.add_argument("input", nargs="?", help="Path to audio file (mp3/wav) or text if --text is used")
     parser.add_argument("--text", action="store_true", help="Input is a text transcription, not a file path")
     parser.add_argument("--history", help="Historical medical context for the patient")
+    parser.add_argument("--stream", action="store_true", help=f"Emit synthesis tokens on stdout as {TOKEN_MARKER} lines")
     
     args = parser.parse_args()
     
@@ -282,7 +66,15 @@ if __name__ == "__main__":
 
     try:
         print("\n>>> Starting Clinical Pipeline...")
-        out = pipeline(audio_path=file_to_process, transcription=text_to_process, history=args.history)
+        def emit_token(token: str) -> None:
+            print(TOKEN_MARKER + json.dumps(token), flush=True)
+
+        out = pipeline(
+            audio_path=file_to_process,
+            transcription=text_to_process,
+            history=args.history,
+            on_token=emit_token if args.stream else None,
+        )
         
         # Proper display of top 5 diseases
         print("\n" + "="*60)
@@ -301,6 +93,8 @@ if __name__ == "__main__":
         print(out["ai_response"])
         print("="*60 + "\n")
 
+        out["metrics"] = get_client_metrics()
+
         print("---PIPELINE_OUTPUT_START---")
         print(json.dumps(out))
         print("---PIPELINE_OUTPUT_END---")
@@ -0,0 +1,83 @@
+# Facet_Queries.py
+"""
+Deterministic retrieval sub-queries built from structured case data.
+
+Instead of embedding the long instruction prompt from build_clinical_query
+and asking the LLM for rewrites, the "facets" query mode derives short,
+clinically specific queries straight from the SymptomModel fields and the
+top-5 predictions:
+
+  - one per symptom cluster (symptoms grouped by body system with the same
+    keyword taxonomy Metadata_Filter uses for specialties),
+  - one per candidate disease,
+  - one per red flag.
+
+No LLM is involved, so the rewrite step costs nothing; all queries are
+embedded and searched in one batch by amulti_query_retrieve.
+"""
+
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+from Metadata_Filter import classify_specialty
+
+FACET_MAX_QUERIES = int(os.environ.get("FACET_MAX_QUERIES", "10"))
+FACET_MAX_DISEASES = int(os.environ.get("FACET_MAX_DISEASES", "5"))
+
+
+def symptom_clusters(symptoms: Sequence[str]) -> Dict[str, List[str]]:
+    """Symptoms grouped by body system ("general" for constitutional ones)."""
+    clusters: Dict[str, List[str]] = {}
+    for symptom in symptoms:
+        name = str(symptom).strip().replace("_", " ")
+        if name:
+            clusters.setdefault(classify_specialty(name), []).append(name)
+    return clusters
+
+
+def build_facet_queries(
+    symptoms: Sequence[str],
+    duration: Optional[str],
+    red_flags: Sequence[str],
+    predictions: Sequence[Dict[str, Any]],
+    max_queries: int = FACET_MAX_QUERIES,
+) -> List[str]:
+    """Red-flag, candidate-disease and symptom-cluster queries, deduplicated, in that order."""
+    symptoms = [str(s).strip().replace("_", " ") for s in symptoms if str(s).strip()]
+    lead_symptoms = ", ".join(symptoms[:3])
+    over = f" for {duration}" if duration else ""
+    queries: List[str] = []
+
+    for flag in red_flags or []:
+        flag = str(flag).strip().replace("_", " ")
+        if flag:
+            queries.append(f"{flag} as a red flag: dangerous causes and emergency evaluation")
+
+    for pred in list(predictions)[:FACET_MAX_DISEASES]:
+        disease = str(pred.get("disease", "")).strip()
+        if disease:
+            with_symptoms = f" presenting with {lead_symptoms}" if lead_symptoms else ""
+            queries.append(f"{disease}{with_symptoms}: diagnostic criteria, investigations and management")
+
+    for system, members in symptom_clusters(symptoms).items():
+        label = "" if system == "general" else f" ({system.replace('_', ' ')})"
+        queries.append(f"{', '.join(members)}{over}{label}: differential diagnosis and initial workup")
+
+    seen = set()
+    unique = []
+    for q in queries:
+        key = q.lower()
+        if key not in seen:
+            seen.add(key)
+            unique.append(q)
+    return unique[:max_queries]
+
+
+def build_case_query(symptoms: Sequence[str], duration: Optional[str], predictions: Sequence[Dict[str, Any]]) -> str:
+    """Short anchor query for the facet mode (replaces the instruction prompt)."""
+    parts = [", ".join(str(s).replace("_", " ") for s in symptoms) or "unspecified symptoms"]
+    if duration:
+        parts.append(f"for {duration}")
+    if predictions:
+        parts.append("suspected " + " or ".join(str(p.get("disease")) for p in list(predictions)[:2]))
+    return " ".join(parts)
@@ -7,16 +7,17 @@ import uuid
 import base64
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_ollama import OllamaEmbeddings, ChatOllama
 from langchain_chroma import Chroma
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 
+from MY_Model import get_chat_model, get_embedding_model, get_client_metrics, FINAL_LLM_MODEL, EMBEDDING_MODEL_NAME
+
 # Configuration
-OLLAMA_BASE_URL = "http://127.0.0.1:11434"
-DEFAULT_LLM = "MedAIBase/MedGemma1.5:4b"
+DEFAULT_LLM = FINAL_LLM_MODEL
 VISION_LLM = "llava:latest" # Recommended for images
-EMBEDDING_MODEL = "bge-m3:latest"
+EMBEDDING_MODEL = EMBEDDING_MODEL_NAME
+RAG_NUM_CTX = 8192
 
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
@@ -35,7 +36,7 @@ def run_rag_chat(prompt, pdf_path=None, image_path=None, user_id=None):
     try:
         if image_path and os.path.exists(image_path):
             # 1. Multi-modal Vision Path
-            llm = ChatOllama(model=VISION_LLM, base_url=OLLAMA_BASE_URL, temperature=0.1, timeout=300)
+            llm = get_chat_model(model=VISION_LLM, temperature=0.1, max_tokens=None, num_ctx=None, timeout=300)
             from langchain_core.messages import HumanMessage
             
             img_base64 = encode_image(image_path)
@@ -53,7 +54,7 @@ def run_rag_chat(prompt, pdf_path=None, image_path=None, user_id=None):
             text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
             splits = text_splitter.split_documents(docs)
             
-            embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
+            embeddings = get_embedding_model(EMBEDDING_MODEL)
             
             # Check if user already has a vector store
             if os.path.exists(vectorstore_dir) and os.listdir(vectorstore_dir):
@@ -71,13 +72,7 @@ def run_rag_chat(prompt, pdf_path=None, image_path=None, user_id=None):
                     persist_directory=vectorstore_dir
                 )
             
-            llm = ChatOllama(
-                model=DEFAULT_LLM, 
-                base_url=OLLAMA_BASE_URL,
-                temperature=0.3,
-                num_ctx=8192,
-                timeout=300
-            )
+            llm = get_chat_model(model=DEFAULT_LLM, temperature=0.3, max_tokens=None, num_ctx=RAG_NUM_CTX, timeout=300)
             
             template = """You are CareFusion AI, an advanced medical intelligence assistant. 
             Use the following pieces of retrieved clinical context to answer the user request.
@@ -105,19 +100,14 @@ def run_rag_chat(prompt, pdf_path=None, image_path=None, user_id=None):
         else:
             # 3. Standard Chat Path - Query existing vector store if available
             if user_id and os.path.exists(vectorstore_dir) and os.listdir(vectorstore_dir):
-                embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
+                # Query-only path: repeated questions skip the embedding call
+                embeddings = get_embedding_model(EMBEDDING_MODEL, cache=True)
                 vectorstore = Chroma(
                     persist_directory=vectorstore_dir,
                     embedding_function=embeddings
                 )
                 
-                llm = ChatOllama(
-                    model=DEFAULT_LLM, 
-                    base_url=OLLAMA_BASE_URL,
-                    temperature=0.3,
-                    num_ctx=8192,
-                    timeout=300
-                )
+                llm = get_chat_model(model=DEFAULT_LLM, temperature=0.3, max_tokens=None, num_ctx=RAG_NUM_CTX, timeout=300)
                 
                 template = """You are CareFusion AI. Use the user's previously uploaded medical documents to answer questions.
                 
@@ -140,7 +130,7 @@ def run_rag_chat(prompt, pdf_path=None, image_path=None, user_id=None):
                 ai_response = response["result"]
             else:
                 # No documents uploaded yet
-                llm = ChatOllama(model=DEFAULT_LLM, base_url=OLLAMA_BASE_URL, temperature=0.3, timeout=300)
+                llm = get_chat_model(model=DEFAULT_LLM, temperature=0.3, max_tokens=None, num_ctx=None, timeout=300)
                 ai_response = llm.invoke(prompt).content
 
     except Exception as e:
@@ -192,7 +182,8 @@ def run_rag_chat(prompt, pdf_path=None, image_path=None, user_id=None):
 
     result = {
         "ai_response": ai_response,
-        "status": "success"
+        "status": "success",
+        "metrics": get_client_metrics()
     }
     
     print("---PIPELINE_OUTPUT_START---")
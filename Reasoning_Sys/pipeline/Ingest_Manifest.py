@@ -0,0 +1,195 @@
+# Ingest_Manifest.py
+"""
+Content-hash manifest that makes incremental ingestion idempotent.
+
+One row per ingested file (manifest.<collection>.sqlite, next to the
+collection) records the file's SHA-256, a key of the chunking config it
+was split with, and the chunk ids it produced. Before a writer embeds a
+file it asks `plan`:
+
+    unchanged  same path, same hash, same config   -> skip
+    duplicate  same content already ingested under another path
+               -> record this path against the existing chunk ids
+    modified   same path, new hash or new config    -> delete old ids
+               (unless another path still references them), re-add
+    new        never seen                           -> add
+
+Chunk ids are derived from (file hash, config key, chunk index), so
+re-adding a file yields the same ids and Chroma's upsert overwrites
+instead of duplicating; a run interrupted half-way is repaired by simply
+running it again.
+
+Add_New_doc.py and the admin upload route share the manifest, so a file
+uploaded through the portal is not embedded a second time by the next
+folder sweep. Writers record a file only after its chunks, facet rows and
+BM25 segment are in and the index version is bumped: a crash before
+`record` leaves the file "new"/"modified" for the next run, never
+"unchanged" with half of it missing.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from Lexical_Index import delete_ids
+
+_READ_BLOCK = 1 << 20
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of the file contents (streamed)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(_READ_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def config_key(**settings: Any) -> str:
+    """Short stable key of everything that changes how a file is chunked and embedded."""
+    raw = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def chunk_ids_for(file_hash: str, cfg_key: str, count: int, start: int = 0) -> List[str]:
+    """Deterministic chunk ids: c-<file hash prefix>-<config key>-<index>."""
+    return [f"c-{file_hash[:20]}-{cfg_key}-{i:05d}" for i in range(start, start + count)]
+
+
+def _norm_path(path: str) -> str:
+    return os.path.normcase(os.path.abspath(str(path)))
+
+
+def source_name(path: str) -> str:
+    """The `source` every writer stores for a file (chunk metadata, manifest, parent store)."""
+    return os.path.abspath(str(path))
+
+
+class IngestManifest:
+    """path -> (file hash, config key, chunk ids) for one collection (SQLite)."""
+
+    def __init__(self, persist_dir: str, collection_name: str):
+        self.path = os.path.join(persist_dir, f"manifest.{collection_name}.sqlite")
+        os.makedirs(persist_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, file_hash TEXT NOT NULL, "
+            "config_key TEXT NOT NULL, source TEXT, chunk_ids TEXT NOT NULL, ingested_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_hash ON files(file_hash, config_key)")
+        self._conn.commit()
+
+    def lookup(self, path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, file_hash, config_key, source, chunk_ids, ingested_at FROM files WHERE path = ?",
+                (_norm_path(path),),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "path": row[0], "file_hash": row[1], "config_key": row[2], "source": row[3],
+            "chunk_ids": json.loads(row[4]), "ingested_at": row[5],
+        }
+
+    def plan(self, path: str, file_hash: str, cfg_key: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """("unchanged" | "duplicate" | "modified" | "new", existing entry or None)"""
+        entry = self.lookup(path)
+        if entry is not None and entry["file_hash"] == file_hash and entry["config_key"] == cfg_key:
+            return "unchanged", entry
+        if entry is None:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT path FROM files WHERE file_hash = ? AND config_key = ? LIMIT 1", (file_hash, cfg_key)
+                ).fetchone()
+            if row is not None:
+                return "duplicate", self.lookup(row[0])
+            return "new", None
+        return "modified", entry
+
+    def record(self, path: str, file_hash: str, cfg_key: str, source: str, chunk_ids: Sequence[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, file_hash, config_key, source, chunk_ids, ingested_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (_norm_path(path), file_hash, cfg_key, source, json.dumps(list(chunk_ids)), time.time()),
+            )
+            self._conn.commit()
+
+    def record_duplicate(self, path: str, existing: Dict[str, Any]) -> None:
+        """Record `path` as another copy of an ingested file: same chunks, nothing re-embedded."""
+        self.record(path, existing["file_hash"], existing["config_key"], existing["source"], existing["chunk_ids"])
+
+    def other_paths(self, entry: Dict[str, Any]) -> List[str]:
+        """Paths besides entry's own that reference the same chunks (same content and config)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM files WHERE file_hash = ? AND config_key = ? AND path != ? ORDER BY path",
+                (entry["file_hash"], entry["config_key"], _norm_path(entry["path"])),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def forget(self, path: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (_norm_path(path),))
+            self._conn.commit()
+
+    def entries(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            paths = [r[0] for r in self._conn.execute("SELECT path FROM files ORDER BY path")]
+        return [e for e in (self.lookup(p) for p in paths) if e is not None]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            files, = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()
+        return {"files": files, "chunks": sum(len(e["chunk_ids"]) for e in self.entries())}
+
+
+def remove_file_chunks(
+    vectorstore, facets, entry: Dict[str, Any], persist_dir: str, collection_name: str, parent_store=None,
+    manifest: Optional[IngestManifest] = None,
+) -> int:
+    """
+    Delete a manifest entry's chunks from the collection, the facet index,
+    the BM25 index (tombstones, see Lexical_Index.delete_ids) and
+    (small-to-big) the parent store. With a manifest, chunks still
+    referenced by another path (a recorded duplicate) are left in place
+    and 0 is returned.
+    """
+    if manifest is not None and manifest.other_paths(entry):
+        return 0
+    ids: List[str] = list(entry.get("chunk_ids") or [])
+    if ids:
+        delete_ids(persist_dir, collection_name, ids)
+        for i in range(0, len(ids), 500):
+            vectorstore.delete(ids=ids[i : i + 500])
+        facets.delete(ids)
+    if parent_store is not None and entry.get("source"):
+        parent_store.delete_source(entry["source"])
+    return len(ids)
+
+
+def _iter_entries(entries: Iterable[Dict[str, Any]]):
+    for e in entries:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(e["ingested_at"]))
+        yield f"{when}  {e['file_hash'][:12]}  cfg={e['config_key']}  {len(e['chunk_ids']):6d} chunks  {e['path']}"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show the ingestion manifest of a collection")
+    parser.add_argument("persist_dir")
+    parser.add_argument("collection")
+    args = parser.parse_args()
+
+    manifest = IngestManifest(args.persist_dir, args.collection)
+    for line in _iter_entries(manifest.entries()):
+        print(line)
+    print(json.dumps(manifest.stats(), indent=2))
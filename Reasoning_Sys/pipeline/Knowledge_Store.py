@@ -0,0 +1,320 @@
+# Knowledge_Store.py
+"""
+Process-wide warm handles on the Chroma knowledge collections.
+
+Opening a persistent Chroma collection and probing the embedding model on
+every retrieval is pure overhead, so each (persist dir, collection,
+embedding model) is opened ONCE per process and reused:
+
+  - the embedding dimension is validated once, from the stored collection
+    (collection metadata, else one stored vector) against the model the
+    index was built with; with a current snapshot it is validated from the
+    snapshot header instead, and Chroma is only opened when a caller needs
+    it (get_documents, as_retriever), so workers never load its HNSW index
+    just to start,
+  - ingestion writes bump an index version marker next to the collection
+    (`record_index_update`), and the warm handle reloads only when that
+    version changes,
+  - the BM25 lexical index (Lexical_Index) kept next to the collection is
+    memory-mapped alongside it and reloaded with the same version,
+  - dense search can be served from an exported memory-mapped snapshot
+    (Ann_Snapshot, ANN_SNAPSHOT_ENABLED=1) shared by all worker processes,
+    or from a binary-quantized copy (Quantized_Store, QUANT_SEARCH_ENABLED=1),
+    in each case only while it was built from the current index version.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+from Ann_Snapshot import ANN_SNAPSHOT_ENABLED, SnapshotHandle
+from Lexical_Index import LexicalIndex
+from Metadata_Filter import FacetIndex
+from Parent_Store import ParentStore, parents_path
+from Quantized_Store import QUANT_SEARCH_ENABLED, QuantizedIndex, open_quantized
+from MY_Model import get_embedding_model
+from Metrics import metrics
+
+# How often (seconds) a warm handle re-checks the on-disk index version
+INDEX_VERSION_POLL_S = float(os.environ.get("INDEX_VERSION_POLL_S", "2"))
+
+
+def _version_path(persist_dir: str, collection_name: str) -> str:
+    return os.path.join(persist_dir, f"index_version.{collection_name}.json")
+
+
+def read_index_info(persist_dir: str, collection_name: str) -> Dict[str, Any]:
+    """Return the version marker written by the last ingestion ({} if never recorded)."""
+    try:
+        with open(_version_path(persist_dir, collection_name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _stored_dimension(collection) -> Optional[int]:
+    meta = getattr(collection, "metadata", None) or {}
+    if meta.get("embedding_dim"):
+        return int(meta["embedding_dim"])
+    try:
+        peek = collection.get(limit=1, include=["embeddings"])
+        embs = peek.get("embeddings")
+        if embs is not None and len(embs):
+            return len(embs[0])
+    except Exception:
+        pass
+    return None
+
+
+def record_index_update(vectorstore: Chroma, persist_dir: str, collection_name: str, embedding_model: str) -> str:
+    """
+    Bump the index version after an ingestion write. Call this from every
+    writer (build_index, Add_New_doc, admin uploads) once its batch is in.
+    The marker is replaced atomically so readers never see a partial file.
+    """
+    coll = vectorstore._collection
+    info = {
+        "version": f"{int(time.time())}-{uuid.uuid4().hex[:8]}",
+        "updated_at": time.time(),
+        "embedding_model": embedding_model,
+        "embedding_dim": _stored_dimension(coll),
+        "count": coll.count(),
+    }
+    path = _version_path(persist_dir, collection_name)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(info, f)
+    os.replace(tmp, path)
+    return info["version"]
+
+
+class WarmKnowledgeStore:
+    def __init__(self, persist_dir: str, collection_name: str, embedding_model: str):
+        self.persist_dir = persist_dir
+        self.collection_name = collection_name
+        self.embedding_model = embedding_model
+        self.embeddings = get_embedding_model(embedding_model, cache=True)
+
+        self._lock = threading.Lock()
+        self._vectorstore: Optional[Chroma] = None
+        self._lexical: Optional[LexicalIndex] = None
+        self._facets: Optional[FacetIndex] = None
+        self._parents: Optional[ParentStore] = None
+        self._quantized: Optional[QuantizedIndex] = None
+        self._snapshots = SnapshotHandle(persist_dir, collection_name, INDEX_VERSION_POLL_S) if ANN_SNAPSHOT_ENABLED else None
+        self._stale_snapshot_warned: Optional[str] = None
+        self.version: Optional[str] = None
+        self.embedding_dim: Optional[int] = None
+        self._version_mtime: Optional[float] = None
+        self._last_check = 0.0
+        self.loads = 0
+
+    def _marker_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(_version_path(self.persist_dir, self.collection_name))
+        except OSError:
+            return None
+
+    def _chroma(self) -> Chroma:
+        return Chroma(
+            collection_name=self.collection_name,
+            persist_directory=self.persist_dir,
+            embedding_function=self.embeddings,
+        )
+
+    def _open_locked(self) -> None:
+        if not os.path.isdir(self.persist_dir):
+            raise FileNotFoundError(f"Chroma DB path not found: {self.persist_dir}")
+        with metrics.timed("knowledge_store.open"):
+            info = read_index_info(self.persist_dir, self.collection_name)
+            snap = self._snapshots.current() if self._snapshots is not None else None
+            if snap is not None and snap.source_version == info.get("version", "0"):
+                # the shared snapshot serves dense search: validate against its header and
+                # leave Chroma (and its per-process HNSW load) closed until something needs it
+                vectorstore = None
+                self._validate_locked(snap.dim, f"snapshot {os.path.basename(snap.path)}",
+                                      info, snap.info.get("embedding_model"))
+                count = snap.count
+            else:
+                vectorstore = self._chroma()
+                self._validate_locked(_stored_dimension(vectorstore._collection), "the stored collection", info)
+                count = vectorstore._collection.count()
+            lexical = LexicalIndex(self.persist_dir, self.collection_name)
+            quantized = open_quantized(self.persist_dir, self.collection_name) if QUANT_SEARCH_ENABLED else None
+        if quantized is not None and quantized.source_version != info.get("version", "0"):
+            print(
+                f"[Knowledge_Store] quantized copy of {self.collection_name} was built from version "
+                f"{quantized.source_version}; re-run Quantized_Store.py migrate. Using Chroma search."
+            )
+            quantized.close()
+            quantized = None
+        if self._lexical is not None:
+            self._lexical.close()
+        if self._quantized is not None:
+            self._quantized.close()
+        self._lexical = lexical
+        self._quantized = quantized
+        self._vectorstore = vectorstore
+        self.version = info.get("version", "0")
+        self._version_mtime = self._marker_mtime()
+        self.loads += 1
+        metrics.incr("knowledge_store.loads")
+        print(
+            f"[Knowledge_Store] opened {self.collection_name} (version {self.version}, "
+            f"{count} vectors{' from the snapshot' if vectorstore is None else ''}, dim {self.embedding_dim}, "
+            f"{len(lexical)} lexical docs)"
+        )
+
+    def _validate_locked(self, stored_dim: Optional[int], source: str, info: Dict[str, Any],
+                         source_model: Optional[str] = None) -> None:
+        # The stored vectors are the source of truth; the marker is only trusted if it agrees
+        marker_dim = info.get("embedding_dim")
+        if stored_dim is not None and marker_dim is not None and int(marker_dim) != stored_dim:
+            raise RuntimeError(
+                f"Index marker for {self.collection_name} records dimension {marker_dim}, "
+                f"but {source} has {stored_dim}; re-run the ingestion that wrote it."
+            )
+        if stored_dim is None:
+            stored_dim = marker_dim
+        built_with = info.get("embedding_model") or source_model
+        for model in (built_with, source_model):
+            if model and model != self.embedding_model:
+                raise RuntimeError(
+                    f"Collection {self.collection_name} was built with {model!r}, "
+                    f"but retrieval is configured for {self.embedding_model!r}."
+                )
+        if stored_dim is not None and not built_with:
+            # Index predates version markers: one probe per process, not per query
+            model_dim = len(self.embeddings.embed_query("dimension probe"))
+            if model_dim != stored_dim:
+                raise RuntimeError(
+                    f"Embedding dimension mismatch for {self.collection_name}: "
+                    f"collection has {stored_dim}, {self.embedding_model} produces {model_dim}."
+                )
+        self.embedding_dim = stored_dim
+
+    def refresh(self) -> None:
+        """Open the handles on first use and reopen them when the index version moves."""
+        now = time.monotonic()
+        if self.version is not None and now - self._last_check < INDEX_VERSION_POLL_S:
+            return
+        with self._lock:
+            self._last_check = now
+            if self.version is None:
+                self._open_locked()
+            elif self._marker_mtime() != self._version_mtime:
+                info = read_index_info(self.persist_dir, self.collection_name)
+                if info.get("version", "0") != self.version:
+                    metrics.incr("knowledge_store.reloads")
+                    self._open_locked()
+                else:
+                    self._version_mtime = self._marker_mtime()
+
+    @property
+    def vectorstore(self) -> Chroma:
+        self.refresh()
+        vectorstore = self._vectorstore
+        if vectorstore is None:
+            # snapshot mode: Chroma is opened on the first call that needs it (get_documents, as_retriever)
+            with self._lock:
+                if self._vectorstore is None:
+                    self._vectorstore = self._chroma()
+                vectorstore = self._vectorstore
+        return vectorstore
+
+    @property
+    def lexical(self) -> LexicalIndex:
+        self.refresh()
+        return self._lexical
+
+    @property
+    def quantized(self) -> Optional[QuantizedIndex]:
+        self.refresh()
+        return self._quantized
+
+    @property
+    def vector_index(self):
+        """Dense search backend: mapped snapshot, else quantized copy, else None (Chroma)."""
+        self.refresh()
+        if self._snapshots is not None:
+            snap = self._snapshots.current()
+            if snap is not None and snap.source_version == self.version:
+                return snap
+            if snap is not None and self._stale_snapshot_warned != self.version:
+                self._stale_snapshot_warned = self.version
+                print(
+                    f"[Knowledge_Store] snapshot of {self.collection_name} was built from version "
+                    f"{snap.source_version}; re-run Ann_Snapshot.py export. Using Chroma search."
+                )
+        return self._quantized
+
+    @property
+    def facets(self) -> FacetIndex:
+        # SQLite side index: always reads current rows, no reload needed
+        if self._facets is None:
+            with self._lock:
+                if self._facets is None:
+                    self._facets = FacetIndex(self.persist_dir, self.collection_name)
+        return self._facets
+
+    @property
+    def parents(self) -> Optional[ParentStore]:
+        # small-to-big side store; None until an ingestion has written parents
+        if self._parents is None and os.path.exists(parents_path(self.persist_dir, self.collection_name)):
+            with self._lock:
+                if self._parents is None:
+                    self._parents = ParentStore(self.persist_dir, self.collection_name)
+        return self._parents
+
+    def get_documents(self, ids: List[str]) -> Dict[str, Document]:
+        """Fetch chunks by id (no vector search), keyed by id."""
+        got = self.vectorstore._collection.get(ids=list(ids), include=["documents", "metadatas"])
+        return {
+            doc_id: Document(id=doc_id, page_content=text or "", metadata=dict(meta or {}))
+            for doc_id, text, meta in zip(got["ids"], got["documents"], got["metadatas"])
+        }
+
+    def as_retriever(self, k: int, where: Optional[Dict[str, Any]] = None):
+        search_kwargs: Dict[str, Any] = {"k": k}
+        if where:
+            search_kwargs["filter"] = where
+        return self.vectorstore.as_retriever(search_type="similarity", search_kwargs=search_kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "collection": self.collection_name,
+            "version": self.version,
+            "embedding_model": self.embedding_model,
+            "embedding_dim": self.embedding_dim,
+            "loads": self.loads,
+            "lexical_docs": len(self._lexical) if self._lexical is not None else None,
+            "quantized_vectors": len(self._quantized) if self._quantized is not None else None,
+            "snapshot": (self._snapshots._snapshot.info.get("index") if self._snapshots and self._snapshots._snapshot else None),
+            "snapshot_swaps": self._snapshots.swaps if self._snapshots is not None else None,
+        }
+
+
+_stores: Dict[Tuple[str, str, str], WarmKnowledgeStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_knowledge_store(persist_dir: str, collection_name: str, embedding_model: str) -> WarmKnowledgeStore:
+    """Process-wide warm store for one collection (opened lazily on first use)."""
+    key = (os.path.abspath(persist_dir), collection_name, embedding_model)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = WarmKnowledgeStore(persist_dir, collection_name, embedding_model)
+                _stores[key] = store
+                metrics.register_collector(
+                    f"knowledge_store.{collection_name}", store.stats
+                )
+    return store
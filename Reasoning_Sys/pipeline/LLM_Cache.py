@@ -0,0 +1,78 @@
+# LLM_Cache.py
+"""
+Persistent exact-match response cache for chat models.
+
+Implements LangChain's BaseCache on top of Disk_Cache.DiskLRUCache. The key
+is a hash of the LLM string (model name + generation parameters, as built
+by LangChain) and the fully rendered prompt, so any change in model,
+temperature, num_predict, num_ctx or prompt text is a miss.
+
+Enable it per call site with `get_chat_model(..., cache=True)`. Streaming
+calls (e.g. the Module 1 synthesis) bypass LangChain caches by design.
+"""
+
+import hashlib
+import os
+import threading
+from typing import Any, Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+from Disk_Cache import DiskLRUCache
+
+# --- CONFIG ---
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "1") not in ("0", "false", "False")
+LLM_CACHE_PATH = os.environ.get(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "llm_responses.sqlite"),
+)
+LLM_CACHE_MAX_MB = int(os.environ.get("LLM_CACHE_MAX_MB", "256"))
+
+
+class DiskLLMCache(BaseCache):
+    def __init__(self, store: DiskLRUCache):
+        self.store = store
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Any]]:
+        raw = self.store.get(self._key(prompt, llm_string))
+        if raw is None:
+            return None
+        try:
+            return loads(raw.decode("utf-8"))
+        except Exception:
+            # Stale / incompatible serialization: treat as a miss
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Any]) -> None:
+        try:
+            payload = dumps(list(return_val)).encode("utf-8")
+        except Exception as e:
+            print(f"[LLM_Cache] could not serialize response: {e}")
+            return
+        self.store.set(self._key(prompt, llm_string), payload)
+
+    def clear(self, **kwargs: Any) -> None:
+        self.store.clear()
+
+
+_cache: Optional[DiskLLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[DiskLLMCache]:
+    """Process-wide LLM response cache, or None when disabled via LLM_CACHE_ENABLED."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DiskLLMCache(
+                    DiskLRUCache(LLM_CACHE_PATH, max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024, name="llm")
+                )
+    return _cache
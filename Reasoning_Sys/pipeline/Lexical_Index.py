@@ -0,0 +1,328 @@
+# Lexical_Index.py
+"""
+Compact on-disk BM25 inverted index kept alongside a Chroma collection.
+
+Each ingestion write (one file, or one build batch) adds an immutable segment
+holding the postings for the chunks it added (keyed by their Chroma ids):
+
+    <persist_dir>/lexical/<collection>/seg-<timestamp>-<rand>.bin
+
+Segment layout (little-endian):
+    header   "<8sIIIQQQQ": magic, n_docs, n_terms, total_len,
+                           doc_lens_off, doc_ids_off, vocab_off, postings_off
+    doc_lens uint32[n_docs]
+    doc_ids  JSON list of chunk ids (utf-8)
+    vocab    JSON {term: [postings_offset, df]} (utf-8)
+    postings per term, df x (uint32 doc index, uint32 term freq)
+
+At query time segments are memory-mapped read-only; only the vocabularies
+and id lists are parsed, postings are read in place.
+
+Files are applied in stamp order and the latest occurrence of an id wins:
+
+    seg-<stamp>-<rand>.bin     postings; re-writing an id supersedes older ones
+    tomb-<stamp>-<rand>.json   ids deleted from the collection (delete_ids)
+    reset-<stamp>-<rand>.json  everything older is dead (clear_segments)
+
+so each live id is scored once, and corpus statistics (N, avgdl, df) count
+live postings only, matching a single freshly built index.
+"""
+
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from Metrics import metrics
+
+MAGIC = b"BM25SEG1"
+_HEADER = struct.Struct("<8sIIIQQQQ")
+_POSTING = struct.Struct("<II")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the to was were will with "
+    "this these those which who what when where how not no but if then than into per".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS and len(t) > 1]
+
+
+def lexical_dir(persist_dir: str, collection_name: str) -> str:
+    return os.path.join(persist_dir, "lexical", collection_name)
+
+
+_stamp_lock = threading.Lock()
+_last_stamp = 0
+
+
+def _stamp() -> int:
+    """Strictly increasing nanosecond stamp (file order within one process)."""
+    global _last_stamp
+    with _stamp_lock:
+        _last_stamp = max(time.time_ns(), _last_stamp + 1)
+        return _last_stamp
+
+
+def _file_order(name: str) -> Tuple[int, str]:
+    try:
+        stamp = int(name.split("-")[1].split(".")[0])
+    except (IndexError, ValueError):
+        return 0, name
+    # segments written before nanosecond stamps carry milliseconds
+    return (stamp * 1_000_000 if stamp < 10 ** 15 else stamp), name
+
+
+def _lexical_files(out_dir: str) -> List[Tuple[str, str]]:
+    """[(kind, path)] after the latest reset, in stamp order."""
+    if not os.path.isdir(out_dir):
+        return []
+    entries = []
+    for name in os.listdir(out_dir):
+        if name.endswith(".tmp"):
+            continue
+        kind = name.split("-", 1)[0]
+        if (kind == "seg" and name.endswith(".bin")) or (kind in ("tomb", "reset") and name.endswith(".json")):
+            entries.append((_file_order(name), kind, os.path.join(out_dir, name)))
+    entries.sort()
+    resets = [i for i, (_, kind, _) in enumerate(entries) if kind == "reset"]
+    if resets:
+        entries = entries[resets[-1] + 1 :]
+    return [(kind, path) for _, kind, path in entries]
+
+
+def _write_json_atomic(path: str, payload) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+
+def write_segment(persist_dir: str, collection_name: str, ids: Sequence[str], texts: Sequence[str]) -> Optional[str]:
+    """Write one immutable segment for the given chunks; returns its path (None if empty)."""
+    if not ids:
+        return None
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    doc_lens = array("I")
+    for doc_idx, text in enumerate(texts):
+        tokens = tokenize(text or "")
+        doc_lens.append(len(tokens))
+        counts: Dict[str, int] = {}
+        for tok in tokens:
+            counts[tok] = counts.get(tok, 0) + 1
+        for tok, tf in counts.items():
+            postings.setdefault(tok, []).append((doc_idx, tf))
+
+    postings_blob = bytearray()
+    vocab: Dict[str, List[int]] = {}
+    for term in sorted(postings):
+        plist = postings[term]
+        vocab[term] = [len(postings_blob), len(plist)]
+        for doc_idx, tf in plist:
+            postings_blob += _POSTING.pack(doc_idx, tf)
+
+    doc_lens_blob = doc_lens.tobytes()
+    doc_ids_blob = json.dumps(list(ids)).encode("utf-8")
+    vocab_blob = json.dumps(vocab, separators=(",", ":")).encode("utf-8")
+
+    doc_lens_off = _HEADER.size
+    doc_ids_off = doc_lens_off + len(doc_lens_blob)
+    vocab_off = doc_ids_off + len(doc_ids_blob)
+    postings_off = vocab_off + len(vocab_blob)
+    header = _HEADER.pack(
+        MAGIC, len(ids), len(vocab), sum(doc_lens),
+        doc_lens_off, doc_ids_off, vocab_off, postings_off,
+    )
+
+    out_dir = lexical_dir(persist_dir, collection_name)
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"seg-{_stamp()}-{uuid.uuid4().hex[:6]}.bin")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(doc_lens_blob)
+        f.write(doc_ids_blob)
+        f.write(vocab_blob)
+        f.write(postings_blob)
+    os.replace(tmp, path)
+    return path
+
+
+def delete_ids(persist_dir: str, collection_name: str, ids: Sequence[str]) -> Optional[str]:
+    """Tombstone chunk ids deleted from the collection; returns the tombstone path (None if empty)."""
+    ids = list(ids)
+    if not ids:
+        return None
+    out_dir = lexical_dir(persist_dir, collection_name)
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"tomb-{_stamp()}-{uuid.uuid4().hex[:6]}.json")
+    _write_json_atomic(path, ids)
+    return path
+
+
+def clear_segments(persist_dir: str, collection_name: str, index: Optional["LexicalIndex"] = None) -> None:
+    """
+    Drop the whole index (used before a full rebuild). A reset marker makes
+    everything older dead at once; the old files are then removed where
+    possible. Pass this process's open `index` so its maps are closed
+    first: Windows refuses to delete a file that is still memory-mapped,
+    and files mapped by other processes are left for a later clear.
+    """
+    if index is not None:
+        index.close()
+    out_dir = lexical_dir(persist_dir, collection_name)
+    os.makedirs(out_dir, exist_ok=True)
+    marker = os.path.join(out_dir, f"reset-{_stamp()}-{uuid.uuid4().hex[:6]}.json")
+    _write_json_atomic(marker, {"reset": True})
+    for name in os.listdir(out_dir):
+        path = os.path.join(out_dir, name)
+        if path == marker or _file_order(name) >= _file_order(os.path.basename(marker)):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # still mapped elsewhere; dead behind the reset marker anyway
+
+
+class _Segment:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.n_docs, self.n_terms, self.total_len,
+         doc_lens_off, doc_ids_off, vocab_off, self.postings_off) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a lexical segment: {path}")
+        self._view = memoryview(self._mm)
+        self.doc_lens = self._view[doc_lens_off:doc_ids_off].cast("I")
+        self.doc_ids: List[str] = json.loads(self._mm[doc_ids_off:vocab_off].decode("utf-8"))
+        self.vocab: Dict[str, List[int]] = json.loads(self._mm[vocab_off:self.postings_off].decode("utf-8"))
+
+    def postings(self, term: str) -> Iterable[Tuple[int, int]]:
+        entry = self.vocab.get(term)
+        if entry is None:
+            return ()
+        start = self.postings_off + entry[0]
+        return _POSTING.iter_unpack(self._mm[start : start + entry[1] * _POSTING.size])
+
+    def close(self) -> None:
+        self.doc_lens.release()
+        self._view.release()
+        self._mm.close()
+        self._file.close()
+
+
+class LexicalIndex:
+    """Read-only BM25 view over all live postings of one collection."""
+
+    def __init__(self, persist_dir: str, collection_name: str):
+        self.persist_dir = persist_dir
+        self.collection_name = collection_name
+        self.segments: List[_Segment] = []
+        live: Dict[str, Tuple[int, int]] = {}
+        for kind, path in _lexical_files(lexical_dir(persist_dir, collection_name)):
+            if kind == "seg":
+                seg = _Segment(path)
+                si = len(self.segments)
+                self.segments.append(seg)
+                for doc_idx, doc_id in enumerate(seg.doc_ids):
+                    live[doc_id] = (si, doc_idx)  # latest write of an id wins
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    for doc_id in json.load(f):
+                        live.pop(doc_id, None)
+        # per segment: 1 where that row is the live copy of its id
+        self._live = [bytearray(seg.n_docs) for seg in self.segments]
+        total_len = 0
+        for si, doc_idx in live.values():
+            self._live[si][doc_idx] = 1
+            total_len += self.segments[si].doc_lens[doc_idx]
+        self.n_docs = len(live)
+        self.dead = sum(seg.n_docs for seg in self.segments) - self.n_docs
+        self.avgdl = (total_len / self.n_docs) if self.n_docs else 0.0
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Top-k (chunk_id, bm25_score), best first; each live id at most once."""
+        if not self.n_docs:
+            return []
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        scores: Dict[Tuple[int, int], float] = {}
+        with metrics.timed("lexical.search"):
+            for term in terms:
+                hits = [
+                    (si, doc_idx, tf)
+                    for si, seg in enumerate(self.segments)
+                    for doc_idx, tf in seg.postings(term)
+                    if self._live[si][doc_idx]
+                ]
+                if not hits:
+                    continue
+                df = len(hits)
+                idf = math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+                for si, doc_idx, tf in hits:
+                    seg = self.segments[si]
+                    norm = tf + BM25_K1 * (1.0 - BM25_B + BM25_B * seg.doc_lens[doc_idx] / self.avgdl)
+                    key = (si, doc_idx)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1.0) / norm
+            top = heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+        return [(self.segments[si].doc_ids[doc_idx], score) for (si, doc_idx), score in top]
+
+    def close(self) -> None:
+        for seg in self.segments:
+            seg.close()
+        self.segments = []
+
+
+def rebuild_from_collection(collection, persist_dir: str, collection_name: str, page_size: int = 1000) -> int:
+    """
+    Rebuild the lexical index from everything stored in a Chroma collection
+    (one segment). Use once to backfill collections built before this index.
+    """
+    clear_segments(persist_dir, collection_name)
+    ids: List[str] = []
+    texts: List[str] = []
+    offset = 0
+    while True:
+        page = collection.get(limit=page_size, offset=offset, include=["documents"])
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        texts.extend(page["documents"])
+        offset += len(page["ids"])
+    write_segment(persist_dir, collection_name, ids, texts)
+    return len(ids)
+
+
+if __name__ == "__main__":
+    import argparse
+    from langchain_chroma import Chroma
+    from Knowledge_Store import record_index_update
+    from MY_Model import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Backfill the BM25 index of an existing Chroma collection")
+    parser.add_argument("persist_dir")
+    parser.add_argument("collection")
+    args = parser.parse_args()
+
+    store = Chroma(collection_name=args.collection, persist_directory=args.persist_dir)
+    n = rebuild_from_collection(store._collection, args.persist_dir, args.collection)
+    record_index_update(store, args.persist_dir, args.collection, EMBEDDING_MODEL_NAME)
+    print(f"Indexed {n} chunks into {lexical_dir(args.persist_dir, args.collection)}")
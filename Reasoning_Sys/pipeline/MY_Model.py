@@ -1,12 +1,16 @@
 from langchain_ollama import OllamaEmbeddings, ChatOllama
-import whisper
 from functools import lru_cache
 from typing import Optional
 
+from Client_Registry import get_registry
+
 
 
 @lru_cache(maxsize=4)
 def load_whisper_model(size: str):
+    # Imported lazily so modules that only need the LLM factories
+    # (backend routers, ingestion tools) do not pull in whisper/torch.
+    import whisper
     return whisper.load_model(size)
 
 def audio_text(
@@ -31,10 +35,13 @@ def audio_text(
 # --- Configuration Layer (single source of truth) ---
 
 DEFAULT_LLM_MODEL = "llama3.2:3b"
+FAST_LLM_MODEL = "llama3.2:3b"  # Small model for simple Module 1 cases (see Case_Router)
 FINAL_LLM_MODEL = "MedAIBase/MedGemma1.5:4b"
 CARL_ADVISOR_MODEL = "MedAIBase/MedGemma1.5:4b"  # Specialized for clinical advisory loop
 DEFAULT_MAX_TOKENS = 2048
 DEFAULT_TEMPERATURE = 0.7
+DEFAULT_NUM_CTX = 2048     # Kept small to force more layers onto GPU VRAM
+DEFAULT_NUM_THREAD = 8
 
 # --- Factory Function ---
 
@@ -42,43 +49,39 @@ def get_chat_model(
     *,
     model: str = DEFAULT_LLM_MODEL,
     temperature: float = DEFAULT_TEMPERATURE,
-    max_tokens: int = DEFAULT_MAX_TOKENS,
+    max_tokens: Optional[int] = DEFAULT_MAX_TOKENS,
     timeout: Optional[int] = None,
+    num_ctx: Optional[int] = DEFAULT_NUM_CTX,
+    base_url: Optional[str] = None,
+    cache: bool = False,
 ) -> ChatOllama:
     """
-    Create and return a production-configured ChatOllama instance.
+    Return a production-configured ChatOllama instance from the shared client registry.
+
+    Instances with identical settings are reused and share one pooled
+    HTTP connection per Ollama host. Pass `max_tokens=None` / `num_ctx=None`
+    to keep the Ollama server defaults. `cache=True` serves repeated identical
+    (model, prompt, parameters) calls from the on-disk LLM_Cache.
     """
 
     if not 0.0 <= temperature <= 2.0:
         raise ValueError(f"Invalid temperature: {temperature}")
 
-    import requests
-    import time
-    
-    # Robust check for Ollama server with retries
-    max_retries = 2
-    for attempt in range(max_retries + 1):
-        try:
-            # Increased timeout to 15 seconds for slower system startup
-            requests.get("http://127.0.0.1:11434/api/tags", timeout=15)
-            break
-        except (requests.exceptions.RequestException, Exception) as e:
-            if attempt < max_retries:
-                time.sleep(2) # brief wait before retry
-                continue
-            raise RuntimeError(
-                f"Ollama server is unresponsive or not running (Error: {type(e).__name__}). "
-                "Please ensure the Ollama application is active and not hung."
-            )
-
-    return ChatOllama(
-        model=model,
-        temperature=temperature,
-        num_predict=max_tokens,
-        timeout=timeout,
-        num_ctx=2048,     # Further reduced to 2048 to force more layers onto GPU VRAM
-        num_thread=8,
-    )
+    registry = get_registry()
+    registry.ensure_server(base_url)
+
+    options = {"temperature": temperature, "num_thread": DEFAULT_NUM_THREAD}
+    if max_tokens is not None:
+        options["num_predict"] = max_tokens
+    if num_ctx is not None:
+        options["num_ctx"] = num_ctx
+    if cache:
+        from LLM_Cache import get_llm_cache
+        llm_cache = get_llm_cache()
+        if llm_cache is not None:
+            options["cache"] = llm_cache
+
+    return registry.chat(model=model, base_url=base_url, timeout=timeout, **options)
     
     # example usage of the model function
     # llm = get_chat_model()
@@ -98,14 +101,28 @@ EMBEDDING_MODEL_NAME = "bge-m3:latest"
 def get_embedding_model(
     EMBEDDING_MODEL_NAME : Optional[str] = "bge-m3:latest",
     base_url: Optional[str] = None,
+    cache: bool = False,
 ) -> OllamaEmbeddings:
     """
-    Return a configured OllamaEmbeddings instance.
+    Return a configured OllamaEmbeddings instance from the shared client registry.
 
     - Model is fixed to a dedicated embedding model.
     - Optional `base_url` allows remote Ollama instances.
+    - `cache=True` serves repeated query texts from the two-level
+      Embedding_Cache (use for query paths, not bulk ingestion).
     """
-    return OllamaEmbeddings(
+    embeddings = get_registry().embeddings(
         model=EMBEDDING_MODEL_NAME,
         base_url=base_url,
-    )
\ No newline at end of file
+    )
+    if cache:
+        from Embedding_Cache import with_embedding_cache
+        embeddings = with_embedding_cache(embeddings, EMBEDDING_MODEL_NAME)
+    return embeddings
+
+
+def get_client_metrics() -> dict:
+    """Snapshot of pipeline metrics, including pooled client counters."""
+    from Metrics import metrics
+    get_registry()
+    return metrics.snapshot()
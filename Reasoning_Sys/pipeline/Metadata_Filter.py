@@ -0,0 +1,333 @@
+# Metadata_Filter.py
+"""
+Metadata tags and filtered retrieval for the knowledge collections.
+
+Ingestion tags every chunk with document-level facets:
+  - specialty   (keyword taxonomy over the title page and file name)
+  - doc_type    (guideline / review / trial / case_report / textbook / other)
+  - pub_year    (copyright / publication line, else the PDF creation date)
+
+A side index (FacetIndex, one SQLite file next to the collection) maps each
+facet value to its chunk ids. Filters are resolved against it BEFORE any
+vector search: the candidate count (fields intersected and counted in
+SQLite) decides whether a filter is selective enough to apply (a filter
+that would leave only a handful of chunks is dropped rather than starving
+the context), the surviving filter becomes a Chroma `where` clause so the
+collection only searches matching chunks, and, when a backend needs them,
+the candidate ids prune the BM25 side of hybrid retrieval.
+
+Filters are plain dicts:
+    {"specialty": ["cardiology"], "doc_type": ["guideline"], "min_year": 2015}
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+
+from Metrics import metrics
+
+FACET_FIELDS = ("specialty", "doc_type", "pub_year")
+# Below this many candidate chunks a filter is considered too narrow and dropped
+FILTER_MIN_CANDIDATES = int(os.environ.get("FILTER_MIN_CANDIDATES", "25"))
+
+# Keywords match whole tokens (plural "s"/"es" allowed); a trailing "*" marks a
+# stem that matches any token starting with it. "heart" therefore does not
+# match "heartburn" and "renal" does not match "adrenal".
+SPECIALTY_KEYWORDS: Dict[str, Sequence[str]] = {
+    "cardiology": ("cardi*", "pericard*", "endocard*", "tachycard*", "bradycard*", "heart", "coronary", "myocard*",
+                   "angina", "arrhythm*", "dysrhythm*", "atrial", "hypertens*", "valv*", "aort*"),
+    "pulmonology": ("pulmon*", "lung", "asthma*", "copd", "pneumon*", "bronch*", "respirat*", "pleur*"),
+    "neurology": ("neuro*", "migraine", "headache", "stroke", "seizure", "epilep*", "parkinson*", "dementia", "mening*"),
+    "gastroenterology": ("gastr*", "epigastr*", "heartburn", "reflux", "gerd", "hepat*", "liver", "bowel", "colitis",
+                         "crohn*", "pancrea*", "peptic", "cirrho*", "jaundice"),
+    "endocrinology": ("diabet*", "thyroid*", "hypothyroid*", "hyperthyroid*", "endocrin*", "insulin", "adrenal",
+                      "glyc*", "hyperglyc*", "hypoglyc*"),
+    "infectious_disease": ("infect*", "malaria", "dengue", "typhoid", "hiv", "sepsis", "septic", "viral", "bacteri*",
+                           "tubercul*", "fungal"),
+    "nephrology": ("renal", "kidney", "nephr*", "glomerulonephr*", "dialysis", "urinary"),
+    "dermatology": ("dermat*", "skin", "rash", "psoria*", "eczema", "acne", "urticaria"),
+    "rheumatology": ("arthrit*", "osteoarthrit*", "polyarthrit*", "lupus", "rheumat*", "gout", "spondyl*"),
+    "hematology": ("anemi*", "anaemi*", "leuk*", "lymphoma", "thrombocyt*", "hemophil*", "haemophil*", "sickle"),
+    "psychiatry": ("depress*", "anxiety", "schizo*", "bipolar", "psychiat*", "psychos*"),
+}
+
+
+def _keyword_pattern(keywords: Sequence[str]) -> "re.Pattern":
+    alternatives = [
+        re.escape(k[:-1]) + r"\w*" if k.endswith("*") else re.escape(k) + "(?:e?s)?"
+        for k in keywords
+    ]
+    return re.compile(r"\b(?:" + "|".join(alternatives) + r")\b", re.I)
+
+
+_SPECIALTY_PATTERNS = {specialty: _keyword_pattern(keywords) for specialty, keywords in SPECIALTY_KEYWORDS.items()}
+
+DOC_TYPE_PATTERNS = (
+    ("guideline", re.compile(r"\b(guideline|recommendation|consensus statement|position statement|clinical practice)", re.I)),
+    ("review", re.compile(r"\b(systematic review|meta-analysis|narrative review|review article)", re.I)),
+    ("trial", re.compile(r"\b(randomi[sz]ed|controlled trial|clinical trial)", re.I)),
+    ("case_report", re.compile(r"\bcase report", re.I)),
+    ("textbook", re.compile(r"\b(textbook|chapter \d+|edition|handbook|manual of)", re.I)),
+)
+
+_YEAR_CONTEXT_RE = re.compile(r"(?:©|copyright|published|publication date|\(c\))\D{0,20}((?:19[5-9]|20[0-4])\d)", re.I)
+_YEAR_RE = re.compile(r"\b((?:19[5-9]|20[0-4])\d)\b")
+_PDF_DATE_RE = re.compile(r"((?:19[5-9]|20[0-4])\d)")
+
+
+def _specialty_counts(text: str) -> Counter:
+    counts: Counter = Counter()
+    for specialty, pattern in _SPECIALTY_PATTERNS.items():
+        n = len(pattern.findall(text))
+        if n:
+            counts[specialty] = n
+    return counts
+
+
+def classify_specialty(text: str) -> str:
+    counts = _specialty_counts(text)
+    return counts.most_common(1)[0][0] if counts else "general"
+
+
+def classify_doc_type(text: str) -> str:
+    for doc_type, pattern in DOC_TYPE_PATTERNS:
+        if pattern.search(text):
+            return doc_type
+    return "other"
+
+
+def extract_pub_year(text: str, pdf_metadata: Optional[Dict[str, Any]] = None) -> Optional[int]:
+    m = _YEAR_CONTEXT_RE.search(text)
+    if m:
+        return int(m.group(1))
+    for key in ("creationdate", "creation_date", "moddate"):
+        raw = str((pdf_metadata or {}).get(key) or "")
+        m = _PDF_DATE_RE.search(raw)
+        if m:
+            return int(m.group(1))
+    years = _YEAR_RE.findall(text)
+    return int(Counter(years).most_common(1)[0][0]) if years else None
+
+
+def infer_doc_tags(title_text: str, source: str, pdf_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Document-level facets from the first page(s) and the file name."""
+    name = os.path.splitext(os.path.basename(source))[0].replace("_", " ").replace("-", " ")
+    probe = f"{name}\n{name}\n{title_text[:6000]}"  # file name weighted twice
+    tags: Dict[str, Any] = {
+        "specialty": classify_specialty(probe),
+        "doc_type": classify_doc_type(probe),
+    }
+    year = extract_pub_year(title_text[:6000], pdf_metadata)
+    if year is not None:
+        tags["pub_year"] = year  # Chroma metadata cannot hold None: omit when unknown
+    return tags
+
+
+def tag_pages(pages: Sequence[Any], source: str) -> Dict[str, Any]:
+    """Tag all pages of one PDF in place (chunks split from them inherit the tags)."""
+    if not pages:
+        return {}
+    title_text = "\n".join(p.page_content or "" for p in pages[:2])
+    tags = infer_doc_tags(title_text, source, pages[0].metadata)
+    for page in pages:
+        page.metadata.update(tags)
+    return tags
+
+
+def specialties_for_predictions(top_predictions: Sequence[Dict[str, Any]], min_share: float = 0.6) -> List[str]:
+    """
+    Specialties that account for at least `min_share` of the top-k probability
+    mass, e.g. ["cardiology"] when the top-5 differential is mostly cardiac.
+    Returns [] when the differential is spread across specialties.
+    """
+    mass: Counter = Counter()
+    total = 0.0
+    for pred in top_predictions:
+        prob = float(pred.get("prob") or 0.0) or 1e-6
+        total += prob
+        specialty = classify_specialty(str(pred.get("disease", "")))
+        if specialty != "general":
+            mass[specialty] += prob
+    if not total:
+        return []
+    chosen, share = [], 0.0
+    for specialty, m in mass.most_common():
+        chosen.append(specialty)
+        share += m / total
+        if share >= min_share:
+            return chosen
+    return []
+
+
+def build_where(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Translate a filter dict into a Chroma `where` clause."""
+    if not filters:
+        return None
+    clauses = []
+    for field in ("specialty", "doc_type"):
+        values = filters.get(field)
+        if values:
+            clauses.append({field: {"$in": list(values)}})
+    if filters.get("min_year"):
+        clauses.append({"pub_year": {"$gte": int(filters["min_year"])}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+class FacetIndex:
+    """chunk id <-> facet value side index (SQLite, next to the collection)."""
+
+    def __init__(self, persist_dir: str, collection_name: str):
+        self.path = os.path.join(persist_dir, f"facets.{collection_name}.sqlite")
+        os.makedirs(persist_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS facets (chunk_id TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_facets_field_value ON facets(field, value)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_facets_chunk ON facets(chunk_id)")
+        self._conn.commit()
+
+    def add(self, ids: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> None:
+        rows = [
+            (chunk_id, field, str(meta[field]))
+            for chunk_id, meta in zip(ids, metadatas)
+            for field in FACET_FIELDS
+            if meta.get(field) is not None
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT INTO facets (chunk_id, field, value) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def delete(self, ids: Iterable[str]) -> None:
+        ids = list(ids)
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i : i + 500]
+                self._conn.execute(f"DELETE FROM facets WHERE chunk_id IN ({','.join('?' * len(chunk))})", chunk)
+            self._conn.commit()
+
+    @staticmethod
+    def _match_sql(filters: Dict[str, Any]):
+        """One SELECT per given field, INTERSECTed in SQLite (None when no field is given)."""
+        parts, params = [], []
+        for field in ("specialty", "doc_type"):
+            values = filters.get(field)
+            if values:
+                parts.append(f"SELECT chunk_id FROM facets WHERE field = ? AND value IN ({','.join('?' * len(values))})")
+                params += [field, *values]
+        if filters.get("min_year"):
+            parts.append("SELECT chunk_id FROM facets WHERE field = 'pub_year' AND CAST(value AS INTEGER) >= ?")
+            params.append(int(filters["min_year"]))
+        if not parts:
+            return None, params
+        return " INTERSECT ".join(parts), params
+
+    def count_for(self, filters: Dict[str, Any]) -> int:
+        """Number of chunk ids matching every given field, counted without fetching them."""
+        sql, params = self._match_sql(filters)
+        if sql is None:
+            return 0
+        with self._lock, metrics.timed("facets.count"):
+            return self._conn.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+
+    def ids_for(self, filters: Dict[str, Any]) -> Set[str]:
+        """Chunk ids matching every given field (any of its values)."""
+        sql, params = self._match_sql(filters)
+        if sql is None:
+            return set()
+        with self._lock, metrics.timed("facets.lookup"):
+            rows = self._conn.execute(sql, params).fetchall()
+        return {r[0] for r in rows}
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT field, value, COUNT(*) FROM facets GROUP BY field, value").fetchall()
+        out: Dict[str, Dict[str, int]] = {}
+        for field, value, n in rows:
+            out.setdefault(field, {})[value] = n
+        return out
+
+
+def resolve_filter(facets: FacetIndex, filters: Optional[Dict[str, Any]], *, need_ids: bool = True):
+    """
+    Return (where, candidate_ids) for a filter, or (None, None) when there is
+    no filter or it is too narrow to be useful (< FILTER_MIN_CANDIDATES).
+
+    The candidates are counted in SQLite first; their ids are only fetched
+    with need_ids (a backend filters by id: BM25 fusion, a mapped snapshot
+    or quantized copy), else candidate_ids is None and `where` alone
+    applies the filter.
+    """
+    where = build_where(filters)
+    if where is None:
+        return None, None
+    n = facets.count_for(filters)
+    if n < FILTER_MIN_CANDIDATES:
+        metrics.incr("facets.filter_dropped")
+        print(f"[Metadata_Filter] filter {filters} matches only {n} chunks; searching unfiltered.")
+        return None, None
+    metrics.incr("facets.filter_applied")
+    print(f"[Metadata_Filter] filter {filters} -> {n} candidate chunks.")
+    return where, (facets.ids_for(filters) if need_ids else None)
+
+
+def backfill_collection(collection, facets: FacetIndex, page_size: int = 500) -> int:
+    """
+    Tag chunks ingested before facets existed (document tags inferred from
+    each source's first chunks) and fill the side index. Returns chunks tagged.
+    """
+    by_source: Dict[str, List[str]] = {}
+    texts: Dict[str, str] = {}
+    metas: Dict[str, Dict[str, Any]] = {}
+    offset = 0
+    while True:
+        page = collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+        if not page["ids"]:
+            break
+        for chunk_id, text, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+            meta = dict(meta or {})
+            if all(field in meta for field in ("specialty", "doc_type")):
+                continue
+            source = str(meta.get("source", ""))
+            by_source.setdefault(source, []).append(chunk_id)
+            if len(by_source[source]) <= 2:
+                texts[source] = texts.get(source, "") + "\n" + (text or "")
+            metas[chunk_id] = meta
+        offset += len(page["ids"])
+
+    tagged = 0
+    for source, ids in by_source.items():
+        tags = infer_doc_tags(texts.get(source, ""), source)
+        for i in range(0, len(ids), page_size):
+            batch = ids[i : i + page_size]
+            new_metas = [{**metas[c], **tags} for c in batch]
+            collection.update(ids=batch, metadatas=new_metas)
+            facets.delete(batch)
+            facets.add(batch, new_metas)
+            tagged += len(batch)
+    return tagged
+
+
+if __name__ == "__main__":
+    import argparse
+    from langchain_chroma import Chroma
+    from Knowledge_Store import record_index_update
+    from MY_Model import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Tag an existing Chroma collection with specialty / doc_type / pub_year")
+    parser.add_argument("persist_dir")
+    parser.add_argument("collection")
+    args = parser.parse_args()
+
+    store = Chroma(collection_name=args.collection, persist_directory=args.persist_dir)
+    facets = FacetIndex(args.persist_dir, args.collection)
+    n = backfill_collection(store._collection, facets)
+    record_index_update(store, args.persist_dir, args.collection, EMBEDDING_MODEL_NAME)
+    print(f"Tagged {n} chunks; facet counts: {facets.counts()}")
@@ -0,0 +1,88 @@
+# Metrics.py
+"""
+Process-wide metrics registry for the reasoning pipeline.
+
+Counters, gauges and timings are kept in memory and exposed through
+`metrics.snapshot()`. Worker scripts embed the snapshot in their JSON output
+so the backend can surface it; in-process callers can read it directly.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Record one duration sample (count / total / min / max / last)."""
+        with self._lock:
+            t = self._timings.get(name)
+            if t is None:
+                t = self._timings[name] = {"count": 0, "total_s": 0.0, "min_s": seconds, "max_s": seconds, "last_s": seconds}
+            t["count"] += 1
+            t["total_s"] += seconds
+            t["min_s"] = min(t["min_s"], seconds)
+            t["max_s"] = max(t["max_s"], seconds)
+            t["last_s"] = seconds
+
+    @contextmanager
+    def timed(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def register_collector(self, name: str, fn: Callable[[], Dict[str, Any]]) -> None:
+        """Register a callable evaluated lazily at snapshot time (e.g. pool stats)."""
+        with self._lock:
+            self._collectors[name] = fn
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timings = {}
+            for name, t in self._timings.items():
+                timings[name] = dict(t, avg_s=t["total_s"] / t["count"] if t["count"] else 0.0)
+            collectors = dict(self._collectors)
+
+        collected = {}
+        for name, fn in collectors.items():
+            try:
+                collected[name] = fn()
+            except Exception as e:
+                collected[name] = {"error": str(e)}
+
+        return {
+            "counters": counters,
+            "gauges": gauges,
+            "timings": timings,
+            "collectors": collected,
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+
+
+metrics = MetricsRegistry()
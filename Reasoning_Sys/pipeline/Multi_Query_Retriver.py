@@ -1,8 +1,12 @@
 import asyncio
+import hashlib
 import inspect
+import json
+import math
+import os
+import threading
 import traceback
-from typing import List, Set, Tuple, Optional
-from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence, Set, Tuple, Optional
 
 # Try imports that match newer/older LangChain packaging
 try:
@@ -28,6 +32,76 @@ if sys.stdout.encoding != 'utf-8':
         # Fallback for older python or restricted environments
         sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
+from Client_Registry import run_sync
+from Disk_Cache import DiskLRUCache
+from Metrics import metrics
+
+# --- Adaptive rewriting CONFIG ---
+# Rewrites are requested only when the original query's best hit is below
+# this similarity, or its hits come from fewer than MIN_SOURCES documents.
+MULTIQUERY_MIN_SIMILARITY = float(os.environ.get("MULTIQUERY_MIN_SIMILARITY", "0.55"))
+MULTIQUERY_MIN_SOURCES = int(os.environ.get("MULTIQUERY_MIN_SOURCES", "2"))
+REWRITE_CACHE_PATH = os.environ.get(
+    "REWRITE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "query_rewrites.sqlite"),
+)
+REWRITE_CACHE_MAX_MB = int(os.environ.get("REWRITE_CACHE_MAX_MB", "16"))
+# Max retriever calls in flight per request (non-Chroma retrievers)
+MULTIQUERY_MAX_CONCURRENCY = int(os.environ.get("MULTIQUERY_MAX_CONCURRENCY", "8"))
+# Per-query diagnostics (queries, per-query hit counts, fusion/cutoff summaries)
+MULTIQUERY_VERBOSE = os.environ.get("MULTIQUERY_VERBOSE", "0") not in ("0", "false", "False")
+# Reciprocal-rank fusion constant for hybrid (BM25 + dense) retrieval
+HYBRID_RRF_K = int(os.environ.get("HYBRID_RRF_K", "60"))
+
+# --- Score cutoffs CONFIG (dense similarity, cosine-like scale) ---
+# Per-query floor: hits below it never reach the context
+MULTIQUERY_MIN_SCORE = float(os.environ.get("MULTIQUERY_MIN_SCORE", "0.30"))
+# Gap cutoff: a query's list is cut at the first drop between neighbours >= this (0 = off)
+MULTIQUERY_SCORE_GAP = float(os.environ.get("MULTIQUERY_SCORE_GAP", "0.15"))
+# Global cap on unique documents across all queries (0 = no cap)
+MULTIQUERY_MAX_TOTAL = int(os.environ.get("MULTIQUERY_MAX_TOTAL", "40"))
+# Early stop: once ENOUGH_EVIDENCE unique hits score >= CONFIDENT_SCORE, later queries are skipped (0 = off)
+MULTIQUERY_CONFIDENT_SCORE = float(os.environ.get("MULTIQUERY_CONFIDENT_SCORE", "0.75"))
+MULTIQUERY_ENOUGH_EVIDENCE = int(os.environ.get("MULTIQUERY_ENOUGH_EVIDENCE", "8"))
+
+_rewrite_cache: Optional[DiskLRUCache] = None
+_rewrite_cache_lock = threading.Lock()
+_adaptive_stats = {"requests": 0, "rewrites_skipped": 0, "deterministic_queries": 0, "early_stops": 0, "score_cut": 0}
+_stats_lock = threading.Lock()
+
+
+def _log(message: str) -> None:
+    if MULTIQUERY_VERBOSE:
+        print(message)
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _stats_lock:
+        _adaptive_stats[name] += n
+    metrics.incr(f"multi_query.{name}", n)
+
+
+def _get_rewrite_cache() -> DiskLRUCache:
+    global _rewrite_cache
+    if _rewrite_cache is None:
+        with _rewrite_cache_lock:
+            if _rewrite_cache is None:
+                _rewrite_cache = DiskLRUCache(
+                    REWRITE_CACHE_PATH, max_bytes=REWRITE_CACHE_MAX_MB * 1024 * 1024, name="rewrites"
+                )
+    return _rewrite_cache
+
+
+def adaptive_stats() -> Dict[str, Any]:
+    requests = _adaptive_stats["requests"]
+    return {
+        **_adaptive_stats,
+        "skip_fraction": round(_adaptive_stats["rewrites_skipped"] / requests, 4) if requests else None,
+    }
+
+
+metrics.register_collector("multi_query", adaptive_stats)
+
 
 def build_multi_query_prompt(num_queries: int,k_per_query: int) -> ChatPromptTemplate:
     """
@@ -55,32 +129,41 @@ Original question:
 
 def _maybe_await(fn, *args, **kwargs):
     """
-    Call `fn`. If fn is an async function or returns a coroutine, run it synchronously.
+    Call a sync retriever method. Async retrievers are awaited natively by
+    amulti_query_retrieve, so a coroutine here is a caller error rather than
+    something to spin up a private event loop for.
     """
-    try:
-        if asyncio.iscoroutinefunction(fn):
-            return asyncio.run(fn(*args, **kwargs))
-        res = fn(*args, **kwargs)
-        if asyncio.iscoroutine(res):
-            return asyncio.run(res)
-        return res
-    except Exception:
-        # Try calling once more and see if it returns a coroutine
-        try:
-            res = fn(*args, **kwargs)
-            if asyncio.iscoroutine(res):
-                return asyncio.run(res)
-            return res
-        except Exception:
-            traceback.print_exc()
-            raise
+    res = fn(*args, **kwargs)
+    if asyncio.iscoroutine(res):
+        res.close()
+        raise TypeError(f"{getattr(fn, '__name__', fn)} is async; use amulti_query_retrieve")
+    return res
+
+
+def _parse_queries(result: Any, num_queries: int) -> List[str]:
+    # Extract result text
+    if hasattr(result, "content"):
+        text = result.content
+    elif hasattr(result, "text"):
+        text = result.text
+    else:
+        text = str(result)
+
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    alt_queries = lines[:num_queries]
+    if not alt_queries:
+        print("[generate_alternative_queries] WARNING: LLM returned no queries. Raw output preview:")
+        print(text[:1000])
+    else:
+        _log(f"[generate_alternative_queries] Generated {len(alt_queries)} alternative queries.")
+    return alt_queries
 
 
 def generate_alternative_queries(
     llm: BaseChatModel,
     user_query: str,
     num_queries: int = 10,
-    k_per_query: int =200000
+    k_per_query: int = 10
 ) -> List[str]:
     """
     Use the llm to generate alternative queries. Returns up to num_queries strings.
@@ -106,21 +189,55 @@ def generate_alternative_queries(
             traceback.print_exc()
             return []
 
-    # Extract result text
-    if hasattr(result, "content"):
-        text = result.content
-    elif hasattr(result, "text"):
-        text = result.text
-    else:
-        text = str(result)
+    return _parse_queries(result, num_queries)
 
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-    alt_queries = lines[:num_queries]
-    if not alt_queries:
-        print("[generate_alternative_queries] WARNING: LLM returned no queries. Raw output preview:")
-        print(text[:1000])
-    else:
-        print(f"[generate_alternative_queries] Generated {len(alt_queries)} alternative queries.")
+
+async def agenerate_alternative_queries(
+    llm: BaseChatModel,
+    user_query: str,
+    num_queries: int = 10,
+) -> List[str]:
+    """Async variant of generate_alternative_queries (awaits the LLM natively)."""
+    chain: Runnable = build_multi_query_prompt(num_queries, 0) | llm
+    try:
+        result = await chain.ainvoke({"question": user_query})
+    except Exception:
+        traceback.print_exc()
+        return []
+    return _parse_queries(result, num_queries)
+
+
+def _rewrite_key(llm: BaseChatModel, user_query: str, num_queries: int) -> str:
+    normalized = " ".join(user_query.split())
+    model = getattr(llm, "model", None) or type(llm).__name__
+    return hashlib.sha256(f"{model}\x00{num_queries}\x00{normalized}".encode("utf-8")).hexdigest()
+
+
+def cached_alternative_queries(llm: BaseChatModel, user_query: str, num_queries: int) -> List[str]:
+    """
+    generate_alternative_queries behind a disk cache keyed by rewrite model,
+    num_queries and the whitespace-normalized query.
+    """
+    key = _rewrite_key(llm, user_query, num_queries)
+    cache = _get_rewrite_cache()
+    raw = cache.get(key)
+    if raw is not None:
+        return json.loads(raw.decode("utf-8"))
+    alt_queries = generate_alternative_queries(llm, user_query, num_queries=num_queries)
+    if alt_queries:
+        cache.set(key, json.dumps(alt_queries).encode("utf-8"))
+    return alt_queries
+
+
+async def acached_alternative_queries(llm: BaseChatModel, user_query: str, num_queries: int) -> List[str]:
+    key = _rewrite_key(llm, user_query, num_queries)
+    cache = _get_rewrite_cache()
+    raw = cache.get(key)
+    if raw is not None:
+        return json.loads(raw.decode("utf-8"))
+    alt_queries = await agenerate_alternative_queries(llm, user_query, num_queries=num_queries)
+    if alt_queries:
+        cache.set(key, json.dumps(alt_queries).encode("utf-8"))
     return alt_queries
 
 
@@ -214,55 +331,487 @@ def _call_retriever(base_retriever, query: str) -> List[Document]:
     return []
 
 
-def multi_query_retrieve(
+async def _acall_retriever(base_retriever, query: str) -> List[Document]:
+    """
+    Await the retriever's native async API when it has one (LangChain
+    retrievers expose ainvoke); sync-only retrievers run in a worker thread.
+    """
+    if hasattr(base_retriever, "ainvoke"):
+        out = await base_retriever.ainvoke(query)
+    elif hasattr(base_retriever, "aget_relevant_documents"):
+        out = await base_retriever.aget_relevant_documents(query)
+    else:
+        out = await asyncio.to_thread(_call_retriever, base_retriever, query)
+    if out is None:
+        return []
+    if isinstance(out, Document):
+        return [out]
+    return list(out)
+
+
+def _chroma_target(base_retriever):
+    """
+    Return (collection, embeddings) when base_retriever is a similarity
+    VectorStoreRetriever over a Chroma store, else None.
+    """
+    vectorstore = getattr(base_retriever, "vectorstore", None)
+    collection = getattr(vectorstore, "_collection", None)
+    embeddings = getattr(vectorstore, "embeddings", None) or getattr(vectorstore, "_embedding_function", None)
+    if collection is None or embeddings is None or not hasattr(embeddings, "embed_documents"):
+        return None
+    if getattr(base_retriever, "search_type", "similarity") != "similarity":
+        return None
+    return collection, embeddings
+
+
+def _distance_to_similarity(distance: float, space: str) -> float:
+    # Chroma returns distances; map them onto a cosine-like [.., 1] scale
+    if space in ("cosine", "ip"):
+        # cosine: 1 - cos; ip: 1 - dot
+        return 1.0 - distance
+    # l2 (Chroma's default) returns squared distance; for unit vectors d = 2 - 2*cos
+    return 1.0 - distance / 2.0
+
+
+def _collection_space(collection) -> str:
+    return (getattr(collection, "metadata", None) or {}).get("hnsw:space", "l2")
+
+
+def _vector_similarity(query_vec: Sequence[float], doc_vec: Sequence[float], space: str) -> float:
+    """Similarity of a stored vector to a query vector on the same scale as the search results."""
+    dot = sum(a * b for a, b in zip(query_vec, doc_vec))
+    if space == "cosine":
+        norm = math.sqrt(sum(a * a for a in query_vec) * sum(b * b for b in doc_vec))
+        distance = 1.0 - dot / norm if norm else 1.0
+    elif space == "ip":
+        distance = 1.0 - dot
+    else:
+        distance = sum((a - b) * (a - b) for a, b in zip(query_vec, doc_vec))
+    return _distance_to_similarity(distance, space)
+
+
+def _quantized_search(vector_index, vectors, k: int, allowed_ids: Optional[Set[str]]) -> List[List[Tuple[Document, float]]]:
+    results = []
+    for vec in vectors:
+        hits = vector_index.search(vec, k, allowed_ids=allowed_ids)
+        results.append([
+            (Document(id=c["id"], page_content=c["text"], metadata=dict(c["metadata"])), sim) for c, sim in hits
+        ])
+    return results
+
+
+async def _aembed_queries(embeddings, queries: List[str]) -> List[List[float]]:
+    """All queries in ONE embed_documents call (awaited natively when supported)."""
+    if hasattr(embeddings, "aembed_documents"):
+        return await embeddings.aembed_documents(queries)
+    return await asyncio.to_thread(embeddings.embed_documents, queries)
+
+
+def _search_vectors(
+    collection,
+    vectors: List[List[float]],
+    k: int,
+    where: Optional[Dict[str, Any]] = None,
+    vector_index=None,
+    allowed_ids: Optional[Set[str]] = None,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    Search query vectors in ONE collection.query call (multiple
+    query_embeddings). Returns (doc, similarity) lists, one per vector.
+
+    With a vector_index (Quantized_Store.QuantizedIndex or an
+    Ann_Snapshot.AnnSnapshot) the search runs on its binary codes + float32
+    rescoring instead; allowed_ids then applies the metadata filter in
+    place of `where`.
+    """
+    if vector_index is not None:
+        return _quantized_search(vector_index, vectors, k, allowed_ids)
+    res = collection.query(
+        query_embeddings=vectors,
+        n_results=k,
+        where=where,
+        include=["documents", "metadatas", "distances"],
+    )
+    space = _collection_space(collection)
+    results: List[List[Tuple[Document, float]]] = []
+    for qi in range(len(vectors)):
+        hits = []
+        for doc_id, text, meta, dist in zip(
+            res["ids"][qi], res["documents"][qi], res["metadatas"][qi], res["distances"][qi]
+        ):
+            doc = Document(id=doc_id, page_content=text or "", metadata=dict(meta or {}))
+            hits.append((doc, _distance_to_similarity(float(dist), space)))
+        results.append(hits)
+    return results
+
+
+def _doc_key(d: Document) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    meta_items = tuple(sorted((k, str(v)) for k, v in (d.metadata or {}).items()))
+    return d.page_content or "", meta_items
+
+
+async def _asearch_until_confident(
+    collection,
+    vectors: List[List[float]],
+    k: int,
+    where: Optional[Dict[str, Any]],
+    vector_index,
+    allowed_ids: Optional[Set[str]],
+    results: List[List[Tuple[Document, float]]],
+    *,
+    min_score: float,
+    score_gap: float,
+    confident_score: float,
+    enough_evidence: int,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    Search `vectors` in order and append their hit lists to `results`.
+
+    With early stopping off (enough_evidence 0) they go out in one
+    multi-vector query. Otherwise they are issued one at a time, and the
+    rest are never searched once enough_evidence unique hits that survive
+    the score cutoffs reach confident_score (hits already in `results`
+    count too). The query embeddings stay one batched call either way.
+    """
+    if not enough_evidence:
+        results += await asyncio.to_thread(_search_vectors, collection, vectors, k, where, vector_index, allowed_ids)
+        return results
+
+    confident: Set[Tuple[str, Tuple[Tuple[str, str], ...]]] = set()
+
+    def count(hits) -> None:
+        confident.update(_doc_key(d) for d, sim in _cut_by_score(hits, min_score, score_gap) if sim >= confident_score)
+
+    for hits in results:
+        count(hits)
+    for i, vec in enumerate(vectors):
+        if len(confident) >= enough_evidence:
+            _count("early_stops")
+            _log(f"[multi_query_retrieve] {len(confident)} hits >= {confident_score:.2f}; "
+                 f"skipping the remaining {len(vectors) - i} queries.")
+            break
+        hits = (await asyncio.to_thread(_search_vectors, collection, [vec], k, where, vector_index, allowed_ids))[0]
+        results.append(hits)
+        count(hits)
+    return results
+
+
+def _needs_rewrite(hits: List[Tuple[Document, float]], min_similarity: float, min_sources: int) -> bool:
+    if not hits:
+        return True
+    if max(sim for _, sim in hits) < min_similarity:
+        return True
+    sources = {str((d.metadata or {}).get("source", d.id)) for d, _ in hits}
+    return len(sources) < min_sources
+
+
+def _cut_by_score(hits: List[Tuple[Document, Optional[float]]], min_score: float, gap: float) -> List[Tuple[Document, Optional[float]]]:
+    """
+    Drop hits below min_score, then cut the (best-first) list at the first
+    drop between neighbours of at least `gap`. Hits without a score (plain
+    retrievers) are kept as they are.
+    """
+    if not hits or any(sim is None for _, sim in hits):
+        return hits
+    hits = sorted(hits, key=lambda h: h[1], reverse=True)
+    kept = [h for h in hits if h[1] >= min_score]
+    if gap > 0:
+        for i in range(1, len(kept)):
+            if kept[i - 1][1] - kept[i][1] >= gap:
+                kept = kept[:i]
+                break
+    return kept
+
+
+def _fuse_with_lexical(
+    dense_results: List[List[Tuple[Document, Optional[float]]]],
+    queries: List[str],
+    lexical_index,
+    collection,
+    k: int,
+    allowed_ids: Optional[Set[str]] = None,
+    query_vectors: Optional[List[List[float]]] = None,
+    vector_index=None,
+) -> List[Tuple[Document, Optional[float]]]:
+    """
+    Reciprocal-rank fusion of the dense result lists and a BM25 list per
+    query, returned as (doc, best dense similarity) in fused order.
+    Lexical-only hits are fetched from the collection by id; with
+    query_vectors their stored embeddings are scored against every query
+    (None when the collection has no vector for them), so they carry a
+    dense score like every other hit. allowed_ids (from a metadata filter)
+    restricts the BM25 candidates. With a vector_index the hits are read
+    from it first (cosine, the scale of its dense scores), so a mapped
+    snapshot serves fusion without touching the collection's vectors.
+    """
+    scores: Dict[str, float] = {}
+    docs_by_id: Dict[str, Document] = {}
+    best_dense: Dict[str, Optional[float]] = {}
+    for hits in dense_results:
+        for rank, (d, sim) in enumerate(hits):
+            doc_id = getattr(d, "id", None)
+            if doc_id is None:
+                continue
+            docs_by_id.setdefault(doc_id, d)
+            prev = best_dense.get(doc_id)
+            if sim is not None and (prev is None or sim > prev):
+                best_dense[doc_id] = sim
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (HYBRID_RRF_K + rank + 1)
+    for q in queries:
+        hits = lexical_index.search(q, k if allowed_ids is None else k * 4)
+        if allowed_ids is not None:
+            hits = [h for h in hits if h[0] in allowed_ids][:k]
+        for rank, (doc_id, _) in enumerate(hits):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (HYBRID_RRF_K + rank + 1)
+
+    limit = k * len(queries)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+    missing = [doc_id for doc_id in ranked if doc_id not in docs_by_id]
+    if missing and vector_index is not None:
+        for doc_id, (chunk, vec) in vector_index.lookup(missing).items():
+            docs_by_id[doc_id] = Document(id=doc_id, page_content=chunk["text"], metadata=dict(chunk["metadata"]))
+            if query_vectors:
+                best_dense[doc_id] = max(_vector_similarity(q, vec, "cosine") for q in query_vectors)
+    unread = [doc_id for doc_id in missing if doc_id not in docs_by_id]
+    if unread:
+        include = ["documents", "metadatas"] + (["embeddings"] if query_vectors else [])
+        got = collection.get(ids=unread, include=include)
+        embeddings = got.get("embeddings") if query_vectors else None
+        if embeddings is None:
+            embeddings = [None] * len(got["ids"])
+        space = _collection_space(collection)
+        for doc_id, text, meta, vec in zip(got["ids"], got["documents"], got["metadatas"], embeddings):
+            docs_by_id[doc_id] = Document(id=doc_id, page_content=text or "", metadata=dict(meta or {}))
+            if vec is not None:
+                vec = [float(x) for x in vec]
+                best_dense[doc_id] = max(_vector_similarity(q, vec, space) for q in query_vectors)
+    lexical_only = sum(1 for doc_id in missing if doc_id in docs_by_id)
+    _log(f"[multi_query_retrieve] hybrid fusion: {len(ranked)} candidates ({lexical_only} lexical-only).")
+    # ids deleted since the lexical segment was written simply drop out here
+    return [(docs_by_id[doc_id], best_dense.get(doc_id)) for doc_id in ranked if doc_id in docs_by_id]
+
+
+async def amulti_query_retrieve(
     base_retriever,
     llm: BaseChatModel,
     user_query: str,
     *,
     num_queries: int = 10,
-    k_per_query: int = 200000,
+    k_per_query: int = 10,
+    adaptive: bool = True,
+    min_similarity: float = MULTIQUERY_MIN_SIMILARITY,
+    min_sources: int = MULTIQUERY_MIN_SOURCES,
+    min_score: Optional[float] = None,
+    score_gap: Optional[float] = None,
+    max_total: Optional[int] = None,
+    confident_score: Optional[float] = None,
+    enough_evidence: Optional[int] = None,
+    lexical_index=None,
+    where: Optional[Dict[str, Any]] = None,
+    allowed_ids: Optional[Set[str]] = None,
+    vector_index=None,
+    sub_queries: Optional[List[str]] = None,
+    max_concurrency: int = MULTIQUERY_MAX_CONCURRENCY,
 ) -> List[Document]:
     """
-    Generate alternative queries via LLM and retrieve unique documents from base_retriever.
+    Retrieve unique documents for user_query, widening recall with LLM
+    rewrites only when needed. Safe to await inside a running event loop.
 
-    - base_retriever: object supporting get_relevant_documents/_get_relevant_documents/invoke
+    - base_retriever: LangChain retriever (ainvoke) or any object supporting
+      get_relevant_documents/_get_relevant_documents/invoke
     - llm: BaseChatModel used to generate alternative queries
     - user_query: original query
     - num_queries: how many alternative rewrites to ask for (LLM may return fewer)
-    - k_per_query: limit docs per query (post-fetch trimming)
+    - k_per_query: max docs fetched per query (before the score cutoffs)
+    - adaptive: search the original query first and skip the rewrite LLM
+      when its best similarity >= min_similarity and its hits span at least
+      min_sources documents (Chroma-backed retrievers only)
+    - min_score / score_gap: per-query cutoffs on the similarity curve; hits
+      below min_score are dropped and each list is cut at the first drop of
+      at least score_gap between neighbours (see _cut_by_score)
+    - max_total: global cap on unique documents across all queries
+    - confident_score / enough_evidence: once that many unique hits score at
+      least confident_score, the remaining queries are not searched (the
+      original query alone reaching it also skips the rewrite LLM)
+      (the five cutoffs default to the MULTIQUERY_* settings; 0 turns one off)
+    - lexical_index: optional Lexical_Index.LexicalIndex over the same
+      collection; when given, BM25 and dense rankings of every query are
+      combined with reciprocal-rank fusion
+    - where / allowed_ids: a resolved metadata filter (Metadata_Filter.resolve_filter);
+      `where` restricts the Chroma search, allowed_ids the BM25 candidates.
+      Non-Chroma retrievers must be built with the filter already applied.
+    - vector_index: optional QuantizedIndex / AnnSnapshot over the same
+      collection; dense search then runs on it instead of Chroma
+    - sub_queries: precomputed alternative queries (Facet_Queries); when
+      given the rewrite LLM is never called and all queries are embedded
+      in one batch
+    - max_concurrency: retriever calls in flight (non-Chroma retrievers)
+
+    Chroma-backed retrievers embed all queries in one call and search them
+    in one multi-vector query, or one query at a time while the early stop
+    is on (see _asearch_until_confident); any other retriever is called
+    once per query under a semaphore. Rewrites are cached by normalized query.
+
+    Each returned document carries its best dense similarity in
+    metadata["retrieval_score"]; the list is ordered best first, except
+    after hybrid fusion where the fused rank order is kept and min_score
+    is applied again to the fused list (lexical-only hits are scored
+    against the query vectors). Plain retrievers return no scores, so only
+    the global cap applies to them.
     """
-    alt_queries = generate_alternative_queries(llm, user_query, num_queries=num_queries,k_per_query=k_per_query)
-    queries = [user_query] + alt_queries
+    _count("requests")
+    min_score = MULTIQUERY_MIN_SCORE if min_score is None else min_score
+    score_gap = MULTIQUERY_SCORE_GAP if score_gap is None else score_gap
+    max_total = MULTIQUERY_MAX_TOTAL if max_total is None else max_total
+    confident_score = MULTIQUERY_CONFIDENT_SCORE if confident_score is None else confident_score
+    enough_evidence = MULTIQUERY_ENOUGH_EVIDENCE if enough_evidence is None else enough_evidence
 
-    all_docs: List[Document] = []
-    seen_keys: Set[Tuple[str, Tuple[Tuple[str, str], ...]]] = set()
+    async def alternatives() -> List[str]:
+        if sub_queries is not None:
+            return list(sub_queries)
+        return await acached_alternative_queries(llm, user_query, num_queries)
 
-    def process_query(i: int, q: str) -> List[Document]:
-        print(f"[multi_query_retrieve] query #{i}: {q[:200]!r}")
+    if sub_queries is not None:
+        _count("deterministic_queries")
+
+    results: Optional[List[List[Tuple[Document, Optional[float]]]]] = None
+    vectors: Optional[List[List[float]]] = None
+    target = _chroma_target(base_retriever)
+    if target is not None:
+        collection, embeddings = target
+        search_k = min((getattr(base_retriever, "search_kwargs", None) or {}).get("k", k_per_query), k_per_query)
+        search = dict(min_score=min_score, score_gap=score_gap, confident_score=confident_score,
+                      enough_evidence=enough_evidence)
         try:
-            return _call_retriever(base_retriever, q) or []
+            if adaptive and sub_queries is None:
+                _log(f"[multi_query_retrieve] query #0: {user_query[:200]!r}")
+                queries = [user_query]
+                vectors = await _aembed_queries(embeddings, queries)
+                first = (await asyncio.to_thread(
+                    _search_vectors, collection, vectors, search_k, where, vector_index, allowed_ids
+                ))[0]
+                strong = sum(1 for _, sim in first if sim >= confident_score)
+                if not _needs_rewrite(first, min_similarity, min_sources) or (enough_evidence and strong >= enough_evidence):
+                    best = max(sim for _, sim in first)
+                    _log(f"[multi_query_retrieve] original query sufficient (best similarity {best:.3f}); skipping rewrites.")
+                    _count("rewrites_skipped")
+                    results = [first]
+                else:
+                    alt_queries = await acached_alternative_queries(llm, user_query, num_queries)
+                    queries += alt_queries
+                    for i, q in enumerate(alt_queries, start=1):
+                        _log(f"[multi_query_retrieve] query #{i}: {q[:200]!r}")
+                    results = [first]
+                    if alt_queries:
+                        alt_vectors = await _aembed_queries(embeddings, alt_queries)
+                        vectors += alt_vectors
+                        results = await _asearch_until_confident(
+                            collection, alt_vectors, search_k, where, vector_index, allowed_ids, results, **search
+                        )
+            else:
+                queries = [user_query] + await alternatives()
+                for i, q in enumerate(queries):
+                    _log(f"[multi_query_retrieve] query #{i}: {q[:200]!r}")
+                vectors = await _aembed_queries(embeddings, queries)
+                results = await _asearch_until_confident(
+                    collection, vectors, search_k, where, vector_index, allowed_ids, [], **search
+                )
+            # queries skipped by the early stop take no part in fusion either
+            queries, vectors = queries[: len(results)], vectors[: len(results)]
         except Exception:
             traceback.print_exc()
-            return []
+            print("[multi_query_retrieve] batched search failed; falling back to per-query retrieval.")
+            results = vectors = None
+
+    if results is None:
+        queries = [user_query] + await alternatives()
+        for i, q in enumerate(queries):
+            _log(f"[multi_query_retrieve] query #{i}: {q[:200]!r}")
+
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
 
-    # Use ThreadPoolExecutor for parallel retrieval
-    with ThreadPoolExecutor(max_workers=min(len(queries), 8)) as executor:
-        results = list(executor.map(lambda p: process_query(*p), enumerate(queries)))
+        async def process_query(q: str) -> List[Document]:
+            async with semaphore:
+                try:
+                    return await _acall_retriever(base_retriever, q)
+                except Exception:
+                    traceback.print_exc()
+                    return []
+
+        results = [[(d, None) for d in docs] for docs in await asyncio.gather(*(process_query(q) for q in queries))]
+
+    # per-query threshold + gap cutoff, before fusion so weak dense hits never get RRF credit
+    before = sum(len(hits) for hits in results)
+    results = [_cut_by_score(hits, min_score, score_gap) for hits in results]
+    cut = before - sum(len(hits) for hits in results)
+    if cut:
+        _count("score_cut", cut)
+        _log(f"[multi_query_retrieve] score cutoffs dropped {cut} of {before} hits "
+              f"(min {min_score:.2f}, gap {score_gap:.2f}).")
+
+    trim = k_per_query
+    fused = False
+    if lexical_index is not None and target is not None and len(lexical_index):
+        try:
+            fused_hits = await asyncio.to_thread(
+                _fuse_with_lexical, results, queries, lexical_index, target[0], search_k, allowed_ids, vectors,
+                vector_index,
+            )
+            if vectors is not None:
+                # the floor applies to lexical-only hits too (scored against the query vectors);
+                # one whose vector is missing cannot show it clears the floor and is dropped
+                kept = [(d, sim) for d, sim in fused_hits if sim is not None and sim >= min_score]
+                if len(kept) < len(fused_hits):
+                    _count("score_cut", len(fused_hits) - len(kept))
+                    _log(f"[multi_query_retrieve] min score dropped {len(fused_hits) - len(kept)} fused hits.")
+                fused_hits = kept
+            results, trim, fused = [fused_hits], len(fused_hits), True
+        except Exception:
+            traceback.print_exc()
+            print("[multi_query_retrieve] hybrid fusion failed; using dense results only.")
 
-    for i, docs in enumerate(results):
-        if not docs:
-            print(f"[multi_query_retrieve] No documents returned for query #{i}.")
+    collected: List[Tuple[Document, Optional[float]]] = []
+    position: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], int] = {}
+
+    for i, hits in enumerate(results):
+        if not hits:
+            _log(f"[multi_query_retrieve] No documents returned for query #{i}.")
             continue
 
-        docs = docs[:k_per_query]
-        print(f"[multi_query_retrieve] Retrieved {len(docs)} docs for query #{i} (trimmed to {k_per_query}).")
+        hits = hits[:trim]
+        _log(f"[multi_query_retrieve] Retrieved {len(hits)} docs for query #{i} (trimmed to {trim}).")
+
+        for d, sim in hits:
+            key = _doc_key(d)
+            if key not in position:
+                position[key] = len(collected)
+                collected.append((d, sim))
+            elif sim is not None:
+                j = position[key]
+                prev = collected[j][1]
+                if prev is None or sim > prev:
+                    collected[j] = (collected[j][0], sim)
 
-        for d in docs:
-            meta_items = tuple(sorted((k, str(v)) for k, v in (d.metadata or {}).items()))
-            key = (d.page_content or "", meta_items)
-            if key not in seen_keys:
-                seen_keys.add(key)
-                all_docs.append(d)
+    if not fused and collected and all(sim is not None for _, sim in collected):
+        collected.sort(key=lambda h: h[1], reverse=True)
+    if max_total and len(collected) > max_total:
+        _log(f"[multi_query_retrieve] global cap: keeping {max_total} of {len(collected)} documents.")
+        collected = collected[:max_total]
+
+    all_docs: List[Document] = []
+    for d, sim in collected:
+        if sim is not None:
+            d.metadata["retrieval_score"] = round(float(sim), 6)
+        all_docs.append(d)
 
-    print(f"[multi_query_retrieve] Total unique documents collected: {len(all_docs)}")
+    _log(f"[multi_query_retrieve] Total unique documents collected: {len(all_docs)}")
     return all_docs
+
+
+def multi_query_retrieve(base_retriever, llm: BaseChatModel, user_query: str, **kwargs) -> List[Document]:
+    """
+    Synchronous wrapper over amulti_query_retrieve (same keyword arguments).
+    Call it from threads without a running loop (CLI scripts, worker
+    threads); inside an event loop await amulti_query_retrieve instead.
+    """
+    return run_sync(amulti_query_retrieve(base_retriever, llm, user_query, **kwargs))
@@ -0,0 +1,153 @@
+# Near_Dup.py
+"""
+Near-duplicate suppression for retrieved chunks.
+
+At ingest every chunk gets a 64-bit SimHash of its word 3-shingles, stored
+in metadata as `simhash` (hex string; Chroma metadata ints are signed
+64-bit). At query time `diversify` walks the ranked candidates once and
+
+  - drops chunks within NEAR_DUP_MAX_HAMMING bits of an already selected
+    chunk (the same passage re-indexed from another copy of a PDF, or
+    overlapping splitter windows),
+  - orders the survivors by maximal marginal relevance (MMR):
+        MMR_LAMBDA * relevance - (1 - MMR_LAMBDA) * max similarity to the chunks already picked
+    where relevance is metadata['retrieval_score'] (or the rank when a
+    candidate has none) and similarity is SimHash agreement (1 for
+    identical signatures, 0 at 32+ differing bits, i.e. unrelated text);
+    MMR_LAMBDA=1 keeps the retrieval order,
+  - defers chunks from a source that already supplied MAX_PER_SOURCE
+    chunks, back-filling with them only if the result would be short.
+
+Candidate lookups go through 4 x 16-bit band buckets: two signatures within
+3 bits must agree on at least one band, so each check touches a handful of
+signatures and the whole pass stays O(k). (Thresholds above 3 bits are
+only caught when the pair still shares a band.) The MMR pass compares
+each pick against the remaining candidates once, O(k * limit).
+"""
+
+import hashlib
+import os
+import re
+from typing import Dict, List, Optional, Sequence
+
+from Metrics import metrics
+
+NEAR_DUP_MAX_HAMMING = int(os.environ.get("NEAR_DUP_MAX_HAMMING", "3"))
+MAX_PER_SOURCE = int(os.environ.get("RETRIEVAL_MAX_PER_SOURCE", "4"))
+# Relevance / novelty trade-off of the MMR selection (1.0 = rank order only)
+MMR_LAMBDA = float(os.environ.get("MMR_LAMBDA", "0.7"))
+
+_WORD_RE = re.compile(r"\w+")
+_BANDS = 4
+_BAND_BITS = 16
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+
+def simhash(text: str, shingle: int = 3) -> int:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < shingle:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i : i + shingle]) for i in range(len(words) - shingle + 1)]
+    weights = [0] * 64
+    for gram in grams:
+        h = int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little")
+        for bit in range(64):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    sig = 0
+    for bit in range(64):
+        if weights[bit] > 0:
+            sig |= 1 << bit
+    return sig
+
+
+def add_signatures(docs: Sequence) -> None:
+    """Set metadata['simhash'] on chunks before they are written to the store."""
+    for doc in docs:
+        doc.metadata["simhash"] = f"{simhash(doc.page_content or ''):016x}"
+
+
+def _signature(doc) -> int:
+    raw = (doc.metadata or {}).get("simhash")
+    if raw:
+        try:
+            return int(raw, 16)
+        except (TypeError, ValueError):
+            pass
+    # Chunks ingested before signatures existed
+    return simhash(doc.page_content or "")
+
+
+def _bands(sig: int) -> List[int]:
+    return [(i << _BAND_BITS) | ((sig >> (i * _BAND_BITS)) & _BAND_MASK) for i in range(_BANDS)]
+
+
+def _similarity(a: int, b: int) -> float:
+    # 0 differing bits -> 1.0; 32 (what unrelated texts average) or more -> 0.0
+    return max(0.0, 1.0 - bin(a ^ b).count("1") / 32.0)
+
+
+def _relevance(docs: Sequence) -> List[float]:
+    scores = [(d.metadata or {}).get("retrieval_score") for d in docs]
+    if docs and all(isinstance(x, (int, float)) for x in scores):
+        return [float(x) for x in scores]  # cosine-like, same 0..1 scale as _similarity
+    n = len(docs)
+    return [1.0 - i / n for i in range(n)]
+
+
+def diversify(
+    docs: Sequence,
+    *,
+    limit: Optional[int] = None,
+    max_per_source: int = MAX_PER_SOURCE,
+    max_hamming: int = NEAR_DUP_MAX_HAMMING,
+    mmr_lambda: float = MMR_LAMBDA,
+) -> List:
+    """Near-duplicate removal, MMR ordering and per-source capping of ranked candidates."""
+    limit = len(docs) if limit is None else limit
+    buckets: Dict[int, List[int]] = {}
+    pool: List = []
+    sigs: List[int] = []
+    dropped = 0
+
+    for doc in docs:
+        sig = _signature(doc)
+        bands = _bands(sig)
+        if any(bin(sig ^ other).count("1") <= max_hamming for b in bands for other in buckets.get(b, ())):
+            dropped += 1
+            continue
+        for b in bands:
+            buckets.setdefault(b, []).append(sig)
+        pool.append(doc)
+        sigs.append(sig)
+
+    relevance = _relevance(pool)
+    max_sim = [0.0] * len(pool)
+    remaining = list(range(len(pool)))
+    per_source: Dict[str, int] = {}
+    selected: List = []
+    deferred: List = []
+
+    while remaining and len(selected) < limit:
+        best = max(remaining, key=lambda i: (mmr_lambda * relevance[i] - (1.0 - mmr_lambda) * max_sim[i], -i))
+        remaining.remove(best)
+        doc = pool[best]
+        source = str((doc.metadata or {}).get("source", ""))
+        if max_per_source and per_source.get(source, 0) >= max_per_source:
+            deferred.append(doc)
+            continue
+        per_source[source] = per_source.get(source, 0) + 1
+        selected.append(doc)
+        if mmr_lambda < 1.0:
+            for i in remaining:
+                max_sim[i] = max(max_sim[i], _similarity(sigs[i], sigs[best]))
+
+    if len(selected) < limit:
+        selected.extend(deferred[: limit - len(selected)])
+
+    metrics.incr("near_dup.dropped", dropped)
+    metrics.incr("near_dup.deferred", len(deferred))
+    if dropped or deferred:
+        print(f"[Near_Dup] kept {len(selected)} of {len(docs)} chunks "
+              f"({dropped} near-duplicates dropped, {len(deferred)} deferred by source cap).")
+    return selected
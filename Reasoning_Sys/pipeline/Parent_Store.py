@@ -0,0 +1,193 @@
+# Parent_Store.py
+"""
+Small-to-big (parent-document) retrieval.
+
+Ingestion (SMALL_TO_BIG_ENABLED=1): every chunk produced by the writer's
+usual splitter becomes a *parent*. Parents are kept, zlib-compressed, in a
+side store next to the collection (parents.<collection>.sqlite) and only
+their small *child* chunks (CHILD_CHUNK_SIZE chars) are embedded, indexed
+and searched. Each child carries `parent_id` and its character span in
+the parent (`child_start`, `child_end`).
+
+Query time: `expand_to_parents` walks the final ranked hits and grows each
+child into the part of its parent that surrounds it, snapped to sentence
+boundaries, up to EXPAND_MAX_CHARS per hit and RETRIEVAL_TOKEN_BUDGET
+overall. Hits from the same parent that land close together are merged
+into one span. Chunks ingested without children pass through unchanged.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from Metrics import metrics
+
+SMALL_TO_BIG_ENABLED = os.environ.get("SMALL_TO_BIG_ENABLED", "0") not in ("0", "false", "False")
+CHILD_CHUNK_SIZE = int(os.environ.get("CHILD_CHUNK_SIZE", "500"))
+CHILD_CHUNK_OVERLAP = int(os.environ.get("CHILD_CHUNK_OVERLAP", "80"))
+# Context budget for the expanded hits (tokens, ~4 chars each) and per-hit ceiling (chars)
+RETRIEVAL_TOKEN_BUDGET = int(os.environ.get("RETRIEVAL_TOKEN_BUDGET", "2500"))
+EXPAND_MAX_CHARS = int(os.environ.get("EXPAND_MAX_CHARS", "1400"))
+CHARS_PER_TOKEN = 4
+# Spans of the same parent closer than this are merged
+_MERGE_GAP = 200
+_SENTENCE_ENDS = (". ", ".\n", "? ", "! ", "\n\n")
+
+
+def parent_id_for(doc: Any, index: int) -> str:
+    meta = doc.metadata or {}
+    raw = f"{meta.get('source', '')}|{meta.get('page', '')}|{index}|{doc.page_content}"
+    return "p-" + hashlib.blake2b(raw.encode("utf-8"), digest_size=10).hexdigest()
+
+
+def parents_path(persist_dir: str, collection_name: str) -> str:
+    return os.path.join(persist_dir, f"parents.{collection_name}.sqlite")
+
+
+class ParentStore:
+    """parent_id -> compressed parent text (SQLite, next to the collection)."""
+
+    def __init__(self, persist_dir: str, collection_name: str):
+        self.path = parents_path(persist_dir, collection_name)
+        os.makedirs(persist_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS parents (parent_id TEXT PRIMARY KEY, source TEXT, body BLOB NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_parents_source ON parents(source)")
+        self._conn.commit()
+
+    def add(self, items: Iterable[Tuple[str, str, str]]) -> None:
+        """items: (parent_id, source, text)"""
+        rows = [(pid, source, zlib.compress(text.encode("utf-8"), 6)) for pid, source, text in items]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO parents (parent_id, source, body) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def get_many(self, parent_ids: Iterable[str]) -> Dict[str, str]:
+        ids = list(set(parent_ids))
+        out: Dict[str, str] = {}
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i : i + 500]
+                rows = self._conn.execute(
+                    f"SELECT parent_id, body FROM parents WHERE parent_id IN ({','.join('?' * len(chunk))})", chunk
+                )
+                for pid, body in rows:
+                    out[pid] = zlib.decompress(body).decode("utf-8")
+        return out
+
+    def delete_source(self, source: str) -> int:
+        with self._lock:
+            n = self._conn.execute("DELETE FROM parents WHERE source = ?", (source,)).rowcount
+            self._conn.commit()
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM parents").fetchone()
+        return {"parents": count, "compressed_bytes": size}
+
+
+def make_children(parents: Sequence[Any], store: ParentStore,
+                  chunk_size: int = CHILD_CHUNK_SIZE, chunk_overlap: int = CHILD_CHUNK_OVERLAP) -> List[Any]:
+    """
+    Store `parents` in the side store and return their child chunks (to be
+    embedded and indexed in place of the parents).
+    """
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    children: List[Any] = []
+    stored = []
+    for index, parent in enumerate(parents):
+        pid = parent_id_for(parent, index)
+        meta = dict(parent.metadata or {})
+        stored.append((pid, str(meta.get("source", "")), parent.page_content or ""))
+        for child in splitter.create_documents([parent.page_content or ""], metadatas=[meta]):
+            start = child.metadata.pop("start_index", 0)
+            child.metadata.update(parent_id=pid, child_start=start, child_end=start + len(child.page_content))
+            children.append(child)
+    store.add(stored)
+    return children
+
+
+def _snap_start(text: str, pos: int) -> int:
+    if pos <= 0:
+        return 0
+    window = text[max(0, pos - 160) : pos]
+    best = max((window.rfind(end) for end in _SENTENCE_ENDS), default=-1)
+    if best < 0:
+        return pos
+    return max(0, pos - 160) + best + 2
+
+
+def _snap_end(text: str, pos: int) -> int:
+    if pos >= len(text):
+        return len(text)
+    window = text[pos : pos + 160]
+    found = [window.find(end) for end in _SENTENCE_ENDS if window.find(end) >= 0]
+    return pos + min(found) + 1 if found else pos
+
+
+def expand_to_parents(docs: Sequence[Any], store: Optional[ParentStore],
+                      token_budget: int = RETRIEVAL_TOKEN_BUDGET, max_chars: int = EXPAND_MAX_CHARS) -> List[Any]:
+    """Grow child hits into budgeted parent spans, best hit first; others pass through."""
+    if store is None or not any((d.metadata or {}).get("parent_id") for d in docs):
+        return list(docs)
+    budget = token_budget * CHARS_PER_TOKEN
+    parents = store.get_many(d.metadata["parent_id"] for d in docs if (d.metadata or {}).get("parent_id"))
+
+    out: List[Any] = []
+    spans: Dict[str, List[List[int]]] = {}  # parent_id -> [[start, end, out_index], ...]
+    used = 0
+    for doc in docs:
+        meta = doc.metadata or {}
+        pid = meta.get("parent_id")
+        text = parents.get(pid) if pid else None
+        if text is None:
+            if out and used + len(doc.page_content or "") > budget:
+                break
+            used += len(doc.page_content or "")
+            out.append(doc)
+            continue
+
+        cs, ce = int(meta.get("child_start", 0)), int(meta.get("child_end", 0))
+        merged = False
+        for span in spans.get(pid, []):
+            if cs <= span[1] + _MERGE_GAP and ce >= span[0] - _MERGE_GAP:
+                new_start, new_end = min(span[0], cs), max(span[1], ce)
+                used += (span[0] - new_start) + (new_end - span[1])
+                span[0], span[1] = new_start, new_end
+                merged = True
+                break
+        if merged:
+            continue
+
+        if out and used + (ce - cs) > budget:
+            break
+        target = min(max_chars, max(ce - cs, budget - used))
+        extra = max(0, target - (ce - cs)) // 2
+        start = _snap_start(text, max(0, cs - extra))
+        end = _snap_end(text, min(len(text), ce + extra))
+        start, end = min(start, cs), max(end, ce)
+        used += end - start
+        spans.setdefault(pid, []).append([start, end, len(out)])
+        out.append(doc)
+
+    for pid, items in spans.items():
+        text = parents[pid]
+        for start, end, index in items:
+            doc = out[index]
+            doc.metadata["parent_span"] = json.dumps([start, end])
+            doc.page_content = text[start:end]
+    metrics.incr("small_to_big.expanded", sum(len(v) for v in spans.values()))
+    print(f"[Parent_Store] expanded {sum(len(v) for v in spans.values())} hits into parent spans "
+          f"(~{used // CHARS_PER_TOKEN} tokens, {len(out)} of {len(docs)} hits kept).")
+    return out
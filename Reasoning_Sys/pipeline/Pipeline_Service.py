@@ -0,0 +1,469 @@
+# Pipeline_Service.py
+"""
+In-process API for the Module 1 symptom reasoning pipeline.
+
+`PipelineService` owns its models, retriever, predictor and prompts as
+long-lived, injectable dependencies, so the backend (or a worker) can call
+`analyze(...)` / `await aanalyze(...)` directly and tests can inject fakes.
+`Execution.pipeline` and the `Execution.py` CLI are thin wrappers over it.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from MY_Model import get_chat_model, audio_text
+from MY_Prompt import prompt, final_prompt_template, compact_final_prompt_template
+from MY_Format import SymptomModel
+from Case_Router import RoutingDecision, route_case, log_routing_decision
+from Tools import _normalize_symptom_json, flatten_docs, top_predictions
+from Metrics import metrics
+
+# Project root on sys.path once (Disease_Prediction_Pipeline lives there)
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+NO_HISTORY = "No previous medical history available."
+
+
+def _result_to_text(result: Any) -> str:
+    """
+    Normalize an LLM chain result to plain string.
+    Accepts objects with .content or .text, or plain strings.
+    """
+    if result is None:
+        return ""
+    if isinstance(result, str):
+        return result
+    # ChatMessage-like
+    if hasattr(result, "content"):
+        return result.content
+    if hasattr(result, "text"):
+        return result.text
+    # fallback
+    return str(result)
+
+
+# --- Typed results ---
+
+class TopPrediction(BaseModel):
+    disease: str
+    prob: float = 0.0
+    bucket: Optional[str] = None
+
+
+class RetrievedChunk(BaseModel):
+    rank: int
+    id: Optional[str] = None
+    source: Optional[str] = None
+    retrieval_rank: Optional[int] = None
+    retrieval_score: Optional[float] = None
+    rerank_score: Optional[float] = None
+
+
+class AnalysisResult(BaseModel):
+    symptoms: List[str] = Field(default_factory=list)
+    top_5: List[TopPrediction] = Field(default_factory=list)
+    ai_response: str = ""
+    synthesis_ttft_s: Optional[float] = None
+    routing: Optional[RoutingDecision] = None
+    retrieval: List[RetrievedChunk] = Field(default_factory=list)
+    logs: str = ""
+
+
+class PipelineService:
+    """
+    Module 1 pipeline with injected, long-lived dependencies.
+
+    - extraction_llm: chat model for symptom extraction
+    - synthesis_llms: {"fast": llm, "full": llm} keyed by routing tier
+    - retriever: callable(transcription, symptoms, duration, red_flags, prediction) -> docs
+    - aretriever: async variant of retriever, used by `aanalyze`
+    - predictor: callable(symptoms) -> run_symptom_test-style dict
+    - transcriber: callable(audio_path) -> text
+    Anything not supplied is built lazily from the production factories.
+    """
+
+    def __init__(
+        self,
+        *,
+        extraction_llm: Any = None,
+        synthesis_llms: Optional[Dict[str, Any]] = None,
+        retriever: Optional[Callable[..., Any]] = None,
+        aretriever: Optional[Callable[..., Any]] = None,
+        predictor: Optional[Callable[[List[str]], Any]] = None,
+        transcriber: Optional[Callable[[str], str]] = None,
+        extraction_prompt: Any = prompt,
+        synthesis_prompts: Optional[Dict[str, Any]] = None,
+        router: Callable[..., RoutingDecision] = route_case,
+    ):
+        self._extraction_llm = extraction_llm
+        self._synthesis_llms = dict(synthesis_llms or {})
+        self._retriever = retriever
+        self._aretriever = aretriever
+        # an injected sync retriever (and no async one) means async calls must use it too;
+        # the lazily-built production retriever does not count
+        self._sync_retriever_injected = retriever is not None and aretriever is None
+        self._predictor = predictor
+        self.transcriber = transcriber or audio_text
+        self.extraction_prompt = extraction_prompt
+        self.synthesis_prompts = synthesis_prompts or {
+            "full": final_prompt_template,
+            "fast": compact_final_prompt_template,
+        }
+        self.router = router
+        self._lock = threading.Lock()
+
+    # --- Lazily-built dependencies ---
+
+    @property
+    def extraction_llm(self):
+        if self._extraction_llm is None:
+            # Identical transcripts yield identical extractions: serve repeats from the response cache
+            self._extraction_llm = get_chat_model(cache=True)
+        return self._extraction_llm
+
+    def synthesis_llm(self, routing: RoutingDecision):
+        with self._lock:
+            llm = self._synthesis_llms.get(routing.tier)
+        if llm is None:
+            try:
+                llm = get_chat_model(model=routing.model)
+            except Exception:
+                traceback.print_exc()
+                llm = self.extraction_llm
+            with self._lock:
+                llm = self._synthesis_llms.setdefault(routing.tier, llm)
+        return llm
+
+    @property
+    def retriever(self):
+        if self._retriever is None:
+            from Vector_Search import run_custom_multiquery_retrieval
+            self._retriever = run_custom_multiquery_retrieval
+        return self._retriever
+
+    @property
+    def aretriever(self):
+        if self._aretriever is None and not self._sync_retriever_injected:
+            from Vector_Search import arun_custom_multiquery_retrieval
+            self._aretriever = arun_custom_multiquery_retrieval
+        return self._aretriever
+
+    @property
+    def predictor(self):
+        if self._predictor is None:
+            try:
+                from Disease_Prediction_Pipeline.test import run_symptom_test
+            except Exception as e:
+                traceback.print_exc()
+                raise RuntimeError(f"Cannot import run_symptom_test: {e}")
+            self._predictor = run_symptom_test
+        return self._predictor
+
+    # --- Steps ---
+
+    def _transcribe(self, audio_path: Optional[str], transcription: Optional[str]) -> str:
+        if transcription:
+            print("Using provided text transcription.")
+            return transcription
+        if not audio_path:
+            raise ValueError("Either audio_path or transcription must be provided.")
+        try:
+            with metrics.timed("module1.stage.transcribe"):
+                text = self.transcriber(audio_path)
+            print("TRANSCRIPTION (first 300 chars):\n", text[:300])
+            return text
+        except Exception as e:
+            traceback.print_exc()
+            raise RuntimeError(f"Failed to transcribe audio: {e}")
+
+    def _extraction_inputs(self, transcription: str, history: Optional[str]) -> Dict[str, Any]:
+        return {"audio_transcription": transcription, "history": history or NO_HISTORY}
+
+    def _parse_symptoms(self, raw_text: str) -> SymptomModel:
+        print("\nRaw symptom-extraction output (first 600 chars):\n", raw_text[:600])
+        try:
+            normalized_obj = _normalize_symptom_json(raw_text)
+        except Exception as e:
+            traceback.print_exc()
+            raise RuntimeError(f"Failed to normalize symptom JSON: {e}")
+        try:
+            model_output = SymptomModel.model_validate(normalized_obj)
+        except Exception as e:
+            traceback.print_exc()
+            raise RuntimeError(f"SymptomModel validation failed: {e}")
+
+        print("Parsed SymptomModel:")
+        print(" - symptoms:", model_output.symptoms)
+        print(" - duration:", model_output.duration)
+        print(" - red_flags:", model_output.red_flags)
+        print(" - notes:", getattr(model_output, "notes", None))
+        return model_output
+
+    def _extract_symptoms(self, transcription: str, history: Optional[str]) -> SymptomModel:
+        try:
+            with metrics.timed("module1.stage.extract"):
+                raw = (self.extraction_prompt | self.extraction_llm).invoke(
+                    self._extraction_inputs(transcription, history)
+                )
+        except Exception as e:
+            traceback.print_exc()
+            raise RuntimeError(f"Symptom extraction chain failed: {e}")
+        return self._parse_symptoms(_result_to_text(raw))
+
+    async def _aextract_symptoms(self, transcription: str, history: Optional[str]) -> SymptomModel:
+        try:
+            with metrics.timed("module1.stage.extract"):
+                raw = await (self.extraction_prompt | self.extraction_llm).ainvoke(
+                    self._extraction_inputs(transcription, history)
+                )
+        except Exception as e:
+            traceback.print_exc()
+            raise RuntimeError(f"Symptom extraction chain failed: {e}")
+        return self._parse_symptoms(_result_to_text(raw))
+
+    def _predict(self, symptoms: List[str]) -> Any:
+        try:
+            with metrics.timed("module1.stage.predict"):
+                return self.predictor(symptoms)
+        except Exception as e:
+            traceback.print_exc()
+            raise RuntimeError(f"run_symptom_test failed: {e}")
+
+    @staticmethod
+    def _top_predictions(result_prediction: Any, k: int = 5) -> List[Dict[str, Any]]:
+        return top_predictions(result_prediction, k)
+
+    @staticmethod
+    def _flatten(docs: Any) -> List[Any]:
+        try:
+            return flatten_docs(docs)
+        except Exception:
+            if docs is None:
+                return []
+            if isinstance(docs, list) and docs and isinstance(docs[0], list):
+                return [d for sub in docs for d in sub]
+            if isinstance(docs, list):
+                return docs
+            return []
+
+    def _retrieve(self, transcription: str, model_output: SymptomModel, result_prediction: Any) -> List[Any]:
+        try:
+            with metrics.timed("module1.stage.retrieve"):
+                docs = self.retriever(
+                    transcription,
+                    model_output.symptoms,
+                    model_output.duration,
+                    model_output.red_flags,
+                    result_prediction,
+                )
+        except Exception as e:
+            traceback.print_exc()
+            raise RuntimeError(f"run_custom_multiquery_retrieval failed: {e}")
+        return self._flatten(docs)
+
+    async def _aretrieve(self, transcription: str, model_output: SymptomModel, result_prediction: Any) -> List[Any]:
+        # Injected sync retrievers (tests, custom backends) still run in a worker thread
+        if self.aretriever is None:
+            return await asyncio.to_thread(self._retrieve, transcription, model_output, result_prediction)
+        try:
+            with metrics.timed("module1.stage.retrieve"):
+                docs = await self.aretriever(
+                    transcription,
+                    model_output.symptoms,
+                    model_output.duration,
+                    model_output.red_flags,
+                    result_prediction,
+                )
+        except Exception as e:
+            traceback.print_exc()
+            raise RuntimeError(f"run_custom_multiquery_retrieval failed: {e}")
+        return self._flatten(docs)
+
+    @staticmethod
+    def _build_context(final_docs: List[Any]) -> List[str]:
+        # Context is built from page content only (no metadata)
+        context_pieces = []
+        for doc in final_docs:
+            page_content = getattr(doc, "page_content", None)
+            if page_content and isinstance(page_content, str) and page_content.strip():
+                context_pieces.append(page_content)
+            else:
+                text = getattr(doc, "content", None) or str(doc)
+                if text and text.strip():
+                    context_pieces.append(text)
+        return context_pieces
+
+    def _prepare_synthesis(self, transcription, history, model_output, top_5_list, context_pieces):
+        top_5_summary = "\n".join(
+            [f"{i+1}. {p['disease']} ({p['prob']:.2%})" for i, p in enumerate(top_5_list)]
+        ) if top_5_list else "None"
+
+        lead_pred = "No safe prediction"
+        if top_5_list:
+            lead = top_5_list[0]
+            lead_pred = f"{lead['disease']} ({lead['prob']:.2%})"
+
+        context = "\n\n".join(context_pieces)
+        if not context.strip():
+            context = "No relevant medical documents found."
+
+        routing = self.router(model_output.symptoms, model_output.red_flags, top_5_list, transcription)
+        inputs = {
+            "document": context,
+            "symptoms": model_output.symptoms,
+            "duration": model_output.duration,
+            "red_flags": model_output.red_flags,
+            "disease_prediction": lead_pred,
+            "top_5_predictions": top_5_summary,
+            "user_query": transcription,
+            "history": history or NO_HISTORY,
+        }
+        chain = self.synthesis_prompts[routing.tier] | self.synthesis_llm(routing)
+        return routing, chain, inputs, lead_pred
+
+    @staticmethod
+    def _retrieval_record(final_docs: List[Any]) -> List[RetrievedChunk]:
+        # Final chunk order (after rerank, when enabled) with its scores
+        record = []
+        for rank, doc in enumerate(final_docs, start=1):
+            meta = getattr(doc, "metadata", None) or {}
+            record.append(RetrievedChunk(
+                rank=rank,
+                id=getattr(doc, "id", None),
+                source=meta.get("source"),
+                retrieval_rank=meta.get("retrieval_rank"),
+                retrieval_score=meta.get("retrieval_score"),
+                rerank_score=meta.get("rerank_score"),
+            ))
+        return record
+
+    def _finish(self, model_output, top_5_list, final_docs, context_pieces, lead_pred, routing, final_text, ttft, latency) -> AnalysisResult:
+        if latency is not None:
+            metrics.observe("module1.synthesis.total", latency)
+        log_routing_decision(routing, synthesis_latency_s=latency, ttft_s=ttft)
+        return AnalysisResult(
+            symptoms=model_output.symptoms,
+            top_5=[TopPrediction(**p) for p in top_5_list],
+            ai_response=final_text,
+            synthesis_ttft_s=ttft,
+            routing=routing,
+            retrieval=self._retrieval_record(final_docs),
+            logs=f"Reasoning path: Symptom extraction -> {len(context_pieces)} document(s) retrieved -> Differential reasoning ({routing.tier} tier, {routing.model}) -> {lead_pred} identified as primary hypothesis.",
+        )
+
+    # --- Public API ---
+
+    def analyze(
+        self,
+        audio_path: Optional[str] = None,
+        transcription: Optional[str] = None,
+        history: Optional[str] = None,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> AnalysisResult:
+        """
+        Run the full Module 1 pipeline synchronously.
+        `on_token` (optional) receives each synthesis token as it is generated.
+        """
+        transcription = self._transcribe(audio_path, transcription)
+        model_output = self._extract_symptoms(transcription, history)
+        result_prediction = self._predict(model_output.symptoms)
+        top_5_list = self._top_predictions(result_prediction)
+
+        final_docs = self._retrieve(transcription, model_output, result_prediction)
+        print(f"\nRetrieved {len(final_docs)} documents.")
+        context_pieces = self._build_context(final_docs)
+
+        routing, chain, inputs, lead_pred = self._prepare_synthesis(
+            transcription, history, model_output, top_5_list, context_pieces
+        )
+
+        final_text, ttft, latency = "", None, None
+        try:
+            parts: List[str] = []
+            start = time.perf_counter()
+            for chunk in chain.stream(inputs):
+                token = _result_to_text(chunk)
+                if not token:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                    metrics.observe("module1.synthesis.ttft", ttft)
+                parts.append(token)
+                if on_token:
+                    on_token(token)
+            latency = time.perf_counter() - start
+            final_text = "".join(parts)
+        except Exception:
+            traceback.print_exc()
+            final_text = "Clinical synthesis failed."
+
+        return self._finish(model_output, top_5_list, final_docs, context_pieces, lead_pred, routing, final_text, ttft, latency)
+
+    async def aanalyze(
+        self,
+        audio_path: Optional[str] = None,
+        transcription: Optional[str] = None,
+        history: Optional[str] = None,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> AnalysisResult:
+        """
+        Async variant of `analyze` for use inside an event loop (e.g. the backend).
+        LLM calls are awaited natively; blocking steps run in worker threads.
+        """
+        transcription = await asyncio.to_thread(self._transcribe, audio_path, transcription)
+        model_output = await self._aextract_symptoms(transcription, history)
+        result_prediction = await asyncio.to_thread(self._predict, model_output.symptoms)
+        top_5_list = self._top_predictions(result_prediction)
+
+        final_docs = await self._aretrieve(transcription, model_output, result_prediction)
+        print(f"\nRetrieved {len(final_docs)} documents.")
+        context_pieces = self._build_context(final_docs)
+
+        routing, chain, inputs, lead_pred = self._prepare_synthesis(
+            transcription, history, model_output, top_5_list, context_pieces
+        )
+
+        final_text, ttft, latency = "", None, None
+        try:
+            parts: List[str] = []
+            start = time.perf_counter()
+            async for chunk in chain.astream(inputs):
+                token = _result_to_text(chunk)
+                if not token:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                    metrics.observe("module1.synthesis.ttft", ttft)
+                parts.append(token)
+                if on_token:
+                    on_token(token)
+            latency = time.perf_counter() - start
+            final_text = "".join(parts)
+        except Exception:
+            traceback.print_exc()
+            final_text = "Clinical synthesis failed."
+
+        return self._finish(model_output, top_5_list, final_docs, context_pieces, lead_pred, routing, final_text, ttft, latency)
+
+
+_default_service: Optional[PipelineService] = None
+_default_lock = threading.Lock()
+
+
+def get_pipeline_service() -> PipelineService:
+    """Process-wide default service built from the production factories."""
+    global _default_service
+    if _default_service is None:
+        with _default_lock:
+            if _default_service is None:
+                _default_service = PipelineService()
+    return _default_service
@@ -0,0 +1,358 @@
+# Quantized_Store.py
+"""
+Binary-quantized copy of a Chroma collection for a fast first-pass search.
+
+Each stored embedding is kept twice:
+  - a 1-bit-per-dimension code (sign of the vector minus the collection
+    mean): 128 bytes per 1024-dim bge-m3 vector instead of 4 KB,
+  - the unit-normalized float32 vector, only touched for rescoring.
+Both files are memory-mapped; nothing is decoded per row at open time.
+
+A query scans every code with XOR + popcount in one pass over the mapped
+codes, keeps the QUANT_RESCORE_FACTOR x k nearest by Hamming distance, and
+rescores those exactly (cosine) from the float32 file. Chunk texts and
+metadata live in a JSONL sidecar so hits come back without a Chroma
+round-trip.
+
+The scan is linear in the collection size (well under a millisecond per
+thousand rows, so a few tens of milliseconds at 100k rows): this copy is
+meant for small and medium collections. Larger ones should use the
+clustered snapshot (Ann_Snapshot), which only scans the probed lists.
+
+Files, under <persist_dir>/quantized/<collection>/:
+    header.json   dim, count, mean vector, embedding model, source index version
+    codes.bin     count x dim/8 bytes
+    vectors.f32   count x dim float32 (native byte order)
+    chunks.jsonl  one {"id", "text", "metadata"} per line
+    offsets.bin   uint64[count + 1] byte offsets into chunks.jsonl
+    ids.json      chunk ids in row order (for filtered searches)
+
+The copy is built by the migration CLI below from an existing collection
+and records the index version it was built from; the warm knowledge store
+only uses it while that version is current (QUANT_SEARCH_ENABLED=1).
+
+Usage:
+  python Quantized_Store.py migrate  <persist_dir> <collection>
+  python Quantized_Store.py compare  <persist_dir> <collection> --samples 50 --k 10
+"""
+
+import heapq
+import json
+import math
+import mmap
+import operator
+import os
+import shutil
+import sys
+import time
+import uuid
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from Metrics import metrics
+
+QUANT_SEARCH_ENABLED = os.environ.get("QUANT_SEARCH_ENABLED", "0") not in ("0", "false", "False")
+QUANT_RESCORE_FACTOR = int(os.environ.get("QUANT_RESCORE_FACTOR", "8"))
+
+_popcount = getattr(int, "bit_count", None) or (lambda x: bin(x).count("1"))
+
+
+def quantized_dir(persist_dir: str, collection_name: str) -> str:
+    return os.path.join(persist_dir, "quantized", collection_name)
+
+
+def _normalize(vec: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def _encode(vec: Sequence[float], mean: Sequence[float]) -> int:
+    code = 0
+    for i, (v, m) in enumerate(zip(vec, mean)):
+        if v > m:
+            code |= 1 << i
+    return code
+
+
+def _hamming_distances(codes: bytes, q_code: int, code_bytes: int) -> List[int]:
+    """
+    Hamming distance from q_code to every code in a contiguous block of
+    code_bytes-byte codes, in one pass over one buffer (no per-row reads or
+    key callbacks; pair with heapq.nsmallest(..., key=dists.__getitem__)).
+    """
+    from_bytes = int.from_bytes
+    return [_popcount(q_code ^ from_bytes(codes[i : i + code_bytes], "little")) for i in range(0, len(codes), code_bytes)]
+
+
+def migrate_collection(collection, out_dir: str, *, embedding_model: str = "", source_version: str = "0",
+                       page_size: int = 500) -> int:
+    """
+    Write a quantized copy of a Chroma collection into out_dir (replaced
+    atomically when complete). Returns the number of vectors written.
+    """
+    parent = os.path.dirname(out_dir)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = f"{out_dir}.tmp-{uuid.uuid4().hex[:6]}"
+    os.makedirs(tmp_dir)
+
+    dim = 0
+    count = 0
+    sums: List[float] = []
+    ids: List[str] = []
+    offsets = array("Q", [0])
+    with open(os.path.join(tmp_dir, "vectors.f32"), "wb") as vf, \
+            open(os.path.join(tmp_dir, "chunks.jsonl"), "wb") as cf:
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+            if not len(page["ids"]):
+                break
+            for chunk_id, emb, text, meta in zip(page["ids"], page["embeddings"], page["documents"], page["metadatas"]):
+                vec = _normalize([float(x) for x in emb])
+                if not dim:
+                    dim, sums = len(vec), [0.0] * len(vec)
+                array("f", vec).tofile(vf)
+                for i, v in enumerate(vec):
+                    sums[i] += v
+                line = json.dumps({"id": chunk_id, "text": text or "", "metadata": meta or {}}, ensure_ascii=False)
+                cf.write(line.encode("utf-8") + b"\n")
+                offsets.append(cf.tell())
+                ids.append(chunk_id)
+                count += 1
+            offset += len(page["ids"])
+    mean = [s / count for s in sums] if count else []
+
+    # second pass: sign codes relative to the collection mean
+    code_bytes = (dim + 7) // 8
+    with open(os.path.join(tmp_dir, "vectors.f32"), "rb") as vf, \
+            open(os.path.join(tmp_dir, "codes.bin"), "wb") as out:
+        for _ in range(count):
+            vec = array("f")
+            vec.fromfile(vf, dim)
+            out.write(_encode(vec, mean).to_bytes(code_bytes, "little"))
+    with open(os.path.join(tmp_dir, "offsets.bin"), "wb") as f:
+        offsets.tofile(f)
+    with open(os.path.join(tmp_dir, "ids.json"), "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    with open(os.path.join(tmp_dir, "header.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "dim": dim,
+            "count": count,
+            "mean": mean,
+            "embedding_model": embedding_model,
+            "source_version": source_version,
+            "created_at": time.time(),
+        }, f)
+
+    if os.path.isdir(out_dir):
+        old = f"{out_dir}.old-{uuid.uuid4().hex[:6]}"
+        os.replace(out_dir, old)
+        os.replace(tmp_dir, out_dir)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.replace(tmp_dir, out_dir)
+    return count
+
+
+class QuantizedIndex:
+    """Read-only binary-code index with exact float32 rescoring."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "header.json"), "r", encoding="utf-8") as f:
+            self.header: Dict[str, Any] = json.load(f)
+        self.dim: int = self.header["dim"]
+        self.count: int = self.header["count"]
+        self.source_version: str = self.header.get("source_version", "0")
+        self.embedding_model: str = self.header.get("embedding_model", "")
+        self._mean: List[float] = self.header["mean"]
+
+        self.code_bytes = (self.dim + 7) // 8
+        self._codes_file = open(os.path.join(path, "codes.bin"), "rb")
+        self._codes_mm = mmap.mmap(self._codes_file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else None
+        self._offsets = array("Q")
+        with open(os.path.join(path, "offsets.bin"), "rb") as f:
+            self._offsets.fromfile(f, self.count + 1)
+
+        self._vec_file = open(os.path.join(path, "vectors.f32"), "rb")
+        self._vec_mm = mmap.mmap(self._vec_file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else None
+        self._view = memoryview(self._vec_mm) if self._vec_mm is not None else None
+        self._floats = self._view.cast("f") if self._view is not None else None
+        self._chunk_file = open(os.path.join(path, "chunks.jsonl"), "rb")
+        self._chunk_mm = mmap.mmap(self._chunk_file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else None
+        self._ids: Optional[List[str]] = None
+        self._row_of: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def chunk(self, i: int) -> Dict[str, Any]:
+        return json.loads(self._chunk_mm[self._offsets[i] : self._offsets[i + 1]])
+
+    @property
+    def ids(self) -> List[str]:
+        if self._ids is None:
+            try:
+                with open(os.path.join(self.path, "ids.json"), "r", encoding="utf-8") as f:
+                    self._ids = json.load(f)
+            except FileNotFoundError:
+                # copy migrated before ids.json existed
+                self._ids = [self.chunk(i)["id"] for i in range(self.count)]
+        return self._ids
+
+    def memory_bytes(self) -> int:
+        """
+        Resident bytes for this index: the code pages (every query touches
+        all of them), the offset table, and the id list and id -> row map
+        once a filtered search has loaded them. Vector and chunk pages are
+        only read for the rows a query rescores or returns.
+        """
+        total = self.count * self.code_bytes + self._offsets.buffer_info()[1] * self._offsets.itemsize
+        if self._ids is not None:
+            total += sys.getsizeof(self._ids) + sum(sys.getsizeof(i) for i in self._ids)
+        if self._row_of is not None:
+            total += sys.getsizeof(self._row_of)
+        return total
+
+    def disk_bytes(self) -> int:
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path))
+
+    def vector(self, i: int) -> List[float]:
+        return list(self._floats[i * self.dim : (i + 1) * self.dim])
+
+    def lookup(self, ids: Sequence[str]) -> Dict[str, Tuple[Dict[str, Any], List[float]]]:
+        """Chunk and stored (unit) vector of each id in the copy, keyed by id."""
+        return {self.ids[r]: (self.chunk(r), self.vector(r)) for r in self._rows_for(set(ids))}
+
+    def _rows_for(self, allowed_ids: Set[str]) -> List[int]:
+        if self._row_of is None:
+            self._row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        return sorted(self._row_of[c] for c in allowed_ids if c in self._row_of)
+
+    def search_indices(self, query: Sequence[float], k: int, *, allowed_ids: Optional[Set[str]] = None,
+                       rescore: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Top-k (row, cosine similarity), best first."""
+        if not self.count:
+            return []
+        q = _normalize(query)
+        q_code = _encode(q, self._mean)
+        cb, mm = self.code_bytes, self._codes_mm
+        with metrics.timed("quantized.first_pass"):
+            if allowed_ids is None:
+                rows: Sequence[int] = range(self.count)
+                dists = _hamming_distances(mm, q_code, cb)
+            else:
+                rows = self._rows_for(allowed_ids)
+                dists = _hamming_distances(b"".join([mm[r * cb : (r + 1) * cb] for r in rows]), q_code, cb)
+            shortlist = [rows[i] for i in heapq.nsmallest(
+                max(k, (rescore or QUANT_RESCORE_FACTOR * k)), range(len(rows)), key=dists.__getitem__
+            )]
+        dim, floats = self.dim, self._floats
+        with metrics.timed("quantized.rescore"):
+            scored = [(i, sum(map(operator.mul, q, floats[i * dim : (i + 1) * dim]))) for i in shortlist]
+        return heapq.nlargest(k, scored, key=lambda t: t[1])
+
+    def search(self, query: Sequence[float], k: int, *, allowed_ids: Optional[Set[str]] = None,
+               rescore: Optional[int] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """Top-k ({"id", "text", "metadata"}, cosine similarity), best first."""
+        return [(self.chunk(i), sim) for i, sim in self.search_indices(query, k, allowed_ids=allowed_ids, rescore=rescore)]
+
+    def close(self) -> None:
+        if self._floats is not None:
+            self._floats.release()
+            self._view.release()
+            self._vec_mm.close()
+        if self._chunk_mm is not None:
+            self._chunk_mm.close()
+        if self._codes_mm is not None:
+            self._codes_mm.close()
+        self._codes_file.close()
+        self._vec_file.close()
+        self._chunk_file.close()
+
+
+def open_quantized(persist_dir: str, collection_name: str) -> Optional[QuantizedIndex]:
+    path = quantized_dir(persist_dir, collection_name)
+    if not os.path.isfile(os.path.join(path, "header.json")):
+        return None
+    return QuantizedIndex(path)
+
+
+def compare(collection, index, samples: int, k: int) -> Dict[str, Any]:
+    """
+    Recall of the quantized search (a QuantizedIndex, or an Ann_Snapshot)
+    against the collection's own (HNSW) search, and latency of both, using
+    stored vectors as queries (the query's own chunk is excluded from both
+    result lists).
+    """
+    import random
+    from statistics import median
+
+    rows = random.Random(0).sample(range(index.count), min(samples, index.count))
+    recalls, q_lat, c_lat = [], [], []
+    for row in rows:
+        query = index.vector(row)
+        own = index.ids[row]
+
+        start = time.perf_counter()
+        res = collection.query(query_embeddings=[query], n_results=k + 1, include=[])
+        c_lat.append(time.perf_counter() - start)
+        truth = [i for i in res["ids"][0] if i != own][:k]
+
+        start = time.perf_counter()
+        hits = index.search_indices(query, k + 1)
+        q_lat.append(time.perf_counter() - start)
+        got = {index.ids[i] for i, _ in hits if index.ids[i] != own}
+
+        if truth:
+            recalls.append(len(got & set(truth)) / len(truth))
+
+    def pct(values: List[float], p: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))], 5)
+
+    return {
+        "samples": len(rows),
+        "k": k,
+        "rescore_factor": QUANT_RESCORE_FACTOR,
+        "recall_at_k_vs_chroma": round(sum(recalls) / len(recalls), 4) if recalls else None,
+        "quantized_p50_s": pct(q_lat, 50),
+        "quantized_p95_s": pct(q_lat, 95),
+        "chroma_p50_s": pct(c_lat, 50),
+        "chroma_p95_s": pct(c_lat, 95),
+        "resident_bytes": index.memory_bytes(),
+        "bytes_on_disk": index.disk_bytes(),
+        "median_quantized_speedup": round(median(c_lat) / median(q_lat), 2) if q_lat and median(q_lat) else None,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from langchain_chroma import Chroma
+    from Knowledge_Store import read_index_info
+    from MY_Model import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Binary-quantized copy of a Chroma collection")
+    parser.add_argument("command", choices=["migrate", "compare"])
+    parser.add_argument("persist_dir")
+    parser.add_argument("collection")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    store = Chroma(collection_name=args.collection, persist_directory=args.persist_dir)
+    out_dir = quantized_dir(args.persist_dir, args.collection)
+    if args.command == "migrate":
+        info = read_index_info(args.persist_dir, args.collection)
+        n = migrate_collection(
+            store._collection, out_dir,
+            embedding_model=info.get("embedding_model", EMBEDDING_MODEL_NAME),
+            source_version=info.get("version", "0"),
+        )
+        print(f"Quantized {n} vectors into {out_dir}")
+    else:
+        index = QuantizedIndex(out_dir)
+        print(json.dumps(compare(store._collection, index, args.samples, args.k), indent=2))
+        index.close()
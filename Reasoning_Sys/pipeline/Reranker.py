@@ -0,0 +1,125 @@
+# Reranker.py
+"""
+Optional rerank stage for retrieved chunks.
+
+After multi-query retrieval (and near-dup suppression) the whole candidate
+set is scored against a short clinical query in ONE batch and only the top
+RERANK_TOP_N chunks are kept:
+
+  - CrossEncoderScorer: a small CPU cross-encoder from sentence-transformers
+    (RERANK_MODEL), used when that package is installed,
+  - LateInteractionScorer: a dependency-free fallback that matches every
+    query term against the chunk's terms (exact, else shared 5-char prefix),
+    weighted by term rarity within the candidate set.
+
+Scores and the new order are written to each chunk's metadata
+(`rerank_score`, `rerank_rank`) so callers can record them.
+Off by default (the cross-encoder may be downloaded on first use); enable
+with RERANK_ENABLED=1.
+"""
+
+import math
+import os
+import re
+import threading
+from typing import Any, List, Optional, Sequence
+
+from Metrics import metrics
+
+# --- CONFIG ---
+RERANK_ENABLED = os.environ.get("RERANK_ENABLED", "0") not in ("0", "false", "False")
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_TOP_N = int(os.environ.get("RERANK_TOP_N", "8"))
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", "32"))
+RERANK_MAX_CHARS = int(os.environ.get("RERANK_MAX_CHARS", "2000"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_PREFIX = 5
+
+
+class CrossEncoderScorer:
+    name = "cross-encoder"
+
+    def __init__(self, model_name: str = RERANK_MODEL):
+        from sentence_transformers import CrossEncoder
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, query: str, texts: Sequence[str]) -> List[float]:
+        pairs = [(query, t[:RERANK_MAX_CHARS]) for t in texts]
+        return [float(s) for s in self.model.predict(pairs, batch_size=RERANK_BATCH_SIZE, show_progress_bar=False)]
+
+
+class LateInteractionScorer:
+    name = "late-interaction"
+    model_name = None
+
+    @staticmethod
+    def _terms(text: str) -> List[str]:
+        return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 2]
+
+    def score(self, query: str, texts: Sequence[str]) -> List[float]:
+        q_terms = set(self._terms(query))
+        if not q_terms:
+            return [0.0] * len(texts)
+        doc_terms = [set(self._terms(t[:RERANK_MAX_CHARS * 2])) for t in texts]
+        doc_prefixes = [{t[:_PREFIX] for t in terms} for terms in doc_terms]
+
+        # rarity within the candidate set stands in for corpus idf
+        n = len(texts)
+        weights = {}
+        for term in q_terms:
+            df = sum(1 for terms, prefixes in zip(doc_terms, doc_prefixes) if term in terms or term[:_PREFIX] in prefixes)
+            weights[term] = math.log(1.0 + (n + 1) / (df + 0.5))
+        total = sum(weights.values()) or 1.0
+
+        scores = []
+        for terms, prefixes in zip(doc_terms, doc_prefixes):
+            s = 0.0
+            for term, w in weights.items():
+                if term in terms:
+                    s += w
+                elif term[:_PREFIX] in prefixes:
+                    s += 0.6 * w
+            scores.append(s / total)
+        return scores
+
+
+_scorer: Optional[Any] = None
+_scorer_lock = threading.Lock()
+
+
+def get_scorer():
+    """Cross-encoder when available, else the late-interaction fallback (resolved once)."""
+    global _scorer
+    if _scorer is None:
+        with _scorer_lock:
+            if _scorer is None:
+                try:
+                    _scorer = CrossEncoderScorer()
+                except Exception as e:
+                    print(f"[Reranker] cross-encoder unavailable ({e}); using late-interaction scorer.")
+                    _scorer = LateInteractionScorer()
+    return _scorer
+
+
+def rerank(query: str, docs: Sequence[Any], top_n: int = RERANK_TOP_N, scorer: Any = None) -> List[Any]:
+    """Score all candidates in one batch and return the top_n, best first."""
+    if not RERANK_ENABLED or not docs:
+        return list(docs)
+    scorer = scorer or get_scorer()
+    texts = [getattr(d, "page_content", None) or str(d) for d in docs]
+    with metrics.timed(f"rerank.{scorer.name}"):
+        scores = scorer.score(query, texts)
+    order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)[:top_n]
+    kept = []
+    for rank, i in enumerate(order, start=1):
+        doc = docs[i]
+        if getattr(doc, "metadata", None) is not None:
+            doc.metadata["rerank_score"] = round(scores[i], 6)
+            doc.metadata["rerank_rank"] = rank
+            doc.metadata["retrieval_rank"] = i + 1
+        kept.append(doc)
+    metrics.incr("rerank.candidates", len(docs))
+    print(f"[Reranker] {scorer.name}: kept {len(kept)} of {len(docs)} chunks.")
+    return kept
@@ -0,0 +1,149 @@
+# Retrieval_Cache.py
+"""
+Cache of final retrieval results keyed on structured clinical facets.
+
+Many cases share the same symptom set and the same top predicted diseases,
+so run_custom_multiquery_retrieval looks the case up first by:
+
+    collection + transcript + sorted symptoms + duration + sorted red flags
+    + top-k disease names + retrieval settings (query mode, k, filters)
+
+The transcript and duration take part because the clinical query and the
+rerank query are built from them. Only the ranked chunk ids and their
+scores are stored (a few hundred bytes per entry); texts are fetched back
+from the collection by id on a hit. Keys are prefixed with the collection
+name and the cache remembers, per collection, the index version it was
+filled against: when ingestion bumps that version only that collection's
+entries are dropped, so results never outlive the index they came from.
+
+Entries live in a Disk_Cache.DiskLRUCache shared by the workers on the
+node; hit ratio, bytes used, evictions and invalidations are exposed
+through Metrics ("retrieval_cache").
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+from Disk_Cache import DiskLRUCache
+from Metrics import metrics
+
+# --- CONFIG ---
+RETRIEVAL_CACHE_ENABLED = os.environ.get("RETRIEVAL_CACHE_ENABLED", "1") not in ("0", "false", "False")
+RETRIEVAL_CACHE_PATH = os.environ.get(
+    "RETRIEVAL_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "retrieval_results.sqlite"),
+)
+RETRIEVAL_CACHE_MAX_MB = int(os.environ.get("RETRIEVAL_CACHE_MAX_MB", "32"))
+# How many predicted diseases take part in the key
+RETRIEVAL_CACHE_TOP_K = int(os.environ.get("RETRIEVAL_CACHE_TOP_K", "5"))
+
+_SCORE_FIELDS = ("retrieval_score", "rerank_score", "rerank_rank", "retrieval_rank")
+
+
+def _norm(items: Optional[Sequence[Any]]) -> List[str]:
+    return sorted({" ".join(str(i).lower().replace("_", " ").split()) for i in items or [] if str(i).strip()})
+
+
+def _norm_text(text: Optional[str]) -> str:
+    return " ".join(str(text or "").lower().split())
+
+
+def case_key(
+    collection_name: str,
+    transcription: str,
+    symptoms: Sequence[str],
+    duration: Optional[str],
+    red_flags: Sequence[str],
+    predictions: Sequence[Dict[str, Any]],
+    settings: Dict[str, Any],
+) -> str:
+    """Cache key: <collection>:<sha256 of the normalized case and settings>."""
+    payload = {
+        "collection": collection_name,
+        "transcription": _norm_text(transcription),
+        "symptoms": _norm(symptoms),
+        "duration": _norm_text(duration),
+        "red_flags": _norm(red_flags),
+        "diseases": _norm(p.get("disease") for p in list(predictions)[:RETRIEVAL_CACHE_TOP_K]),
+        "settings": settings,
+    }
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{collection_name}:{digest}"
+
+
+class RetrievalCache:
+    def __init__(self, *, path: str = RETRIEVAL_CACHE_PATH, max_bytes: int = RETRIEVAL_CACHE_MAX_MB * 1024 * 1024):
+        self.disk = DiskLRUCache(path, max_bytes=max_bytes, name="retrieval")
+        self._lock = threading.Lock()
+        self.invalidations = 0
+        metrics.register_collector("retrieval_cache", self.stats)
+
+    def _check_version(self, collection_name: str, index_version: str) -> None:
+        meta_key = f"index_version:{collection_name}"
+        if self.disk.get_meta(meta_key) == index_version:
+            return
+        with self._lock:
+            current = self.disk.get_meta(meta_key)
+            if current == index_version:
+                return
+            if current is not None:
+                # One file serves every collection: drop only this collection's entries
+                dropped = self.disk.delete_prefix(f"{collection_name}:")
+                self.invalidations += 1
+                metrics.incr("retrieval_cache.invalidations")
+                print(f"[Retrieval_Cache] index {collection_name} moved to {index_version}; "
+                      f"{dropped} cached results dropped.")
+            self.disk.set_meta(meta_key, index_version)
+
+    def get(self, key: str, collection_name: str, index_version: str) -> Optional[List[Dict[str, Any]]]:
+        """[{"id", "retrieval_score", "rerank_score", "rerank_rank", "retrieval_rank"}, ...] in rank order, or None."""
+        self._check_version(collection_name, index_version)
+        raw = self.disk.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def put(self, key: str, collection_name: str, index_version: str, docs: Sequence[Any]) -> None:
+        self._check_version(collection_name, index_version)
+        entries = []
+        for doc in docs:
+            doc_id = getattr(doc, "id", None)
+            if doc_id is None:
+                return  # cannot be fetched back by id; do not cache partial results
+            meta = getattr(doc, "metadata", None) or {}
+            entries.append({"id": doc_id, **{f: meta[f] for f in _SCORE_FIELDS if f in meta}})
+        self.disk.set(key, json.dumps(entries, separators=(",", ":")).encode("utf-8"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.disk.stats(), "invalidations": self.invalidations}
+
+
+def restore(entries: Sequence[Dict[str, Any]], docs_by_id: Dict[str, Any]) -> Optional[List[Any]]:
+    """Rebuild the ranked document list from cached entries (None if any id is gone)."""
+    docs = []
+    for entry in entries:
+        doc = docs_by_id.get(entry["id"])
+        if doc is None:
+            return None
+        for f in _SCORE_FIELDS:
+            if f in entry:
+                doc.metadata[f] = entry[f]
+        docs.append(doc)
+    return docs
+
+
+_cache: Optional[RetrievalCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache() -> Optional[RetrievalCache]:
+    """Process-wide cache, or None when RETRIEVAL_CACHE_ENABLED=0."""
+    global _cache
+    if not RETRIEVAL_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RetrievalCache()
+    return _cache
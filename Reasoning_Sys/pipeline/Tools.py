@@ -121,6 +121,21 @@ def flatten_docs(docs):
     return flat
 
 
+def top_predictions(result_prediction: Any, k: int = 5) -> List[Dict[str, Any]]:
+    """Best k {disease, prob, bucket} entries across the predictor's probability buckets."""
+    if not isinstance(result_prediction, dict):
+        return []
+    temp_preds: Dict[str, Dict[str, Any]] = {}
+    for bucket_name, diseases in result_prediction.get("top_diseases_by_bucket", {}).items():
+        for d in diseases:
+            name = d.get("disease")
+            prob = d.get("prob", 0.0)
+            if name not in temp_preds or prob > temp_preds[name]["prob"]:
+                temp_preds[name] = {"disease": name, "prob": prob, "bucket": bucket_name}
+    all_preds = sorted(temp_preds.values(), key=lambda x: x["prob"], reverse=True)
+    return all_preds[:k]
+
+
 def summarize_context(llm: Any, context: str, user_query: str) -> str:
     """
     Summarize the retrieved documents to reduce the content sent to the final model.
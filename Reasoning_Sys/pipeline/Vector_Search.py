@@ -7,10 +7,10 @@ Usage:
   - Run: python vector_search_fixed.py
 """
 
+import asyncio
 import os
 import sys
 import io
-import traceback
 from typing import List, Sequence, Optional
 
 # Force UTF-8 for Windows console/subprocess output
@@ -21,27 +21,28 @@ if sys.stdout.encoding != 'utf-8':
         # Fallback for older python or restricted environments
         sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-# Prefer langchain_ollama (official wrapper). Fallback to community wrappers if needed.
-try:
-    from langchain_ollama import OllamaEmbeddings, ChatOllama
-except Exception:
-    try:
-        from langchain_community.embeddings import OllamaEmbeddings  # type: ignore
-        from langchain_community.chat_models import ChatOllama  # type: ignore
-    except Exception:
-        raise RuntimeError("Ollama embeddings/chat wrappers not available. Install langchain_ollama or langchain_community.")
-
-from langchain_chroma import Chroma
-from langchain_core.documents import Document
-
-from Multi_Query_Retriver import multi_query_retrieve
+import Multi_Query_Retriver as mqr
+from Multi_Query_Retriver import amulti_query_retrieve
 from MY_Model import get_chat_model, DEFAULT_LLM_MODEL, EMBEDDING_MODEL_NAME
+from Knowledge_Store import get_knowledge_store
+from Near_Dup import diversify
+from Reranker import rerank
+from Metadata_Filter import resolve_filter, specialties_for_predictions
+from Facet_Queries import build_case_query, build_facet_queries
+from Retrieval_Cache import case_key, get_retrieval_cache, restore
+from Parent_Store import expand_to_parents
+from Tools import top_predictions
+from Client_Registry import run_sync
 
 # --- CONFIG: make sure these match your index builder ---
 EMBEDDING_MODEL = EMBEDDING_MODEL_NAME
-OLLAMA_BASE_URL = "http://127.0.0.1:11434"
 CHROMA_DB_PATH = r"C:\CareFusion-AI\vector of external\chroma_db_bge_m3"
 COLLECTION_NAME = "daily_knowledge"
+# Restrict the search to the predicted specialty when the top-5 differential agrees on one
+# (opt-in: a wrong specialty guess silently hides the relevant passages)
+RETRIEVAL_AUTO_FILTER = os.environ.get("RETRIEVAL_AUTO_FILTER", "0") not in ("0", "false", "False")
+# "llm": instruction query + LLM rewrites; "facets": deterministic sub-queries (no LLM)
+RETRIEVAL_QUERY_MODE = os.environ.get("RETRIEVAL_QUERY_MODE", "llm")
 
 # Helper: format lists
 def _format_list(items: Sequence[str], empty_placeholder: str = "None") -> str:
@@ -86,45 +87,45 @@ Retrieve information that:
 Return the most relevant passages for a clinician to review.
 """.strip()
 
-def _maybe_embed_test(embeddings) -> Optional[int]:
-    # compute one embedding and print its length; return dimension or None
-    try:
-        if hasattr(embeddings, "embed_documents"):
-            vecs = embeddings.embed_documents(["sample"])
-        elif hasattr(embeddings, "embed_query"):
-            vecs = [embeddings.embed_query("sample")]
-        else:
-            print("Embedding object has no known embed_documents/embed_query method; skipping test.")
-            return None
-    except Exception as e:
-        print("Embedding test failed:", e)
-        return None
-    if not vecs:
-        print("Embedding returned nothing.")
+def build_rerank_query(symptoms: List[str], red_flags: List[str], disease_prediction: object, transcription: str) -> str:
+    # Short query for the reranker: cross-encoders truncate long inputs
+    if isinstance(disease_prediction, dict) and "disease" in disease_prediction:
+        disease_str = disease_prediction["disease"]
+    else:
+        disease_str = str(disease_prediction)
+    parts = [disease_str, _format_list(symptoms, empty_placeholder="")]
+    if red_flags:
+        parts.append("red flags: " + _format_list(red_flags))
+    parts.append(transcription[:300])
+    return ". ".join(p for p in parts if p)
+
+def _predictions_for(disease_prediction: object) -> List[dict]:
+    if isinstance(disease_prediction, dict) and "top_diseases_by_bucket" in disease_prediction:
+        return top_predictions(disease_prediction, 5)
+    if isinstance(disease_prediction, dict) and "disease" in disease_prediction:
+        return [disease_prediction]
+    return []
+
+def auto_filter_for(disease_prediction: object) -> Optional[dict]:
+    """e.g. {"specialty": ["cardiology"]} when the top-5 predictions are mostly cardiac."""
+    preds = _predictions_for(disease_prediction)
+    if not preds:
         return None
-    print("embedding vector length:", len(vecs[0]))
-    return len(vecs[0])
+    specialties = specialties_for_predictions(preds)
+    return {"specialty": specialties} if specialties else None
 
-def print_collection_info(vectorstore):
-    try:
-        coll = getattr(vectorstore, "_collection", None)
-        client = getattr(vectorstore, "_client", None)
-        print("vectorstore._collection set:", bool(coll))
-        # try to read collection count
+def _print_results(docs) -> None:
+    print("[run_custom_multiquery_retrieval] total unique docs:", len(docs))
+    for i, doc in enumerate(docs[:10], start=1):
+        print(f"\n--- Result {i} ---")
+        content = getattr(doc, "page_content", "")
         try:
-            print("collection.count():", coll.count() if coll else "n/a")
-        except Exception:
-            try:
-                # attempt via client
-                if client and hasattr(client, "get_or_create_collection"):
-                    c = client.get_or_create_collection(collection_name=COLLECTION_NAME)
-                    print("client.get_or_create_collection.count (fallback):", getattr(c, "count", lambda: "n/a")())
-            except Exception:
-                pass
-    except Exception:
-        traceback.print_exc()
+            print(content[:1000])
+        except UnicodeEncodeError:
+            # Fallback for environments where UTF-8 reconfigure isn't enough
+            print(content[:1000].encode('ascii', errors='replace').decode('ascii'))
 
-def run_custom_multiquery_retrieval(
+async def arun_custom_multiquery_retrieval(
     transcription: str,
     symtom_list: List[str],
     duration: Optional[str],
@@ -133,62 +134,124 @@ def run_custom_multiquery_retrieval(
     *,
     num_queries: int = 3,
     k_per_query: int = 10,
+    filters: Optional[dict] = None,
+    auto_filter: bool = RETRIEVAL_AUTO_FILTER,
+    query_mode: str = RETRIEVAL_QUERY_MODE,
 ):
-    # ensure DB path exists
-    if not os.path.isdir(CHROMA_DB_PATH):
-        raise FileNotFoundError(f"Chroma DB path not found: {CHROMA_DB_PATH}")
+    """
+    Async retrieval for callers already inside an event loop (e.g. the backend).
 
-    # instantiate embeddings (match builder)
-    embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
-    emb_dim = _maybe_embed_test(embeddings)
-    if emb_dim is None:
-        print("Warning: embedding dimension unknown; continue but check compatibility with your collection.")
+    filters: optional metadata filter, e.g.
+        {"specialty": ["cardiology"], "doc_type": ["guideline"], "min_year": 2015}
+    auto_filter: when no filters are given, derive a specialty filter from
+        the top-5 predictions (see auto_filter_for).
+    query_mode: "llm" embeds build_clinical_query and lets the LLM rewrite
+        it when needed; "facets" searches a short case query plus
+        per-symptom-cluster, per-disease and red-flag sub-queries built
+        without any LLM (Facet_Queries).
+    """
+    # warm, process-wide collection handle (opened and validated once,
+    # reloaded only when ingestion bumps the index version)
+    store = get_knowledge_store(CHROMA_DB_PATH, COLLECTION_NAME, EMBEDDING_MODEL)
+    await asyncio.to_thread(store.refresh)
 
-    # open Chroma collection
-    try:
-        vectorstore = Chroma(
-            collection_name=COLLECTION_NAME,
-            persist_directory=CHROMA_DB_PATH,
-            embedding_function=embeddings,
+    # result cache keyed on the structured case (ids + scores only)
+    cache = get_retrieval_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = case_key(
+            COLLECTION_NAME, transcription, symtom_list, duration, red_flags, _predictions_for(disease_prediction),
+            {"num_queries": num_queries, "k_per_query": k_per_query, "filters": filters,
+             "auto_filter": auto_filter, "query_mode": query_mode,
+             "cutoffs": [mqr.MULTIQUERY_MIN_SCORE, mqr.MULTIQUERY_SCORE_GAP, mqr.MULTIQUERY_MAX_TOTAL,
+                         mqr.MULTIQUERY_CONFIDENT_SCORE, mqr.MULTIQUERY_ENOUGH_EVIDENCE]},
         )
-    except Exception as e:
-        traceback.print_exc()
-        raise RuntimeError("Failed to open Chroma collection; check embedding compatibility and collection name.") from e
-
-    print_collection_info(vectorstore)
-
+        entries = await asyncio.to_thread(cache.get, cache_key, COLLECTION_NAME, store.version)
+        if entries is not None:
+            docs_by_id = await asyncio.to_thread(store.get_documents, [e["id"] for e in entries])
+            docs = restore(entries, docs_by_id)
+            if docs is not None:
+                print(f"[run_custom_multiquery_retrieval] result cache hit ({len(docs)} docs).")
+                return await asyncio.to_thread(expand_to_parents, docs, store.parents)
 
-    # create retriever
-    base_retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": k_per_query})
+    # metadata filter resolved against the facet side index before searching
+    if filters is None and auto_filter:
+        filters = auto_filter_for(disease_prediction)
+    # candidate ids are only fetched when a backend filters by id (BM25 fusion, mapped/quantized index)
+    lexical, vector_index = store.lexical, store.vector_index
+    where, allowed_ids = await asyncio.to_thread(
+        resolve_filter, store.facets, filters, need_ids=vector_index is not None or len(lexical) > 0
+    )
+    base_retriever = store.as_retriever(k_per_query, where=where)
 
-    # LLM to generate alternative queries
+    # LLM to generate alternative queries (rewrites are cached by Multi_Query_Retriver's
+    # rewrite cache; no LLM response cache on top of it)
     llm = get_chat_model(model=DEFAULT_LLM_MODEL, temperature=0.2)
 
     # build query
-    query = build_clinical_query(transcription, symtom_list, duration, red_flags, disease_prediction)
-    print("[run_custom_multiquery_retrieval] clinical query (preview):")
+    sub_queries = None
+    if query_mode == "facets":
+        preds = _predictions_for(disease_prediction)
+        query = build_case_query(symtom_list, duration, preds)
+        sub_queries = build_facet_queries(symtom_list, duration, red_flags, preds)
+    else:
+        query = build_clinical_query(transcription, symtom_list, duration, red_flags, disease_prediction)
+    print(f"[run_custom_multiquery_retrieval] {query_mode} query (preview):")
     print(query[:500])
 
     # call multi-query retriever
-    docs = multi_query_retrieve(
+    docs = await amulti_query_retrieve(
         base_retriever=base_retriever,
         llm=llm,
         user_query=query,
         num_queries=num_queries,
         k_per_query=k_per_query,
+        lexical_index=lexical,
+        where=where,
+        allowed_ids=allowed_ids,
+        vector_index=vector_index,
+        sub_queries=sub_queries,
     )
+    # near-duplicate removal + per-source caps (one pass over the ranked list)
+    docs = diversify(docs)
+    # optional rerank: whole candidate set scored in one batch, top N kept
+    rerank_query = build_rerank_query(symtom_list, red_flags, disease_prediction, transcription)
+    docs = await asyncio.to_thread(rerank, rerank_query, docs)
+    if cache_key is not None:
+        await asyncio.to_thread(cache.put, cache_key, COLLECTION_NAME, store.version, docs)
+    # small-to-big: grow child hits into the parent spans they need, within the token budget
+    docs = await asyncio.to_thread(expand_to_parents, docs, store.parents)
 
-    print("[run_custom_multiquery_retrieval] total unique docs:", len(docs))
-    for i, doc in enumerate(docs[:10], start=1):
-        print(f"\n--- Result {i} ---")
-        content = getattr(doc, "page_content", "")
-        try:
-            print(content[:1000])
-        except UnicodeEncodeError:
-            # Fallback for environments where UTF-8 reconfigure isn't enough
-            print(content[:1000].encode('ascii', errors='replace').decode('ascii'))
+    _print_results(docs)
     return docs
 
+def run_custom_multiquery_retrieval(
+    transcription: str,
+    symtom_list: List[str],
+    duration: Optional[str],
+    red_flags: List[str],
+    disease_prediction: object,
+    *,
+    num_queries: int = 3,
+    k_per_query: int = 10,
+    filters: Optional[dict] = None,
+    auto_filter: bool = RETRIEVAL_AUTO_FILTER,
+    query_mode: str = RETRIEVAL_QUERY_MODE,
+):
+    # sync entry point: runs the async retrieval on the shared bridge loop
+    return run_sync(arun_custom_multiquery_retrieval(
+        transcription,
+        symtom_list,
+        duration,
+        red_flags,
+        disease_prediction,
+        num_queries=num_queries,
+        k_per_query=k_per_query,
+        filters=filters,
+        auto_filter=auto_filter,
+        query_mode=query_mode,
+    ))
+
 if __name__ == "__main__":
     # Demo placeholders — replace with actual outputs from your audio->symptom pipeline
     transcription_demo = "Patient reports progressive breathlessness for 3 days with chest tightness."
@@ -1,70 +1,211 @@
 # build_index.py
+"""
+Full index build: every PDF under PDF_FOLDER into a fresh collection.
+
+Streaming pipeline, so memory stays bounded whatever the corpus size:
+
+  process pool   PyPDFLoader parsing + facet tagging + chunking, one PDF per
+                 task; at most 2 x INGEST_WORKERS PDFs are in flight
+  main thread    cuts finished PDFs into embedding batches and puts them on
+                 a bounded queue (INGEST_QUEUE_BATCHES); a full queue stops
+                 new PDFs from being submitted
+  embed thread   embeds + adds each batch, writes its facet rows, and flushes
+                 a BM25 segment every INGEST_SEGMENT_CHUNKS chunks
+
+Progress (pages, chunks and embeddings per second) is printed every
+INGEST_PROGRESS_S seconds.
+"""
+
 from pathlib import Path
 import os
-from langchain_community.embeddings import OllamaEmbeddings
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter, Language
 from langchain_chroma import Chroma
+from MY_Model import get_embedding_model, EMBEDDING_MODEL_NAME
+from Knowledge_Store import record_index_update
+from Lexical_Index import write_segment
+from Near_Dup import add_signatures
+from Metadata_Filter import FacetIndex, tag_pages
+from Parent_Store import SMALL_TO_BIG_ENABLED, ParentStore, make_children
+from Ingest_Manifest import source_name
 
 # CONFIG - change if needed
-EMBEDDING_MODEL = "bge-m3"  # or "nomic-embed-text:latest" — same value must be used in retrieval
-OLLAMA_BASE_URL = "http://127.0.0.1:11434"  # set to your Ollama host if different
+EMBEDDING_MODEL = EMBEDDING_MODEL_NAME  # same value must be used in retrieval (host: OLLAMA_BASE_URL env)
 PDF_FOLDER = Path(r"C:\CareFusion-AI\External_knowledger")
 PERSIST_DIR = r"C:\CareFusion-AI\chroma_external_bge_m3"   # new clean folder
 COLLECTION_NAME = "external_bge_m3"  # use a stable human-readable name
+CHUNK_SIZE = 3000
+CHUNK_OVERLAP = 300
+BATCH = 32
+
+# Pipeline knobs
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+INGEST_QUEUE_BATCHES = int(os.environ.get("INGEST_QUEUE_BATCHES", "8"))
+INGEST_SEGMENT_CHUNKS = int(os.environ.get("INGEST_SEGMENT_CHUNKS", "20000"))
+INGEST_PROGRESS_S = float(os.environ.get("INGEST_PROGRESS_S", "10"))
 
-# create persist dir if missing
-os.makedirs(PERSIST_DIR, exist_ok=True)
+_STOP = object()
 
-# 1) embeddings
-embeddings = OllamaEmbeddings(
-    model=EMBEDDING_MODEL,
-    base_url=OLLAMA_BASE_URL,
-)
 
-# 2) load PDFs as pages (PyPDFLoader yields a Document per page)
-all_docs = []
-for pdf in PDF_FOLDER.rglob("*.pdf"):
+def parse_pdf(path: str):
+    """
+    Worker (process pool): one PDF -> (path, page count, chunks, error).
+    PyPDFLoader yields a Document per page; chunks carry the facet tags.
+    """
     try:
-        print("Loading:", pdf)
-        loader = PyPDFLoader(str(pdf))
-        pages = loader.load()
-        all_docs.extend(pages)
+        pages = PyPDFLoader(path).load()
+        source = source_name(path)  # same `source` form as Add_New_doc and the upload route
+        for page in pages:
+            page.metadata["source"] = source
+        tag_pages(pages, source)  # specialty / doc_type / pub_year facets
+        splitter = RecursiveCharacterTextSplitter.from_language(
+            language=Language.MARKDOWN,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+        )
+        chunks = splitter.split_documents(pages)
+        if not SMALL_TO_BIG_ENABLED:
+            add_signatures(chunks)  # SimHash per chunk for query-time near-dup suppression
+        return path, len(pages), chunks, None
     except Exception as e:
-        print("Skipping PDF (load error):", pdf, "->", e)
-
-print(f"Loaded {len(all_docs)} PDF pages.")
-
-# 3) split to chunks
-splitter = RecursiveCharacterTextSplitter.from_language(
-    language=Language.MARKDOWN,
-    chunk_size=3000,
-    chunk_overlap=300,
-)
-chunks = splitter.split_documents(all_docs)
-print(f"Split into {len(chunks)} chunks.")
-
-# 4) create vectorstore and add
-vectorstore = Chroma(
-    collection_name=COLLECTION_NAME,
-    persist_directory=PERSIST_DIR,
-    embedding_function=embeddings,
-)
-
-# Add in batches
-BATCH = 32
-for i in range(0, len(chunks), BATCH):
-    batch = chunks[i : i + BATCH]
-    print(f"Adding batch {i}-{i+len(batch)-1} ({len(batch)})")
-    vectorstore.add_documents(batch)
-
-# 5) persist (langchain_chroma persist may be implicit but call anyway)
-try:
-    vectorstore.persist()
-except Exception:
-    # older/newer wrappers differ; ignore non-fatal
-    pass
-
-print("✅ Finished indexing into Chroma.")
-print("Persist dir:", PERSIST_DIR)
-print("Collection name:", COLLECTION_NAME)
+        return path, 0, [], str(e)
+
+
+class Progress:
+    def __init__(self, every_s: float = INGEST_PROGRESS_S):
+        self.every_s = every_s
+        self.lock = threading.Lock()
+        self.start = self._last = time.perf_counter()
+        self.pdfs = self.pages = self.chunks = self.embedded = 0
+
+    def add(self, pdfs: int = 0, pages: int = 0, chunks: int = 0, embedded: int = 0) -> None:
+        with self.lock:
+            self.pdfs += pdfs
+            self.pages += pages
+            self.chunks += chunks
+            self.embedded += embedded
+            now = time.perf_counter()
+            if now - self._last < self.every_s:
+                return
+            self._last = now
+        self.report()
+
+    def report(self, final: bool = False) -> None:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        label = "Done" if final else "Progress"
+        print(f"[{label}] {self.pdfs} PDFs, {self.pages} pages ({self.pages / elapsed:.1f}/s), "
+              f"{self.chunks} chunks ({self.chunks / elapsed:.1f}/s), "
+              f"{self.embedded} embedded ({self.embedded / elapsed:.1f}/s) in {elapsed:.0f}s")
+
+
+def embed_worker(batches: "queue.Queue", vectorstore: Chroma, facets: FacetIndex, progress: Progress,
+                 errors: list) -> None:
+    """Consumer: embed + add each batch; BM25 segments are flushed as they fill."""
+    seg_ids, seg_texts = [], []
+    while True:
+        batch = batches.get()
+        if batch is _STOP:
+            break
+        if errors:
+            continue  # drain so the producer never blocks on a dead consumer
+        try:
+            ids = vectorstore.add_documents(batch)
+            facets.add(ids, [c.metadata for c in batch])  # facet side index for filtered retrieval
+            seg_ids.extend(ids)
+            seg_texts.extend(c.page_content for c in batch)
+            if len(seg_ids) >= INGEST_SEGMENT_CHUNKS:
+                write_segment(PERSIST_DIR, COLLECTION_NAME, seg_ids, seg_texts)
+                seg_ids, seg_texts = [], []
+            progress.add(embedded=len(batch))
+        except Exception as e:
+            errors.append(e)
+    if seg_ids and not errors:
+        # BM25 lexical segment for the remaining chunks (hybrid retrieval)
+        write_segment(PERSIST_DIR, COLLECTION_NAME, seg_ids, seg_texts)
+
+
+def _enqueue(result, batches: "queue.Queue", parent_store, progress: Progress, errors: list) -> None:
+    path, n_pages, chunks, error = result
+    if error is not None:
+        print("Skipping PDF (load error):", path, "->", error)
+        return
+    if parent_store is not None:
+        # the 3000-char chunks become parents in the side store; small children are embedded
+        chunks = make_children(chunks, parent_store)
+        add_signatures(chunks)
+    progress.add(pdfs=1, pages=n_pages, chunks=len(chunks))
+    for i in range(0, len(chunks), BATCH):
+        if errors:
+            return
+        batches.put(chunks[i : i + BATCH])  # blocks while the embedder is behind
+
+
+def main() -> None:
+    # create persist dir if missing
+    os.makedirs(PERSIST_DIR, exist_ok=True)
+
+    # 1) embeddings (pooled client from the shared registry) + vectorstore
+    embeddings = get_embedding_model(EMBEDDING_MODEL)
+    vectorstore = Chroma(
+        collection_name=COLLECTION_NAME,
+        persist_directory=PERSIST_DIR,
+        embedding_function=embeddings,
+    )
+    facets = FacetIndex(PERSIST_DIR, COLLECTION_NAME)
+    parent_store = ParentStore(PERSIST_DIR, COLLECTION_NAME) if SMALL_TO_BIG_ENABLED else None
+
+    # 2) embedding consumer behind a bounded queue
+    progress = Progress()
+    batches: "queue.Queue" = queue.Queue(maxsize=INGEST_QUEUE_BATCHES)
+    errors: list = []
+    consumer = threading.Thread(
+        target=embed_worker, args=(batches, vectorstore, facets, progress, errors), name="embed-batches", daemon=True
+    )
+    consumer.start()
+
+    # 3) parse + chunk PDFs in the process pool, at most 2 x workers in flight
+    pdfs = iter(sorted(str(p) for p in PDF_FOLDER.rglob("*.pdf")))
+    max_inflight = INGEST_WORKERS * 2
+    pending = set()
+    print(f"Indexing {PDF_FOLDER} with {INGEST_WORKERS} parser processes.")
+    with ProcessPoolExecutor(max_workers=INGEST_WORKERS) as pool:
+        for path in pdfs:
+            pending.add(pool.submit(parse_pdf, path))
+            if len(pending) < max_inflight:
+                continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                _enqueue(fut.result(), batches, parent_store, progress, errors)
+            if errors:
+                break
+        for fut in pending:
+            _enqueue(fut.result(), batches, parent_store, progress, errors)
+
+    batches.put(_STOP)
+    consumer.join()
+    if errors:
+        raise RuntimeError(f"embedding failed: {errors[0]}") from errors[0]
+    progress.report(final=True)
+
+    # 4) persist (langchain_chroma persist may be implicit but call anyway)
+    try:
+        vectorstore.persist()
+    except Exception:
+        # older/newer wrappers differ; ignore non-fatal
+        pass
+
+    # 5) bump the index version so warm retrievers reload
+    version = record_index_update(vectorstore, PERSIST_DIR, COLLECTION_NAME, EMBEDDING_MODEL)
+
+    print("✅ Finished indexing into Chroma.")
+    print("Persist dir:", PERSIST_DIR)
+    print("Collection name:", COLLECTION_NAME)
+    print("Index version:", version)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,22 +3,15 @@ import os
 import traceback
 from typing import List, Sequence, Optional
 
-# Use langchain_ollama if installed; fallback to community wrapper
-try:
-    from langchain_ollama import OllamaEmbeddings, ChatOllama
-except Exception:
-    from langchain_community.embeddings import OllamaEmbeddings  # type: ignore
-    from langchain_community.chat_models import ChatOllama  # type: ignore
-
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
 
 # import your Multi_Query_Retriver implementation
 from Multi_Query_Retriver import multi_query_retrieve
+from MY_Model import get_chat_model, get_embedding_model, DEFAULT_LLM_MODEL, EMBEDDING_MODEL_NAME
 
 # CONFIG: must match build_index.py
-EMBEDDING_MODEL = "bge-m3"
-OLLAMA_BASE_URL = "http://127.0.0.1:11434"
+EMBEDDING_MODEL = EMBEDDING_MODEL_NAME
 CHROMA_DB_PATH = r"C:\CareFusion-AI\chroma_external_bge_m3"
 COLLECTION_NAME = "external_bge_m3"
 
@@ -86,8 +79,8 @@ def run_demo():
     if not os.path.isdir(CHROMA_DB_PATH):
         raise FileNotFoundError(f"Chroma DB path not found: {CHROMA_DB_PATH}")
 
-    # instantiate embeddings exactly as in build_index
-    embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
+    # pooled embeddings client, same model as build_index
+    embeddings = get_embedding_model(EMBEDDING_MODEL, cache=True)
     emb_dim = simple_embedding_check(embeddings)
     if emb_dim is None:
         raise RuntimeError("Embedding check failed - fix Ollama / embedding model")
@@ -108,7 +101,7 @@ def run_demo():
     base_retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 10})
 
     # LLM to generate alternate queries (same type you used elsewhere)
-    llm = ChatOllama(model="llama3.2:3b", temperature=0.2)
+    llm = get_chat_model(model=DEFAULT_LLM_MODEL, temperature=0.2)
 
     # Demo clinical inputs (replace with real ones)
     transcription = "Patient reports progressive breathlessness for 3 days with chest tightness."
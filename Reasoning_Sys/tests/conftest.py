@@ -0,0 +1,9 @@
+# conftest.py
+"""Pipeline modules import each other by bare name; put the pipeline dir on sys.path."""
+
+import os
+import sys
+
+PIPELINE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pipeline")
+if PIPELINE_DIR not in sys.path:
+    sys.path.insert(0, PIPELINE_DIR)
@@ -0,0 +1,79 @@
+import math
+import random
+
+import pytest
+
+from Ann_Snapshot import SnapshotHandle, export_snapshot
+
+
+class FakeCollection:
+    """Chroma-like collection paged by collection.get(limit, offset, include)."""
+
+    def __init__(self, rows):
+        self.rows = rows  # [(id, vector, text, metadata)]
+
+    def get(self, limit, offset, include=None):
+        page = self.rows[offset : offset + limit]
+        return {
+            "ids": [r[0] for r in page],
+            "embeddings": [r[1] for r in page],
+            "documents": [r[2] for r in page],
+            "metadatas": [r[3] for r in page],
+        }
+
+
+def _rows(n, dim=32, seed=0):
+    rng = random.Random(seed)
+    return [(f"c{i}", [rng.gauss(0, 1) for _ in range(dim)], f"text {i}", {"i": i}) for i in range(n)]
+
+
+def _exact_top(rows, query, k, allowed=None):
+    def cos(a, b):
+        return sum(x * y for x, y in zip(a, b)) / math.sqrt(sum(x * x for x in a) * sum(y * y for y in b))
+
+    scored = [(cos(query, vec), chunk_id) for chunk_id, vec, _, _ in rows if allowed is None or chunk_id in allowed]
+    return [chunk_id for _, chunk_id in sorted(scored, reverse=True)[:k]]
+
+
+def test_export_and_search_match_exact_cosine(tmp_path):
+    rows = _rows(200)
+    current = export_snapshot(FakeCollection(rows), str(tmp_path), "kb", source_version="v1", nlist=4, page_size=64)
+    assert current["count"] == 200 and current["source_version"] == "v1"
+
+    snap = SnapshotHandle(str(tmp_path), "kb", poll_s=0).current()
+    query = rows[17][1]
+    # probing every list with a full rescore is exact
+    hits = snap.search_indices(query, 5, nprobe=4, rescore=200)
+    assert [snap.ids[r] for r, _ in hits] == _exact_top(rows, query, 5)
+    assert hits[0][1] == pytest.approx(1.0, abs=1e-5)
+
+    allowed = {f"c{i}" for i in range(0, 200, 3)}
+    got = snap.search(query, 5, allowed_ids=allowed, rescore=200)
+    assert [chunk["id"] for chunk, _ in got] == _exact_top(rows, query, 5, allowed)
+    assert got[0][0]["metadata"]["i"] % 3 == 0
+
+    found = snap.lookup(["c5", "missing"])
+    assert set(found) == {"c5"} and found["c5"][0]["text"] == "text 5"
+    snap.close()
+
+
+def test_swap_closes_old_mapping_after_in_flight_search(tmp_path):
+    rows = _rows(50)
+    export_snapshot(FakeCollection(rows), str(tmp_path), "kb", source_version="v1", nlist=2)
+    handle = SnapshotHandle(str(tmp_path), "kb", poll_s=0)
+    old = handle.current()
+
+    in_flight = old._enter()  # a search still running on the old mapping
+    export_snapshot(FakeCollection(rows[:40]), str(tmp_path), "kb", source_version="v2", nlist=2)
+    new = handle.current()
+    assert new is not old and new.source_version == "v2" and handle.swaps == 2
+    assert not old.closed
+    in_flight._exit()
+    assert old.closed
+
+    # a caller still holding the retired snapshot is served by its successor
+    hits = old.search(rows[3][1], 3)
+    assert hits[0][0]["id"] == "c3" and len(new) == 40
+    with pytest.raises(ValueError):
+        old.search_indices(rows[3][1], 3)
+    handle.close()
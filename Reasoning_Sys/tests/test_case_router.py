@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+pytest.importorskip("pydantic")
+pytest.importorskip("langchain_ollama")
+
+import Case_Router
+from Case_Router import log_routing_decision, route_case, score_case_complexity
+from MY_Model import FAST_LLM_MODEL, FINAL_LLM_MODEL
+
+CLEAR = [{"disease": "Common cold", "prob": 0.8}, {"disease": "Allergic rhinitis", "prob": 0.1}]
+AMBIGUOUS = [{"disease": "Pneumonia", "prob": 0.3}, {"disease": "Bronchitis", "prob": 0.28},
+             {"disease": "Asthma", "prob": 0.2}]
+
+
+def test_score_factors():
+    simple = score_case_complexity(["runny nose"], [], CLEAR, "Runny nose since yesterday.")
+    assert simple["top_prob_spread"] == pytest.approx(0.7)
+    assert simple["score"] < 0.2
+    complex_ = score_case_complexity(["cough"] * 6, [], AMBIGUOUS, "word " * 250)
+    assert complex_["score"] == pytest.approx(1.0 - 0.35 * (0.02 / 0.30), abs=1e-3)
+    # no predictions at all counts as fully ambiguous
+    assert score_case_complexity([], [], [], "")["score"] == pytest.approx(0.35)
+
+
+def test_simple_case_goes_to_fast_tier():
+    decision = route_case(["runny nose"], [], CLEAR, "Runny nose since yesterday.")
+    assert (decision.tier, decision.model, decision.prompt) == ("fast", FAST_LLM_MODEL, "compact_final_prompt_template")
+
+
+def test_complex_case_goes_to_full_tier():
+    decision = route_case(["cough", "fever", "chest pain", "fatigue"], [], AMBIGUOUS, "word " * 200)
+    assert (decision.tier, decision.model) == ("full", FINAL_LLM_MODEL)
+
+
+def test_any_red_flag_forces_full_tier():
+    decision = route_case(["runny nose"], ["blood in sputum"], CLEAR, "Runny nose.")
+    assert decision.tier == "full"
+    assert decision.reason == "red flags present"
+
+
+def test_threshold_is_configurable():
+    assert route_case(["runny nose"], [], CLEAR, "Runny nose.", threshold=0.0).tier == "full"
+
+
+def test_decisions_are_audited(tmp_path, monkeypatch):
+    log = tmp_path / "routing.jsonl"
+    monkeypatch.setattr(Case_Router, "ROUTING_AUDIT_LOG", str(log))
+    decision = route_case(["runny nose"], [], CLEAR, "Runny nose.")
+    log_routing_decision(decision, synthesis_latency_s=1.5, ttft_s=0.2)
+    entry = json.loads(log.read_text(encoding="utf-8").splitlines()[0])
+    assert entry["tier"] == "fast" and entry["synthesis_latency_s"] == 1.5
@@ -0,0 +1,73 @@
+import sqlite3
+
+import Disk_Cache
+from Disk_Cache import DiskLRUCache
+
+
+def _cache(tmp_path, max_bytes=30):
+    return DiskLRUCache(str(tmp_path / "c.sqlite"), max_bytes=max_bytes, name="test")
+
+
+def test_roundtrip_and_counters(tmp_path):
+    cache = _cache(tmp_path, max_bytes=1 << 20)
+    cache.set("a", b"alpha")
+    assert cache.get("a") == b"alpha"
+    assert cache.get("missing") is None
+    assert cache.get_many(["a", "missing"]) == {"a": b"alpha"}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["bytes"]) == (2, 2, 5)
+
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr("Disk_Cache.time.time", lambda: next(clock))
+    cache = _cache(tmp_path)
+    cache.set("a", b"x" * 10)
+    cache.set("b", b"x" * 10)
+    cache.set("c", b"x" * 10)
+    assert cache.get("a") is not None  # "b" is now the least recently used
+    cache.set("d", b"x" * 10)
+
+    assert cache.get("b") is None
+    assert all(cache.get(k) is not None for k in ("a", "c", "d"))
+    assert cache.evictions == 1
+    assert cache.stats()["bytes"] == 30
+
+
+def test_overwrite_does_not_double_count(tmp_path):
+    cache = _cache(tmp_path)
+    for _ in range(5):
+        cache.set("a", b"x" * 10)
+    assert cache.stats()["bytes"] == 10
+    assert cache.evictions == 0
+
+
+def test_delete_prefix_is_case_sensitive(tmp_path):
+    cache = _cache(tmp_path, max_bytes=1 << 20)
+    cache.set_many({"kb:1": b"1", "kb:2": b"2", "KB:3": b"3", "kb2:4": b"4"})
+    assert cache.delete_prefix("kb:") == 2
+    assert cache.get_many(["kb:1", "kb:2", "KB:3", "kb2:4"]) == {"KB:3": b"3", "kb2:4": b"4"}
+    assert cache.stats()["bytes"] == 2
+
+
+def test_hits_buffer_access_times_until_flush(tmp_path, monkeypatch):
+    monkeypatch.setattr("Disk_Cache.time.time", lambda: 100.0)
+    cache = _cache(tmp_path, max_bytes=1 << 20)
+    cache.set_many({"a": b"1", "b": b"2"})
+    monkeypatch.setattr("Disk_Cache.time.time", lambda: 200.0)
+    assert cache.get("a") == b"1"
+
+    def last_access():
+        with sqlite3.connect(cache.path) as conn:
+            return dict(conn.execute("SELECT key, last_access FROM entries"))
+
+    assert last_access() == {"a": 100.0, "b": 100.0}  # the hit wrote nothing yet
+    cache.set("c", b"3")
+    assert last_access()["a"] == 200.0
+
+    monkeypatch.setattr(Disk_Cache, "_TOUCH_FLUSH_EVERY", 2)
+    monkeypatch.setattr("Disk_Cache.time.time", lambda: 300.0)
+    cache.get("b")
+    assert last_access()["b"] == 100.0  # one buffered touch, below the threshold
+    cache.get_many(["c"])
+    assert last_access()["b"] == 300.0 and last_access()["c"] == 300.0
@@ -0,0 +1,96 @@
+from Ingest_Manifest import IngestManifest, chunk_ids_for, config_key, file_digest, remove_file_chunks
+from Lexical_Index import LexicalIndex, write_segment
+
+
+def _write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_chunk_ids_are_deterministic():
+    cfg = config_key(chunk_size=4200, chunk_overlap=800)
+    assert cfg == config_key(chunk_overlap=800, chunk_size=4200)
+    assert cfg != config_key(chunk_size=3000, chunk_overlap=800)
+    assert chunk_ids_for("ab" * 32, cfg, 2, start=3) == [f"c-{'ab' * 10}-{cfg}-00003", f"c-{'ab' * 10}-{cfg}-00004"]
+
+
+def test_plan_states(tmp_path):
+    manifest = IngestManifest(str(tmp_path / "db"), "kb")
+    a = _write(tmp_path / "a.pdf", b"version one")
+    h1 = file_digest(a)
+
+    assert manifest.plan(a, h1, "cfg")[0] == "new"
+    manifest.record(a, h1, "cfg", "a.pdf", ["c-1", "c-2"])
+    state, entry = manifest.plan(a, h1, "cfg")
+    assert state == "unchanged" and entry["chunk_ids"] == ["c-1", "c-2"]
+
+    copy = _write(tmp_path / "copy.pdf", b"version one")
+    state, entry = manifest.plan(copy, file_digest(copy), "cfg")
+    assert state == "duplicate" and entry["source"] == "a.pdf"
+
+    _write(tmp_path / "a.pdf", b"version two")
+    assert manifest.plan(a, file_digest(a), "cfg")[0] == "modified"
+    assert manifest.plan(a, h1, "other-cfg")[0] == "modified"
+
+    manifest.forget(a)
+    assert manifest.plan(a, h1, "cfg")[0] == "new"
+    assert manifest.stats() == {"files": 0, "chunks": 0}
+
+
+class FakeVectorstore:
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+
+
+class FakeFacets:
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+
+
+def test_remove_file_chunks_drops_bm25_postings(tmp_path):
+    persist = str(tmp_path)
+    write_segment(persist, "kb", ["old-1", "old-2", "keep"], ["gout flare", "gout colchicine", "gout diet"])
+    vectorstore, facets = FakeVectorstore(), FakeFacets()
+
+    n = remove_file_chunks(vectorstore, facets, {"chunk_ids": ["old-1", "old-2"], "source": "a.pdf"}, persist, "kb")
+
+    assert n == 2
+    assert vectorstore.deleted == facets.deleted == ["old-1", "old-2"]
+    index = LexicalIndex(persist, "kb")
+    try:
+        assert [doc_id for doc_id, _ in index.search("gout", 10)] == ["keep"]
+    finally:
+        index.close()
+
+
+def test_modified_original_keeps_chunks_of_recorded_duplicate(tmp_path):
+    persist = str(tmp_path / "db")
+    manifest = IngestManifest(persist, "kb")
+    a = _write(tmp_path / "a.pdf", b"shared content")
+    copy = _write(tmp_path / "copy.pdf", b"shared content")
+    h = file_digest(a)
+    manifest.record(a, h, "cfg", "a.pdf", ["c-1", "c-2"])
+
+    state, entry = manifest.plan(copy, h, "cfg")
+    assert state == "duplicate"
+    manifest.record_duplicate(copy, entry)
+    assert manifest.plan(copy, h, "cfg")[0] == "unchanged"
+
+    _write(tmp_path / "a.pdf", b"new content")
+    state, entry = manifest.plan(a, file_digest(a), "cfg")
+    assert state == "modified"
+    vectorstore, facets = FakeVectorstore(), FakeFacets()
+    assert remove_file_chunks(vectorstore, facets, entry, persist, "kb", manifest=manifest) == 0
+    assert vectorstore.deleted == facets.deleted == []
+
+    # once the copy is gone too, its chunks are removed
+    manifest.forget(a)
+    copy_entry = manifest.lookup(copy)
+    assert remove_file_chunks(vectorstore, facets, copy_entry, persist, "kb", manifest=manifest) == 2
+    assert vectorstore.deleted == ["c-1", "c-2"]
@@ -0,0 +1,73 @@
+import os
+
+from Lexical_Index import LexicalIndex, clear_segments, delete_ids, lexical_dir, tokenize, write_segment
+
+
+def _index(tmp_path):
+    return LexicalIndex(str(tmp_path), "coll")
+
+
+def test_tokenize_drops_stopwords_and_single_chars():
+    assert tokenize("The chest pain of a 5 year-old") == ["chest", "pain", "year", "old"]
+
+
+def test_search_ranks_matching_chunk_first(tmp_path):
+    write_segment(str(tmp_path), "coll", ["a", "b", "c"], [
+        "acute chest pain radiating to the left arm",
+        "chronic cough with sputum",
+        "abdominal pain after meals",
+    ])
+    idx = _index(tmp_path)
+    hits = idx.search("chest pain", 3)
+    assert hits[0][0] == "a"
+    assert {doc_id for doc_id, _ in hits} == {"a", "c"}
+    idx.close()
+
+
+def test_rewritten_id_is_scored_once_with_latest_text(tmp_path):
+    write_segment(str(tmp_path), "coll", ["a", "b"], ["migraine headache aura", "asthma wheeze"])
+    write_segment(str(tmp_path), "coll", ["a"], ["gout joint swelling"])
+    idx = _index(tmp_path)
+    assert len(idx) == 2
+    assert idx.search("migraine", 5) == []
+    hits = idx.search("gout swelling", 5)
+    assert [doc_id for doc_id, _ in hits] == ["a"]
+    idx.close()
+
+
+def test_corpus_stats_match_a_fresh_index(tmp_path):
+    fresh = tmp_path / "fresh"
+    write_segment(str(fresh), "coll", ["a", "b"], ["fever rash", "fever cough"])
+    layered = tmp_path / "layered"
+    write_segment(str(layered), "coll", ["a", "b", "x"], ["old text", "fever cough", "fever stale"])
+    write_segment(str(layered), "coll", ["a"], ["fever rash"])
+    delete_ids(str(layered), "coll", ["x"])
+    one, two = LexicalIndex(str(fresh), "coll"), LexicalIndex(str(layered), "coll")
+    assert (len(one), one.avgdl) == (len(two), two.avgdl)
+    assert one.search("fever rash", 5) == two.search("fever rash", 5)
+    one.close()
+    two.close()
+
+
+def test_tombstoned_ids_disappear_and_can_be_re_added(tmp_path):
+    write_segment(str(tmp_path), "coll", ["a", "b"], ["sepsis lactate", "sepsis antibiotics"])
+    delete_ids(str(tmp_path), "coll", ["a"])
+    idx = _index(tmp_path)
+    assert [doc_id for doc_id, _ in idx.search("sepsis", 5)] == ["b"]
+    idx.close()
+    write_segment(str(tmp_path), "coll", ["a"], ["sepsis fluids"])
+    idx = _index(tmp_path)
+    assert {doc_id for doc_id, _ in idx.search("sepsis", 5)} == {"a", "b"}
+    idx.close()
+
+
+def test_clear_segments_closes_the_open_index_and_removes_files(tmp_path):
+    write_segment(str(tmp_path), "coll", ["a"], ["stroke weakness"])
+    idx = _index(tmp_path)
+    clear_segments(str(tmp_path), "coll", index=idx)
+    assert idx.segments == []
+    remaining = os.listdir(lexical_dir(str(tmp_path), "coll"))
+    assert all(name.startswith("reset-") for name in remaining)
+    assert len(_index(tmp_path)) == 0
+    write_segment(str(tmp_path), "coll", ["b"], ["stroke thrombolysis"])
+    assert [doc_id for doc_id, _ in _index(tmp_path).search("stroke", 5)] == ["b"]
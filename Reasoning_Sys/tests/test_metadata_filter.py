@@ -0,0 +1,61 @@
+import Metadata_Filter
+from Metadata_Filter import FacetIndex, classify_specialty, resolve_filter, specialties_for_predictions
+
+
+def test_keywords_match_whole_tokens():
+    assert classify_specialty("Heart failure with reduced ejection fraction") == "cardiology"
+    assert classify_specialty("Heartburn after meals") == "gastroenterology"
+    assert classify_specialty("Adrenal insufficiency") == "endocrinology"
+    assert classify_specialty("Archived notes") == "general"
+
+
+def test_stems_match_token_prefixes():
+    assert classify_specialty("Cardiac arrest") == "cardiology"
+    assert classify_specialty("Pericarditis") == "cardiology"
+    assert classify_specialty("Hypothyroidism in pregnancy") == "endocrinology"
+    assert classify_specialty("Crohn's disease") == "gastroenterology"
+
+
+def test_plurals_match():
+    assert classify_specialty("Recurrent headaches and seizures") == "neurology"
+    assert classify_specialty("Itchy rashes") == "dermatology"
+
+
+def test_specialties_for_predictions():
+    cardiac = [{"disease": "Myocardial infarction", "prob": 0.5}, {"disease": "Angina", "prob": 0.3},
+               {"disease": "GERD", "prob": 0.2}]
+    assert specialties_for_predictions(cardiac) == ["cardiology"]
+    # "heartburn" no longer counts as cardiac mass
+    mixed = [{"disease": "Heart failure", "prob": 0.5}, {"disease": "Heartburn", "prob": 0.5}]
+    assert specialties_for_predictions(mixed, min_share=0.6) == ["cardiology", "gastroenterology"]
+    unknown = [{"disease": "Fatigue", "prob": 0.7}, {"disease": "Heart failure", "prob": 0.3}]
+    assert specialties_for_predictions(unknown) == []
+
+
+def _facets(tmp_path):
+    facets = FacetIndex(str(tmp_path), "kb")
+    ids = [f"c{i}" for i in range(40)]
+    metas = [{"specialty": "cardiology" if i % 2 else "neurology", "doc_type": "guideline" if i % 4 < 2 else "review",
+              "pub_year": 2010 + i % 10} for i in range(40)]
+    facets.add(ids, metas)
+    return facets
+
+
+def test_facet_fields_intersect_in_sql(tmp_path):
+    facets = _facets(tmp_path)
+    filters = {"specialty": ["cardiology"], "doc_type": ["guideline"], "min_year": 2015}
+    expected = {f"c{i}" for i in range(40) if i % 2 and i % 4 < 2 and i % 10 >= 5}
+    assert facets.ids_for(filters) == expected
+    assert facets.count_for(filters) == len(expected)
+    assert facets.count_for({}) == 0 and facets.ids_for({}) == set()
+
+
+def test_resolve_filter_counts_first_and_fetches_ids_on_demand(tmp_path, monkeypatch):
+    facets = _facets(tmp_path)
+    monkeypatch.setattr(Metadata_Filter, "FILTER_MIN_CANDIDATES", 10)
+    where, ids = resolve_filter(facets, {"specialty": ["cardiology"]}, need_ids=False)
+    assert where == {"specialty": {"$in": ["cardiology"]}} and ids is None
+    where, ids = resolve_filter(facets, {"specialty": ["cardiology"]})
+    assert len(ids) == 20
+    # too narrow: dropped on the count alone
+    assert resolve_filter(facets, {"specialty": ["cardiology"], "min_year": 2019}) == (None, None)
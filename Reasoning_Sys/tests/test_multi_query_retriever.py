@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("langchain_ollama")
+
+import Multi_Query_Retriver as mqr
+
+
+class FakeEmbeddings:
+    def __init__(self, table):
+        self.table = table
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [self.table[t] for t in texts]
+
+
+class FakeCollection:
+    """Chroma-like collection over unit vectors with cosine distances."""
+
+    metadata = {"hnsw:space": "cosine"}
+
+    def __init__(self, rows):
+        self.rows = rows  # id -> (text, vector)
+        self.queries = 0
+
+    def query(self, query_embeddings, n_results, where=None, include=None):
+        self.queries += len(query_embeddings)
+        out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for q in query_embeddings:
+            ranked = sorted(
+                ((1.0 - sum(a * b for a, b in zip(q, vec)), doc_id, text) for doc_id, (text, vec) in self.rows.items())
+            )[:n_results]
+            out["ids"].append([r[1] for r in ranked])
+            out["documents"].append([r[2] for r in ranked])
+            out["metadatas"].append([{"source": r[1]} for r in ranked])
+            out["distances"].append([r[0] for r in ranked])
+        return out
+
+    def get(self, ids, include=None):
+        return {
+            "ids": ids,
+            "documents": [self.rows[i][0] for i in ids],
+            "metadatas": [{"source": i} for i in ids],
+            "embeddings": [self.rows[i][1] for i in ids] if "embeddings" in (include or []) else None,
+        }
+
+
+class FakeVectorStore:
+    def __init__(self, collection, embeddings):
+        self._collection = collection
+        self.embeddings = embeddings
+
+
+class FakeRetriever:
+    search_type = "similarity"
+
+    def __init__(self, collection, embeddings, k):
+        self.vectorstore = FakeVectorStore(collection, embeddings)
+        self.search_kwargs = {"k": k}
+
+
+class FakeLexical:
+    def __init__(self, hits):
+        self.hits = hits
+
+    def __len__(self):
+        return len(self.hits)
+
+    def search(self, query, k):
+        return self.hits[:k]
+
+
+def test_distance_to_similarity():
+    assert mqr._distance_to_similarity(0.2, "cosine") == pytest.approx(0.8)
+    # Chroma's ip distance is 1 - dot, negative when dot > 1
+    assert mqr._distance_to_similarity(0.2, "ip") == pytest.approx(0.8)
+    assert mqr._distance_to_similarity(-0.5, "ip") == pytest.approx(1.5)
+    assert mqr._distance_to_similarity(0.4, "l2") == pytest.approx(0.8)
+
+
+def test_vector_similarity_matches_search_scale():
+    q, d = [1.0, 0.0], [0.6, 0.8]
+    assert mqr._vector_similarity(q, d, "cosine") == pytest.approx(0.6)
+    assert mqr._vector_similarity(q, d, "ip") == pytest.approx(0.6)
+    assert mqr._vector_similarity(q, d, "l2") == pytest.approx(0.6)
+
+
+def test_early_stop_skips_remaining_searches():
+    rows = {f"d{i}": (f"text {i}", [1.0, 0.0]) for i in range(4)}
+    collection = FakeCollection(rows)
+    embeddings = FakeEmbeddings({"q0": [1.0, 0.0], "q1": [0.0, 1.0], "q2": [0.0, 1.0]})
+    docs = asyncio.run(mqr.amulti_query_retrieve(
+        FakeRetriever(collection, embeddings, 4), None, "q0",
+        k_per_query=4, sub_queries=["q1", "q2"], enough_evidence=3, confident_score=0.9,
+    ))
+    assert embeddings.calls == [["q0", "q1", "q2"]]  # one batched embedding call
+    assert collection.queries == 1  # q1 and q2 were never searched
+    assert len(docs) == 4
+
+
+def test_min_score_applies_to_lexical_only_hits():
+    rows = {
+        "dense": ("dense text", [1.0, 0.0]), "dense2": ("dense text 2", [0.99, 0.141]),
+        "near": ("near text", [0.8, 0.6]), "far": ("far text", [0.0, 1.0]),
+    }
+    collection = FakeCollection(rows)
+    embeddings = FakeEmbeddings({"q0": [1.0, 0.0], "q1": [1.0, 0.0]})
+    docs = asyncio.run(mqr.amulti_query_retrieve(
+        FakeRetriever(collection, embeddings, 2), None, "q0",
+        k_per_query=2, sub_queries=["q1"], min_score=0.5, score_gap=0, enough_evidence=0,
+        lexical_index=FakeLexical([("far", 3.0), ("near", 2.0)]),
+    ))
+    by_id = {d.id: d.metadata["retrieval_score"] for d in docs}
+    # "far" is a lexical-only hit below the floor; "near" is lexical-only but clears it
+    assert set(by_id) == {"dense", "dense2", "near"}
+    assert by_id["near"] == pytest.approx(0.8)
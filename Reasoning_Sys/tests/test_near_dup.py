@@ -0,0 +1,58 @@
+from Near_Dup import _similarity, add_signatures, diversify, simhash
+
+
+class Doc:
+    def __init__(self, text, source="a.pdf", score=None):
+        self.page_content = text
+        self.metadata = {"source": source}
+        if score is not None:
+            self.metadata["retrieval_score"] = score
+
+
+BASE = ("Community acquired pneumonia is treated with amoxicillin in mild cases and with "
+        "a beta lactam plus a macrolide when the patient needs admission to hospital.")
+OTHER = "Gout flares respond to colchicine or NSAIDs; allopurinol is started once the flare has settled down."
+THIRD = "Iron deficiency anaemia is confirmed with a low ferritin and treated with oral ferrous sulfate tablets."
+
+
+def test_simhash_is_stable_and_close_for_small_edits():
+    assert simhash(BASE) == simhash(BASE)
+    edited = BASE.replace("mild cases", "mild disease")
+    assert bin(simhash(BASE) ^ simhash(edited)).count("1") < bin(simhash(BASE) ^ simhash(OTHER)).count("1")
+
+
+def test_similarity_scale():
+    assert _similarity(0, 0) == 1.0
+    assert _similarity(0, (1 << 32) - 1) == 0.0
+
+
+def test_exact_reingest_is_dropped():
+    docs = [Doc(BASE, "a.pdf"), Doc(BASE, "copy-of-a.pdf"), Doc(OTHER, "b.pdf")]
+    add_signatures(docs)
+    kept = diversify(docs)
+    assert [d.metadata["source"] for d in kept] == ["a.pdf", "b.pdf"]
+
+
+def test_source_cap_defers_then_backfills():
+    docs = [Doc(BASE, "a.pdf"), Doc(OTHER, "a.pdf"), Doc(THIRD, "b.pdf")]
+    add_signatures(docs)
+    kept = diversify(docs, max_per_source=1, mmr_lambda=1.0)
+    assert [d.page_content for d in kept] == [BASE, THIRD, OTHER]
+    assert len(diversify(docs, max_per_source=1, limit=2, mmr_lambda=1.0)) == 2
+
+
+def test_lambda_one_keeps_rank_order():
+    docs = [Doc(THIRD), Doc(BASE), Doc(OTHER)]
+    add_signatures(docs)
+    assert diversify(docs, max_per_source=0, mmr_lambda=1.0) == docs
+
+
+def test_mmr_prefers_novel_chunk_over_similar_one():
+    similar = BASE.replace("admission to hospital", "admission to a hospital ward today")
+    docs = [Doc(BASE, score=0.90), Doc(similar, score=0.88), Doc(OTHER, score=0.80)]
+    add_signatures(docs)
+    # similar is past the near-dup threshold only when max_hamming is 0
+    kept = diversify(docs, max_per_source=0, max_hamming=0, mmr_lambda=0.5, limit=2)
+    assert [d.page_content for d in kept] == [BASE, OTHER]
+    kept = diversify(docs, max_per_source=0, max_hamming=0, mmr_lambda=1.0, limit=2)
+    assert [d.page_content for d in kept] == [BASE, similar]
@@ -0,0 +1,23 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("langchain_ollama")
+pytest.importorskip("pydantic")
+
+from Pipeline_Service import PipelineService
+
+
+def test_injected_sync_retriever_is_used_for_async_calls():
+    retriever = lambda *a, **kw: []
+    service = PipelineService(retriever=retriever)
+    assert service.aretriever is None
+    assert service.retriever is retriever
+
+
+def test_lazy_sync_retriever_keeps_native_async_path():
+    pytest.importorskip("langchain_chroma")
+    from Vector_Search import arun_custom_multiquery_retrieval, run_custom_multiquery_retrieval
+
+    service = PipelineService()
+    assert service.retriever is run_custom_multiquery_retrieval  # first sync analyze() builds it
+    assert service.aretriever is arun_custom_multiquery_retrieval
@@ -0,0 +1,65 @@
+import math
+import random
+
+import pytest
+
+from Quantized_Store import QuantizedIndex, migrate_collection
+
+
+class FakeCollection:
+    """Chroma-like collection paged by collection.get(limit, offset, include)."""
+
+    def __init__(self, rows):
+        self.rows = rows  # [(id, vector)]
+
+    def get(self, limit, offset, include=None):
+        page = self.rows[offset : offset + limit]
+        return {
+            "ids": [r[0] for r in page],
+            "embeddings": [r[1] for r in page],
+            "documents": [f"text of {r[0]}" for r in page],
+            "metadatas": [{"source": r[0]} for r in page],
+        }
+
+
+def _exact(rows, query, k, allowed=None):
+    def cos(a, b):
+        return sum(x * y for x, y in zip(a, b)) / math.sqrt(sum(x * x for x in a) * sum(y * y for y in b))
+
+    scored = sorted(((cos(query, vec), chunk_id) for chunk_id, vec in rows if allowed is None or chunk_id in allowed),
+                    reverse=True)
+    return [(chunk_id, sim) for sim, chunk_id in scored[:k]]
+
+
+@pytest.fixture
+def index(tmp_path):
+    rng = random.Random(1)
+    rows = [(f"c{i}", [rng.gauss(0, 1) for _ in range(24)]) for i in range(150)]
+    out = str(tmp_path / "kb")
+    assert migrate_collection(FakeCollection(rows), out, page_size=40) == 150
+    idx = QuantizedIndex(out)
+    yield rows, idx
+    idx.close()
+
+
+def test_rescored_top_k_matches_exact_cosine(index):
+    rows, idx = index
+    query = [x + 0.1 for x in rows[42][1]]
+    # rescoring every row makes the result exact; the default shortlist must still find the best hit
+    hits = idx.search_indices(query, 5, rescore=len(rows))
+    expected = _exact(rows, query, 5)
+    assert [idx.ids[r] for r, _ in hits] == [chunk_id for chunk_id, _ in expected]
+    assert [sim for _, sim in hits] == pytest.approx([sim for _, sim in expected], abs=1e-5)
+    assert idx.search(query, 1)[0][0]["id"] == "c42"
+
+
+def test_filtered_search_and_ids_sidecar(index):
+    rows, idx = index
+    allowed = {f"c{i}" for i in range(1, 150, 2)}
+    query = rows[10][1]
+    hits = idx.search(query, 4, allowed_ids=allowed, rescore=len(rows))
+    assert [chunk["id"] for chunk, _ in hits] == [chunk_id for chunk_id, _ in _exact(rows, query, 4, allowed)]
+    assert hits[0][0]["text"] == f"text of {hits[0][0]['id']}"
+    assert idx.ids == [chunk_id for chunk_id, _ in rows]
+    # the id list and row map loaded by the filtered search count as resident
+    assert idx.memory_bytes() > 150 * idx.code_bytes + 151 * 8
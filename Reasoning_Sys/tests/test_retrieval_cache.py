@@ -0,0 +1,54 @@
+from Retrieval_Cache import RetrievalCache, case_key, restore
+
+SETTINGS = {"num_queries": 3, "k_per_query": 10, "query_mode": "llm"}
+PREDS = [{"disease": "Pneumonia", "prob": 0.6}, {"disease": "Asthma", "prob": 0.2}]
+
+
+def _key(**overrides):
+    case = {"transcription": "Cough and fever for three days.", "symptoms": ["cough", "fever"],
+            "duration": "3 days", "red_flags": [], "predictions": PREDS, "settings": SETTINGS}
+    case.update(overrides)
+    return case_key("kb", case["transcription"], case["symptoms"], case["duration"], case["red_flags"],
+                    case["predictions"], case["settings"])
+
+
+class Doc:
+    def __init__(self, doc_id, score):
+        self.id = doc_id
+        self.metadata = {"retrieval_score": score}
+
+
+def test_key_ignores_order_case_and_spacing():
+    assert _key() == _key(symptoms=["Fever", " cough "], transcription="cough and  fever for three days.")
+    assert _key().startswith("kb:")
+
+
+def test_key_covers_every_query_input():
+    base = _key()
+    assert _key(transcription="Cough, fever and chest pain for three days.") != base
+    assert _key(duration="3 weeks") != base
+    assert _key(symptoms=["cough"]) != base
+    assert _key(red_flags=["hemoptysis"]) != base
+    assert _key(predictions=PREDS[:1]) != base
+    assert _key(settings={**SETTINGS, "k_per_query": 5}) != base
+
+
+def test_roundtrip_and_restore(tmp_path):
+    cache = RetrievalCache(path=str(tmp_path / "r.sqlite"), max_bytes=1 << 20)
+    cache.put(_key(), "kb", "v1", [Doc("a", 0.9), Doc("b", 0.7)])
+    entries = cache.get(_key(), "kb", "v1")
+    assert [e["id"] for e in entries] == ["a", "b"]
+    docs = restore(entries, {"a": Doc("a", None), "b": Doc("b", None)})
+    assert [d.metadata["retrieval_score"] for d in docs] == [0.9, 0.7]
+    assert restore(entries, {"a": Doc("a", None)}) is None
+
+
+def test_version_bump_invalidates_only_that_collection(tmp_path):
+    cache = RetrievalCache(path=str(tmp_path / "r.sqlite"), max_bytes=1 << 20)
+    other_key = case_key("other", "x", ["cough"], None, [], PREDS, SETTINGS)
+    cache.put(_key(), "kb", "v1", [Doc("a", 0.9)])
+    cache.put(other_key, "other", "v1", [Doc("z", 0.8)])
+
+    assert cache.get(_key(), "kb", "v2") is None
+    assert cache.invalidations == 1
+    assert cache.get(other_key, "other", "v1") == [{"id": "z", "retrieval_score": 0.8}]
@@ -32,6 +32,7 @@ class Settings(BaseSettings):
     MODULE3_SCRIPT_PATH: str = "C:/CareFusion-AI/dna_disease_identifier/run_module3.py"
     MODULE4_SCRIPT_PATH: str = "C:/CareFusion-AI/temporal_reasoning/temporal_analysis.py"
     MODULE_CHAT_SCRIPT_PATH: str = "C:/CareFusion-AI/Reasoning_Sys/pipeline/General_Chat.py"
+    REASONING_PIPELINE_DIR: str = "C:/CareFusion-AI/Reasoning_Sys/pipeline"
     
     # Module Specific Python Exe (Optional)
     MODULE3_PYTHON_EXECUTABLE: Optional[str] = None
@@ -0,0 +1,41 @@
+import sys
+from datetime import datetime
+from typing import Any, Dict
+from app.core.config import get_settings
+
+settings = get_settings()
+
+# Latest metrics snapshot reported by each worker module (Module 1, chat, temporal...)
+worker_metrics: Dict[str, Dict[str, Any]] = {}
+
+def ensure_pipeline_path():
+    """Make the Reasoning_Sys pipeline modules importable in the backend process."""
+    if settings.REASONING_PIPELINE_DIR not in sys.path:
+        sys.path.insert(0, settings.REASONING_PIPELINE_DIR)
+
+def record_worker_metrics(module: str, data: Any):
+    if isinstance(data, dict) and isinstance(data.get("metrics"), dict):
+        worker_metrics[module] = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "metrics": data["metrics"],
+        }
+
+def observe_timing(name: str, seconds: Any):
+    """Aggregate a worker-reported duration into the backend-side metrics registry."""
+    if not isinstance(seconds, (int, float)):
+        return
+    try:
+        ensure_pipeline_path()
+        from Metrics import metrics
+        metrics.observe(name, float(seconds))
+    except Exception as e:
+        print(f"Metrics unavailable: {e}")
+
+def get_pipeline_metrics() -> Dict[str, Any]:
+    try:
+        ensure_pipeline_path()
+        from Metrics import metrics
+        backend = metrics.snapshot()
+    except Exception as e:
+        backend = {"error": str(e)}
+    return {"backend": backend, "workers": worker_metrics}
@@ -1,3 +1,4 @@
+import asyncio
 import subprocess
 import time
 import json
@@ -6,10 +7,12 @@ import os
 import aiofiles
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Dict
 from app.core.config import get_settings
 from app.core.database import get_db
+from app.core.pipeline_bridge import record_worker_metrics, observe_timing
 from bson import ObjectId
 import uuid
 
@@ -19,6 +22,10 @@ settings = get_settings()
 # Analysis Job Store (In-memory for now, could be Redis/Mongo)
 analysis_jobs = {}
 
+# Live synthesis token subscribers per analysis (SSE clients)
+stream_subscribers: Dict[str, List[asyncio.Queue]] = {}
+TOKEN_MARKER = "---PIPELINE_TOKEN---"
+
 # Models
 class AIRequest(BaseModel):
     module: str
@@ -54,8 +61,8 @@ class GenomicsSaveRequest(BaseModel):
     category: Optional[str] = "General"
 
 # Helper Functions
-import asyncio
 from concurrent.futures import ThreadPoolExecutor
+import threading
 
 executor = ThreadPoolExecutor(max_workers=5)
 # Global lock to prevent simultaneous heavy AI processes from saturating CPU/GPU
@@ -90,6 +97,78 @@ async def run_script(python_path: str, script_path: str, args: list) -> str:
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(executor, run_script_sync, python_path, script_path, args)
 
+def run_script_streaming_sync(python_path: str, script_path: str, args: list, on_token) -> str:
+    """
+    Like run_script_sync, but reads stdout line by line and hands every
+    TOKEN_MARKER line to `on_token` as soon as the worker prints it.
+    Token lines are stripped from the returned output.
+    """
+    cmd = [python_path, script_path] + args
+    cwd = os.path.dirname(script_path)
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', cwd=cwd, bufsize=1
+    )
+    timed_out = threading.Event()
+
+    def _kill():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(1200, _kill)
+    stderr_lines = []
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(proc.stderr), daemon=True)
+    timer.start()
+    stderr_thread.start()
+
+    output_lines = []
+    try:
+        for line in proc.stdout:
+            if line.startswith(TOKEN_MARKER):
+                try:
+                    on_token(json.loads(line[len(TOKEN_MARKER):]))
+                except Exception:
+                    pass
+            else:
+                output_lines.append(line)
+        proc.wait()
+        stderr_thread.join(timeout=5)
+    finally:
+        timer.cancel()
+
+    output = "".join(output_lines)
+    if timed_out.is_set():
+        raise HTTPException(
+            status_code=504,
+            detail="The clinical reasoning engine is taking longer than expected (1200s limit). "
+                   "Please try again or use text-only input for faster results."
+        )
+    if proc.returncode != 0:
+        stderr = "".join(stderr_lines)
+        error_msg = stderr if stderr.strip() else output
+        print(f"Error running script {script_path}: {error_msg}")
+        raise Exception(f"Script failed: {error_msg}")
+    return output
+
+async def run_script_streaming(python_path: str, script_path: str, args: list, analysis_id: str) -> str:
+    loop = asyncio.get_event_loop()
+
+    def on_token(token: str):
+        loop.call_soon_threadsafe(publish_token, analysis_id, token)
+
+    async with ai_lock:
+        return await loop.run_in_executor(executor, run_script_streaming_sync, python_path, script_path, args, on_token)
+
+def publish_token(analysis_id: str, token: str):
+    job = analysis_jobs.get(analysis_id)
+    if job is not None:
+        job["partial_response"] = job.get("partial_response", "") + token
+    for queue in stream_subscribers.get(analysis_id, []):
+        queue.put_nowait(token)
+
+def close_stream(analysis_id: str):
+    for queue in stream_subscribers.pop(analysis_id, []):
+        queue.put_nowait(None)
+
 def extract_json(output: str, marker_start: str = "---PIPELINE_OUTPUT_START---", marker_end: str = "---PIPELINE_OUTPUT_END---") -> dict:
     marker_pattern = f"{marker_start}(.*?){marker_end}"
     match = re.search(marker_pattern, output, re.DOTALL)
@@ -128,26 +207,72 @@ async def analyze_symptoms(
         input_data = file_path
         is_text = False
 
-    args = [input_data]
+    args = [input_data, "--stream"]
     if is_text: args.append("--text")
     
     analysis_id = str(uuid.uuid4())
-    analysis_jobs[analysis_id] = {"status": "processing", "result": None, "error": None}
+    analysis_jobs[analysis_id] = {"status": "processing", "result": None, "error": None, "partial_response": ""}
 
-    # Run in background to avoid tunnel timeouts
+    # Run in background to avoid tunnel timeouts; synthesis tokens are pushed to /module1/stream
     async def run_in_bg(id, py, script, args):
         try:
-            output = await run_script(py, script, args)
+            output = await run_script_streaming(py, script, args, id)
             data = extract_json(output)
+            record_worker_metrics("module1", data)
+            observe_timing("module1.synthesis.ttft", data.get("synthesis_ttft_s"))
             analysis_jobs[id] = {"status": "completed", "result": data, "error": None}
         except Exception as e:
             print(f"Background analysis failed: {str(e)}")
             analysis_jobs[id] = {"status": "failed", "result": None, "error": str(e)}
+        finally:
+            close_stream(id)
 
     asyncio.create_task(run_in_bg(analysis_id, settings.AI_PYTHON_EXECUTABLE, settings.MODULE1_SCRIPT_PATH, args))
     
     return {"status": "accepted", "analysisId": analysis_id}
 
+@router.get("/module1/stream/{analysis_id}")
+async def stream_symptom_synthesis(analysis_id: str):
+    """
+    Server-Sent Events stream of the Module 1 clinical synthesis.
+    Events: `snapshot` (text generated so far), `token`, then `done` with the final job state.
+    """
+    if analysis_id not in analysis_jobs:
+        raise HTTPException(status_code=404, detail="Analysis ID not found")
+
+    queue: asyncio.Queue = asyncio.Queue()
+    stream_subscribers.setdefault(analysis_id, []).append(queue)
+
+    def sse(event: str, payload: Any) -> str:
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    async def event_source():
+        try:
+            job = analysis_jobs.get(analysis_id, {})
+            yield sse("snapshot", {"text": job.get("partial_response", "")})
+            if job.get("status") == "processing":
+                while True:
+                    try:
+                        token = await asyncio.wait_for(queue.get(), timeout=15)
+                    except asyncio.TimeoutError:
+                        yield ": keep-alive\n\n"
+                        continue
+                    if token is None:
+                        break
+                    yield sse("token", {"token": token})
+            job = analysis_jobs.get(analysis_id, {})
+            yield sse("done", {"status": job.get("status"), "result": job.get("result"), "error": job.get("error")})
+        finally:
+            subscribers = stream_subscribers.get(analysis_id)
+            if subscribers and queue in subscribers:
+                subscribers.remove(queue)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.get("/status/{analysis_id}")
 async def get_analysis_status(analysis_id: str):
     if analysis_id not in analysis_jobs:
@@ -243,6 +368,7 @@ async def analyze_temporal(
         try:
             output = await run_script(py, script, args)
             data = extract_json(output, "---TEMPORAL_OUTPUT_START---", "---TEMPORAL_OUTPUT_END---")
+            record_worker_metrics("module4", data)
             analysis_jobs[id] = {"status": "completed", "result": data, "error": None}
         except Exception as e:
             print(f"Temporal analysis failed: {str(e)}")
@@ -282,6 +408,7 @@ async def general_chat(
         try:
             output = await run_script(py, script, args)
             data = extract_json(output)
+            record_worker_metrics("chat", data)
             analysis_jobs[id] = {"status": "completed", "result": data, "error": None}
             
             # Auto-save clinical record
@@ -1,5 +1,6 @@
 from fastapi import APIRouter
 from app.core.config import get_settings
+from app.core.pipeline_bridge import get_pipeline_metrics
 
 router = APIRouter()
 settings = get_settings()
@@ -11,3 +12,7 @@ def health_check():
         "app_name": settings.APP_NAME,
         "debug": settings.DEBUG
     }
+
+@router.get("/metrics")
+def pipeline_metrics():
+    return get_pipeline_metrics()
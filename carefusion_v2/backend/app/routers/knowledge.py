@@ -4,12 +4,21 @@ import shutil
 from pathlib import Path
 from typing import List
 from app.core.config import get_settings
+from app.core.pipeline_bridge import ensure_pipeline_path
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
 import logging
 
+ensure_pipeline_path()
+from MY_Model import get_embedding_model, EMBEDDING_MODEL_NAME
+from Knowledge_Store import read_index_info, record_index_update
+from Lexical_Index import write_segment
+from Near_Dup import add_signatures
+from Metadata_Filter import FacetIndex, tag_pages
+from Parent_Store import CHILD_CHUNK_OVERLAP, CHILD_CHUNK_SIZE, SMALL_TO_BIG_ENABLED, ParentStore, make_children
+from Ingest_Manifest import IngestManifest, chunk_ids_for, config_key, file_digest, remove_file_chunks, source_name
+
 router = APIRouter()
 settings = get_settings()
 logger = logging.getLogger("knowledge_router")
@@ -17,17 +26,24 @@ logger = logging.getLogger("knowledge_router")
 # --- CONFIG ---
 PERSIST_DIR = r"C:\CareFusion-AI\vector of external\chroma_db_bge_m3"
 COLLECTION_NAME = "daily_knowledge"
-EMBED_MODEL = "bge-m3"
+EMBED_MODEL = EMBEDDING_MODEL_NAME
 UPLOAD_DIR = r"C:\CareFusion-AI\External_knowledger"
+# Must match Add_New_doc.py (same folder, same manifest) so neither re-embeds the other's files
+CHUNK_SIZE = 4200
+CHUNK_OVERLAP = 800
+CHUNK_CONFIG = config_key(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    small_to_big=[CHILD_CHUNK_SIZE, CHILD_CHUNK_OVERLAP] if SMALL_TO_BIG_ENABLED else None,
+    embedding_model=EMBED_MODEL,
+)
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 def get_embeddings():
-    return OllamaEmbeddings(
-        model=EMBED_MODEL,
-        base_url="http://127.0.0.1:11434"
-    )
+    # Pooled client shared with the rest of the pipeline
+    return get_embedding_model(EMBED_MODEL)
 
 @router.post("/upload")
 async def upload_medical_document(file: UploadFile = File(...)):
@@ -53,27 +69,68 @@ async def upload_medical_document(file: UploadFile = File(...)):
             embedding_function=embeddings,
         )
 
+        # Incremental: skip identical re-uploads, replace the chunks of a changed file
+        manifest = IngestManifest(PERSIST_DIR, COLLECTION_NAME)
+        facets = FacetIndex(PERSIST_DIR, COLLECTION_NAME)
+        parent_store = ParentStore(PERSIST_DIR, COLLECTION_NAME) if SMALL_TO_BIG_ENABLED else None
+        file_hash = file_digest(file_path)
+        state, entry = manifest.plan(file_path, file_hash, CHUNK_CONFIG)
+        if state == "duplicate":
+            # the existing chunks serve this path too (see Ingest_Manifest.remove_file_chunks)
+            manifest.record_duplicate(file_path, entry)
+        if state in ("unchanged", "duplicate"):
+            return {
+                "status": state,
+                "filename": file.filename,
+                "chunks_added": 0,
+                "total_vectors": vectorstore._collection.count(),
+                "index_version": read_index_info(PERSIST_DIR, COLLECTION_NAME).get("version"),
+            }
+        chunks_removed = 0
+        if state == "modified":
+            chunks_removed = remove_file_chunks(
+                vectorstore, facets, entry, PERSIST_DIR, COLLECTION_NAME, parent_store, manifest
+            )
+
+        # same `source` form as Add_New_doc / build_index (absolute path)
+        source = source_name(file_path)
         loader = PyPDFLoader(file_path)
         pages = loader.load()
+        tag_pages(pages, source)
         
         splitter = RecursiveCharacterTextSplitter(
-            chunk_size=4200,
-            chunk_overlap=800,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
         )
         chunks = splitter.split_documents(pages)
 
         # Enrich metadata
         for chunk in chunks:
-            chunk.metadata["source"] = file.filename
+            chunk.metadata["source"] = source
             chunk.metadata["ingest_mode"] = "admin_portal"
+        if parent_store is not None:
+            chunks = make_children(chunks, parent_store)
+        add_signatures(chunks)
+
+        # Deterministic ids: a retried upload upserts instead of duplicating
+        # (in the BM25 index too: a re-written id supersedes its older postings)
+        chunk_ids = chunk_ids_for(file_hash, CHUNK_CONFIG, len(chunks))
+        facets.delete(chunk_ids)
+        vectorstore.add_documents(chunks, ids=chunk_ids)
+        write_segment(PERSIST_DIR, COLLECTION_NAME, chunk_ids, [c.page_content for c in chunks])
+        facets.add(chunk_ids, [c.metadata for c in chunks])
+        # Bump the index version so warm retrievers in the workers reload, then
+        # record the file: a failure before this point leaves it to be re-ingested
+        index_version = record_index_update(vectorstore, PERSIST_DIR, COLLECTION_NAME, EMBED_MODEL)
+        manifest.record(file_path, file_hash, CHUNK_CONFIG, source, chunk_ids)
 
-        vectorstore.add_documents(chunks)
-        
         return {
             "status": "success",
             "filename": file.filename,
             "chunks_added": len(chunks),
-            "total_vectors": vectorstore._collection.count()
+            "chunks_removed": chunks_removed,
+            "total_vectors": vectorstore._collection.count(),
+            "index_version": index_version,
         }
     except Exception as e:
         logger.error(f"Embedding failed: {e}")
@@ -154,6 +154,33 @@ const DoctorDashboard = () => {
         }
     };
 
+    // Upsert a chat message by id (used when a streamed synthesis is replaced by the final result)
+    const upsertMessage = (msg: Message) => {
+        setMessages(prev => prev.some(m => m.id === msg.id) ? prev.map(m => m.id === msg.id ? msg : m) : [...prev, msg]);
+    };
+
+    // Live Module 1 synthesis over SSE. Polling still delivers the final structured result.
+    const openSynthesisStream = (analysisId: string, messageId: string): EventSource | null => {
+        if (typeof EventSource === 'undefined') return null;
+        const source = new EventSource(`${getApiBase()}${API_ENDPOINTS.AI}/module1/stream/${analysisId}`);
+        const setText = (update: (text: string) => string) => {
+            setMessages(prev => prev.some(m => m.id === messageId)
+                ? prev.map(m => m.id === messageId ? { ...m, text: update(m.text) } : m)
+                : [...prev, { id: messageId, type: 'bot', text: update('') }]);
+        };
+        source.addEventListener('snapshot', (e) => {
+            const { text } = JSON.parse((e as MessageEvent).data);
+            if (text) setText(() => text);
+        });
+        source.addEventListener('token', (e) => {
+            const { token } = JSON.parse((e as MessageEvent).data);
+            setText(text => text + token);
+        });
+        source.addEventListener('done', () => source.close());
+        source.onerror = () => source.close();
+        return source;
+    };
+
     const handleSendMessage = async () => {
         if (!inputText.trim()) return;
 
@@ -187,6 +214,8 @@ const DoctorDashboard = () => {
                 const analysisId = data.analysisId;
 
                 console.log(`📡 Analysis accepted. ID: ${analysisId}. Starting polling...`);
+                const streamMsgId = `stream-${analysisId}`;
+                const stream = openSynthesisStream(analysisId, streamMsgId);
 
                 while (!completed) {
                     await new Promise(r => setTimeout(r, 5000)); // Poll every 5s
@@ -203,15 +232,17 @@ const DoctorDashboard = () => {
 
                         if (statusData.status === 'completed') {
                             completed = true;
+                            stream?.close();
                             const botMsg: Message = {
-                                id: (Date.now() + 1).toString(),
+                                id: streamMsgId,
                                 type: 'bot',
                                 text: statusData.result?.ai_response && statusData.result.ai_response !== "" ? statusData.result.ai_response : "Neural reasoning complete. Structured analysis below.",
                                 richData: statusData.result
                             };
-                            setMessages(prev => [...prev, botMsg]);
+                            upsertMessage(botMsg);
                         } else if (statusData.status === 'failed') {
                             completed = true;
+                            stream?.close();
                             throw new Error(statusData.error || "Analysis failed on engine.");
                         }
                     }
@@ -296,6 +327,8 @@ const DoctorDashboard = () => {
                 const analysisId = data.analysisId;
 
                 console.log(`🎤 Audio Analysis accepted. ID: ${analysisId}. Starting polling...`);
+                const streamMsgId = `stream-${analysisId}`;
+                const stream = openSynthesisStream(analysisId, streamMsgId);
 
                 while (!completed) {
                     await new Promise(r => setTimeout(r, 5000));
@@ -312,15 +345,17 @@ const DoctorDashboard = () => {
 
                         if (statusData.status === 'completed') {
                             completed = true;
+                            stream?.close();
                             const botMsg: Message = {
-                                id: (Date.now() + 1).toString(),
+                                id: streamMsgId,
                                 type: 'bot',
                                 text: statusData.result?.ai_response && statusData.result.ai_response !== "" ? statusData.result.ai_response : "Neural reasoning complete. Structured analysis below.",
                                 richData: statusData.result
                             };
-                            setMessages(prev => [...prev, botMsg]);
+                            upsertMessage(botMsg);
                         } else if (statusData.status === 'failed') {
                             completed = true;
+                            stream?.close();
                             throw new Error(statusData.error || "Vocal analysis failed.");
                         }
                     }
@@ -426,10 +426,13 @@ class TemporalAnalyzer:
         try:
             # Dynamically import to avoid circular dependencies
             import sys
-            sys.path.append('C:/CareFusion-AI')
-            from Reasoning_Sys.pipeline.MY_Model import get_chat_model
+            pipeline_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Reasoning_Sys', 'pipeline')
+            if pipeline_dir not in sys.path:
+                sys.path.append(pipeline_dir)
+            from MY_Model import get_chat_model
             
-            llm = get_chat_model(temperature=0.3, max_tokens=1024)
+            # Unchanged timeline + observation renders the same prompt: reuse the cached narrative
+            llm = get_chat_model(temperature=0.3, max_tokens=1024, cache=True)
             
             # Construct the prompt
             prompt = f"""
@@ -506,6 +509,10 @@ if __name__ == "__main__":
     
     try:
         results = temporal_analysis(user_id, observation)
+
+        # Pooled LLM client counters (only present if the narrative LLM was used)
+        if "MY_Model" in sys.modules:
+            results["metrics"] = sys.modules["MY_Model"].get_client_metrics()
         
         # Output structured JSON
         print("---TEMPORAL_OUTPUT_START---")